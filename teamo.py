@@ -1,10 +1,17 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from typing import Optional, Union, Sequence, Tuple, Dict, Any, List
+from typing import Optional, Union, Sequence, Iterable, Iterator, Tuple, Dict, Set, Any, List
 import sqlite3
 import json
 import pymysql
+import gzip
+import argparse
+from contextlib import contextmanager
+from collections import OrderedDict, Counter
+from array import array
+from bisect import bisect_left
+import itertools
 import random
 import time
 import datetime
@@ -14,15 +21,176 @@ import datetime
 def shouldNotHappen(message: str) -> None:
     raise Exception(message)
 
+# 将序列（可以是生成器）按固定大小逐块切出 用于分批构造 IN (...) 查询
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# 点/边的label与data的LRU缓存 键为 (表名, 列名, id)
+# 只缓存经由Teamo读取的值 绕过Teamo直接修改数据库不会使缓存失效
+class PropertyCache:
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            shouldNotHappen('缓存容量必须是正整数')
+        self._capacity = capacity
+        self._items = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    # 命中时返回 (True, 值) 未命中返回 (False, None)
+    def get(self, key: Tuple[str, str, int]) -> Tuple[bool, Any]:
+        if key in self._items:
+            self._items.move_to_end(key)
+            self._hits += 1
+            return (True, self._items[key])
+        self._misses += 1
+        return (False, None)
+
+    def put(self, key: Tuple[str, str, int], value: Any) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self._capacity:
+            self._items.popitem(last=False)
+
+    def discard(self, key: Tuple[str, str, int]) -> None:
+        self._items.pop(key, None)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return { 'capacity': self._capacity, 'size': len(self._items), 'hits': self._hits, 'misses': self._misses }
+
+
+# has(key, predicate)所用的谓词 与Gremlin的P相同：P.eq(29) P.gt(30) P.within('lop', 'ripple') ...
+# 只比较同一种类型的值（数值、字符串、布尔各自比较） key不存在或值为null时不满足任何谓词
+class P:
+
+    OPERATORS = ('eq', 'neq', 'lt', 'lte', 'gt', 'gte', 'within', 'without')
+
+    def __init__(self, operator: str, *values: Any):
+        if operator not in P.OPERATORS:
+            shouldNotHappen('不支持的谓词')
+        if len(values) == 0:
+            shouldNotHappen('谓词需要至少一个值')
+        for value in values:
+            if P._kind(value) is None:
+                shouldNotHappen('谓词的值只能是数值、字符串或布尔')
+        self.operator = operator
+        self.values = values
+
+    @staticmethod
+    def eq(value: Any) -> 'P':
+        return P('eq', value)
+
+    @staticmethod
+    def neq(value: Any) -> 'P':
+        return P('neq', value)
+
+    @staticmethod
+    def lt(value: Any) -> 'P':
+        return P('lt', value)
+
+    @staticmethod
+    def lte(value: Any) -> 'P':
+        return P('lte', value)
+
+    @staticmethod
+    def gt(value: Any) -> 'P':
+        return P('gt', value)
+
+    @staticmethod
+    def gte(value: Any) -> 'P':
+        return P('gte', value)
+
+    @staticmethod
+    def within(*values: Any) -> 'P':
+        return P('within', *values)
+
+    @staticmethod
+    def without(*values: Any) -> 'P':
+        return P('without', *values)
+
+    # 值的类型 bool必须先于int判断
+    @staticmethod
+    def _kind(value: Any) -> Optional[str]:
+        if isinstance(value, bool):
+            return 'boolean'
+        if isinstance(value, (int, float)):
+            return 'number'
+        if isinstance(value, str):
+            return 'string'
+        return None
+
+    @staticmethod
+    def _compare(operator: str, x: Any, value: Any) -> bool:
+        if P._kind(x) != P._kind(value):
+            return False
+        if operator == 'eq':
+            return x == value
+        if operator == 'lt':
+            return x < value
+        if operator == 'lte':
+            return x <= value
+        if operator == 'gt':
+            return x > value
+        return x >= value
+
+    # 在Python中判断解析后的data（字典）是否满足 has(key, self)
+    def test(self, properties: Dict[str, Any], key: str) -> bool:
+        x = properties.get(key)
+        if x is None:
+            return False
+        if self.operator in ('within', 'without'):
+            matched = any(P._compare('eq', x, value) for value in self.values)
+            return matched if self.operator == 'within' else not matched
+        if self.operator == 'neq':
+            return not P._compare('eq', x, self.values[0])
+        return P._compare(self.operator, x, self.values[0])
+
+
 # 一个图 就是一个数据库 图只是抽象表现 内在结构是关系型数据库
 # 这个图有图这种数据结构的常用API实现
 # 仅考虑简单图（尽管似乎可以实现多重图）
 class Teamo:
     
+    # 批量加边时 每次executemany插入的行数
     ADD_EDGE_BATCH = 1000
+    # 批量加点时 每次executemany插入的行数
+    ADD_VERTEX_BATCH = 10000
+    # 单次 IN (...) 查询中id个数的上限（SQLite旧版本绑定参数上限为999）
+    QUERY_BATCH = 500
+    # MySQL属性索引的生成列中字符串值的最大字节数（utf8mb4下191个字符）
+    PROPERTY_INDEX_BYTES = 764
+    # MySQL中Label.name的最大字节数（utf8mb4下191个字符）
+    LABEL_NAME_BYTES = 764
+    # init()默认创建的二级索引 (表, 列, ...)
+    # Edge上以tail/head为首列的两个索引即点为中心(vertex-centric)的索引 见RANK_COLUMNS
+    # 它们同时承担按tail/head查找（_has_index只看首列） 因此不再单独建Edge(tail)与Edge(head) 删除后按tail/head查找退回沿链表
+    DEFAULT_INDEXES = [ ('Edge', 'tail', 'label', 'out_rank'), ('Edge', 'head', 'label', 'in_rank'),
+        ('Edge', 'label'), ('Vertex', 'label') ]
+    # 出边链表与入边链表所用到的列：(Vertex上的链表头, Edge上的后继指针, Edge上链表所属点的列)
+    CHAIN_COLUMNS = { 'out': ('out_edge', 'forward', 'tail'), 'in': ('in_edge', 'backward', 'head') }
+    # 边在出边链表与入边链表中的位次：(Edge上链表所属点的列, 位次列) 同一链表中位次越小越靠前
+    # 新边总是插在链表头部 位次取旧链表头的位次减一 删除边不改变其余边的先后 因此位次不需要重排
+    # 有 (所属点, label, 位次) 索引时 一个点某些label的邻接边是索引上的范围扫描 不必走完整个链表
+    RANK_COLUMNS = { 'out': ('tail', 'out_rank'), 'in': ('head', 'in_rank') }
+    # 存储布局：linked为十字链表；clustered另外按 (tail, label, id)/(head, label, id) 聚簇存放邻接关系
+    LAYOUTS = ('linked', 'clustered')
+    # clustered布局的两张邻接表：(表名, 所属点的列, 另一端点的列)
+    ADJACENCY_TABLES = { 'out': ('OutAdj', 'tail', 'head'), 'in': ('InAdj', 'head', 'tail') }
 
     # 构造函数做的事是创建一个空图
-    def __init__(self, conn, *, db: str):
+    # cache_size > 0 时为label与data开启容量为cache_size的LRU缓存（见PropertyCache）
+    # layout为存储布局（见LAYOUTS） None表示由已有的表判断 没有图时为linked
+    def __init__(self, conn, *, db: str, cache_size: int = 0, layout: Optional[str] = None):
         # 判断参数合法性
         db_api_2_methods = [ 'close', 'commit', 'rollback', 'cursor' ]
         for method in db_api_2_methods:
@@ -38,20 +206,178 @@ class Teamo:
             self._ph = '%s'
         else:
             shouldNotHappen('不支持此数据库')
+        if layout is not None and layout not in Teamo.LAYOUTS:
+            shouldNotHappen('不支持此存储布局')
+        self._layout = layout
+        # 二级索引的缓存 [(索引名, 表名, (列名, ...)), ...]，None表示尚未从数据库读取
+        self._indexes = None
+        # 写入批次的状态：嵌套深度、每多少次修改自动提交一次(None为退出批次时才提交)、自上次提交以来的修改次数
+        self._batch_depth = 0
+        self._batch_commit_every = None
+        self._batch_pending = 0
+        # label与data的缓存 None表示不缓存
+        self._cache = PropertyCache(cache_size) if cache_size > 0 else None
+        # label字典 {label: 编码} 与 {编码: label}，None表示尚未从Label表读取
+        self._label_codes = None
+        self._label_names = None
 
     def get_db_name(self):
         return str(self._base_db)
 
+    # 图的存储布局 'linked' 或 'clustered'
+    def get_layout(self) -> str:
+        if self._layout is None:
+            self._layout = 'clustered' if self._has_table('OutAdj') else 'linked'
+        return self._layout
+
+    def _has_table(self, table: str) -> bool:
+        c = self._conn.cursor()
+        if self._base_db == 'SQLite3':
+            c.execute('''SELECT COUNT(*) FROM sqlite_master WHERE `type`='table' AND `name`={ph}'''.format(ph=self._ph), (table,))
+        else:
+            c.execute(
+                '''SELECT COUNT(*) FROM information_schema.TABLES
+                WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME`={ph}'''.format(ph=self._ph),
+                (table,)
+            )
+        (found,) = c.fetchone()
+        return found > 0
+
+    def _is_clustered(self) -> bool:
+        return self.get_layout() == 'clustered'
+
     def get_connection(self):
         return self._conn
+
+    ##########################################
+    #          write batch (transaction)     #
+    ##########################################
+
+    # with graph.batch(commit_every=N): 中的所有修改（加点加边、设label/data、drop）合并到事务中
+    # commit_every为None时整个批次只在退出时提交一次，否则每N次修改自动提交一次
+    # 出现异常时回滚尚未提交的修改并重新抛出（已经自动提交的部分不会回滚）
+    # 批次可以嵌套 内层批次并入最外层批次
+    @contextmanager
+    def batch(self, commit_every: Optional[int] = None):
+        if commit_every is not None and commit_every <= 0:
+            shouldNotHappen('commit_every必须是正整数')
+        if self._batch_depth > 0:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+            return
+        self._batch_depth = 1
+        self._batch_commit_every = commit_every
+        self._batch_pending = 0
+        self._begin()
+        try:
+            yield self
+        except BaseException:
+            self._conn.rollback()
+            # 回滚后缓存中可能有已经不存在的修改
+            self.clear_cache()
+            raise
+        else:
+            self._conn.commit()
+        finally:
+            self._batch_depth = 0
+            self._batch_commit_every = None
+            self._batch_pending = 0
+
+    def in_batch(self) -> bool:
+        return self._batch_depth > 0
+
+    # 返回缓存的容量、大小与命中/未命中次数 没有开启缓存时返回None
+    def cache_stats(self) -> Optional[Dict[str, int]]:
+        if self._cache is None:
+            return None
+        return self._cache.stats()
+
+    # 清空label与data的缓存 同时丢弃内存中的label字典（下次使用时重新读取）
+    def clear_cache(self) -> None:
+        if self._cache is not None:
+            self._cache.clear()
+        self._label_codes = None
+        self._label_names = None
+
+    # 使某个点/边的label与data缓存失效
+    def _invalidate(self, table: str, id_: int) -> None:
+        if self._cache is not None:
+            self._cache.discard((table, 'label', id_))
+            self._cache.discard((table, 'data', id_))
+            self._cache.discard((table, 'json', id_))
+
+    # 显式开启事务 SQLite3的连接若处于autocommit模式(isolation_level=None)不会自动开启事务
+    def _begin(self) -> None:
+        if self._base_db == 'SQLite3' and not getattr(self._conn, 'in_transaction', True):
+            self._conn.cursor().execute('BEGIN')
+
+    # 所有修改操作结束时调用 不在批次中则立即提交；在批次中则累计修改次数，达到commit_every时提交
+    def _commit(self, mutations: int = 1) -> None:
+        if self._batch_depth == 0:
+            self._conn.commit()
+            return
+        self._batch_pending += mutations
+        if self._batch_commit_every is not None and self._batch_pending >= self._batch_commit_every:
+            self._conn.commit()
+            self._batch_pending = 0
+            self._begin()
+
+    # 生成n个以逗号分隔的占位符 用于 IN (...)
+    def _placeholders(self, n: int) -> str:
+        return ','.join([ self._ph ] * n)
+
+    # 执行查询 并用fetchmany每次取size行、逐行产出 而不是fetchall一次取出全部结果
+    # 生成器在第一次取值时才执行查询
+    def _iter_query(self, sql: str, args: Sequence[Any] = (), size: int = QUERY_BATCH) -> Iterator[Tuple]:
+        c = self._conn.cursor()
+        c.execute(sql, args)
+        rows = c.fetchmany(size)
+        while rows:
+            for row in rows:
+                yield row
+            rows = c.fetchmany(size)
     
     # ----------------- 以下是图常用API ----------------- #
 
-    # 创建图
-    def init(self):
+    # 创建图 with_index为True时同时创建DEFAULT_INDEXES中的二级索引
+    # （大批量导入时可先不建索引 导入完成后再调用create_index）
+    def init(self, *, with_index: bool = True):
         c = self._conn.cursor()
+        if self._layout is None:
+            self._layout = 'linked'
+        self._create_edge_table('Edge')
+        if self._is_clustered():
+            self._create_adjacency_tables()
         c.execute('''
-            CREATE TABLE `Edge` (
+            CREATE TABLE `Vertex` (
+                `id`	INTEGER PRIMARY KEY NOT NULL UNIQUE /*!40101 AUTO_INCREMENT */,
+                `in_edge`	INTEGER,
+                `out_edge`	INTEGER,
+                `label`   INTEGER,
+                `data`	TEXT,
+                `out_degree`	INTEGER NOT NULL DEFAULT 0,
+                `in_degree`	INTEGER NOT NULL DEFAULT 0
+            );
+        ''')
+        self._create_label_table()
+        self._create_degree_table()
+        self._conn.commit()
+        self._indexes = []
+        if with_index:
+            for (table, *columns) in Teamo.DEFAULT_INDEXES:
+                # clustered布局中按点取边走邻接表的主键 Edge上不再需要tail/head索引
+                if self._is_clustered() and table == 'Edge' and columns[0] in ('tail', 'head'):
+                    continue
+                self.create_index(table, *columns)
+
+    # 边表的建表语句 compact()重建边表时也用它
+    def _create_edge_table(self, name: str) -> None:
+        c = self._conn.cursor()
+        c.execute('''
+            CREATE TABLE `{}` (
                 `id`	INTEGER PRIMARY KEY NOT NULL UNIQUE /*!40101 AUTO_INCREMENT */,
                 `tail`	INTEGER NOT NULL,
                 `head`	INTEGER NOT NULL,
@@ -59,27 +385,635 @@ class Teamo:
                 `forward`	INTEGER,
                 `revback`	INTEGER,
                 `revfor`	INTEGER,
-                `label`   TEXT,
-                `data`	TEXT
+                `label`   INTEGER,
+                `data`	TEXT,
+                `out_rank`	INTEGER,
+                `in_rank`	INTEGER
             );
-        ''')
-        c.execute('''
-            CREATE TABLE `Vertex` (
-                `id`	INTEGER PRIMARY KEY NOT NULL UNIQUE /*!40101 AUTO_INCREMENT */,
-                `in_edge`	INTEGER,
-                `out_edge`	INTEGER,
-                `label`   TEXT,
-                `data`	TEXT
-            );
-        ''')
-        self._conn.commit()
+        '''.format(name))
 
     # [!] Warning: 删表跑路 后果很严重
     def destroy(self):
         c = self._conn.cursor()
         c.execute("DROP TABLE IF EXISTS `Vertex`;")
         c.execute("DROP TABLE IF EXISTS `Edge`;")
+        c.execute("DROP TABLE IF EXISTS `OutAdj`;")
+        c.execute("DROP TABLE IF EXISTS `InAdj`;")
+        c.execute("DROP TABLE IF EXISTS `Label`;")
+        c.execute("DROP TABLE IF EXISTS `Degree`;")
+        self._conn.commit()
+        self._indexes = None
+        self.clear_cache()
+
+    ##########################################
+    #           secondary indexes            #
+    ##########################################
+
+    # 列出Vertex与Edge上的所有二级索引 [(索引名, 表名, (列名, ...)), ...]
+    def list_indexes(self) -> List[Tuple[str, str, Tuple[str, ...]]]:
+        if self._indexes is not None:
+            return list(self._indexes)
+        c = self._conn.cursor()
+        columns = {}
+        if self._base_db == 'SQLite3':
+            # sql为NULL的是主键/UNIQUE约束自动生成的索引
+            c.execute(
+                '''SELECT `name`, `tbl_name` FROM sqlite_master
+                WHERE `type`='index' AND `sql` IS NOT NULL AND `tbl_name` IN ('Vertex', 'Edge')'''
+            )
+            for (name, table) in c.fetchall():
+                c.execute('''PRAGMA index_info(`{}`)'''.format(name))
+                columns[(name, table)] = [ row[2] for row in sorted(c.fetchall()) ]
+        else:
+            c.execute(
+                '''SELECT `INDEX_NAME`, `TABLE_NAME`, `COLUMN_NAME` FROM information_schema.STATISTICS
+                WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME` IN ('Vertex', 'Edge') AND `INDEX_NAME`<>'PRIMARY'
+                ORDER BY `INDEX_NAME`, `SEQ_IN_INDEX`'''
+            )
+            for (name, table, column) in c.fetchall():
+                columns.setdefault((name, table), []).append(column)
+        # 属性索引（见create_property_index）的列记为 data.key
+        for (name, table) in columns:
+            if name.startswith('pidx_{}_'.format(table)):
+                columns[(name, table)] = [ 'data.' + name[len('pidx_{}_'.format(table)):] ]
+        # 排除id上UNIQUE约束产生的索引
+        self._indexes = [ (name, table, tuple(cols)) for ((name, table), cols) in sorted(columns.items())
+            if tuple(cols) != ('id',) ]
+        return list(self._indexes)
+
+    # 在表的一列或多列上创建二级索引 返回索引名 已存在同样的索引时直接返回其名字
+    def create_index(self, table: str, *columns: str) -> str:
+        self._check_index_target(table, columns)
+        for (name, table_, columns_) in self.list_indexes():
+            if table_ == table and columns_ == columns:
+                return name
+        name = 'idx_{}_{}'.format(table, '_'.join(columns))
+        # MySQL中TEXT列的索引必须指定前缀长度（label是整数编码 不需要）
+        column_sql = ', '.join(
+            '`{}`(191)'.format(col) if self._base_db == 'MySQL' and col == 'data' else '`{}`'.format(col)
+            for col in columns
+        )
+        c = self._conn.cursor()
+        c.execute('''CREATE INDEX `{}` ON `{}` ({})'''.format(name, table, column_sql))
+        self._conn.commit()
+        self._indexes.append((name, table, columns))
+        return name
+
+    # 删除表上指定列的二级索引 索引不存在时什么也不做
+    def drop_index(self, table: str, *columns: str) -> None:
+        self._check_index_target(table, columns)
+        c = self._conn.cursor()
+        for (name, table_, columns_) in self.list_indexes():
+            if table_ == table and columns_ == columns:
+                if self._base_db == 'SQLite3':
+                    c.execute('''DROP INDEX `{}`'''.format(name))
+                else:
+                    c.execute('''DROP INDEX `{}` ON `{}`'''.format(name, table))
+                self._indexes.remove((name, table_, columns_))
+        self._conn.commit()
+
+    # 在data中的顶层属性key上建立索引 返回索引名 g.V().has(key, ...)可以借助它按属性值查找
+    # SQLite3为表达式索引 json_extract(data, '$."key"')；MySQL为生成列 prop_key 上的普通索引
+    # MySQL的生成列是VARBINARY 按字节比较 与JSON中字符串的比较一致（VARCHAR按排序规则比较 默认不区分大小写）
+    # 只保存不超过PROPERTY_INDEX_BYTES字节的字符串值 其他值（数值、更长的字符串）为NULL 比较时改用JSON路径
+    # 索引由数据库随data的修改自动维护
+    def create_property_index(self, table: str, key: str) -> str:
+        self._check_property_index_target(table, key)
+        for (name, table_, columns_) in self.list_indexes():
+            if table_ == table and columns_ == ('data.' + key,):
+                return name
+        name = 'pidx_{}_{}'.format(table, key)
+        path = self._json_path(key)
+        c = self._conn.cursor()
+        if self._base_db == 'SQLite3':
+            c.execute('''CREATE INDEX `{}` ON `{}` (json_extract(`data`, '{}'))'''.format(name, table, path))
+        else:
+            column = Teamo._property_column(key)
+            value_sql = "JSON_UNQUOTE(JSON_EXTRACT(`data`, '{}'))".format(path)
+            c.execute(
+                '''ALTER TABLE `{}` ADD COLUMN `{}` VARBINARY({})
+                GENERATED ALWAYS AS (IF(JSON_TYPE(JSON_EXTRACT(`data`, '{}'))='STRING' AND LENGTH({})<={},
+                    {}, NULL)) VIRTUAL'''.format(table, column, Teamo.PROPERTY_INDEX_BYTES, path, value_sql,
+                    Teamo.PROPERTY_INDEX_BYTES, value_sql)
+            )
+            c.execute('''CREATE INDEX `{}` ON `{}` (`{}`)'''.format(name, table, column))
         self._conn.commit()
+        self._indexes.append((name, table, ('data.' + key,)))
+        return name
+
+    # 删除属性索引 不存在时什么也不做
+    def drop_property_index(self, table: str, key: str) -> None:
+        self._check_property_index_target(table, key)
+        if not self._has_property_index(table, key):
+            return
+        name = 'pidx_{}_{}'.format(table, key)
+        c = self._conn.cursor()
+        if self._base_db == 'SQLite3':
+            c.execute('''DROP INDEX `{}`'''.format(name))
+        else:
+            c.execute('''DROP INDEX `{}` ON `{}`'''.format(name, table))
+            c.execute('''ALTER TABLE `{}` DROP COLUMN `{}`'''.format(table, Teamo._property_column(key)))
+        self._conn.commit()
+        self._indexes.remove((name, table, ('data.' + key,)))
+
+    # 列出所有属性索引 [(索引名, 表名, key), ...]
+    def list_property_indexes(self) -> List[Tuple[str, str, str]]:
+        return [ (name, table, columns[0][len('data.'):]) for (name, table, columns) in self.list_indexes()
+            if columns[0].startswith('data.') ]
+
+    def _has_property_index(self, table: str, key: str) -> bool:
+        return self._has_index(table, 'data.' + key)
+
+    # MySQL中属性索引所用生成列的列名
+    @staticmethod
+    def _property_column(key: str) -> str:
+        return 'prop_' + key
+
+    def _check_property_index_target(self, table: str, key: str) -> None:
+        if table not in ('Vertex', 'Edge'):
+            shouldNotHappen('只能在Vertex或Edge上建立索引')
+        # key会成为索引名的一部分
+        if not key.isidentifier():
+            shouldNotHappen('属性索引的key只能由字母、数字与下划线组成')
+
+    def _check_index_target(self, table: str, columns: Sequence[str]) -> None:
+        if table not in ('Vertex', 'Edge'):
+            shouldNotHappen('只能在Vertex或Edge上建立索引')
+        if len(columns) == 0 or not all(col.isidentifier() for col in columns):
+            shouldNotHappen('不合法的索引列')
+
+    # 表上是否有以column为首列的索引（可用于按column查找）
+    def _has_index(self, table: str, column: str) -> bool:
+        return any(table_ == table and columns[0] == column for (_, table_, columns) in self.list_indexes())
+
+    ##########################################
+    #            label dictionary            #
+    ##########################################
+
+    # Vertex与Edge的label列只保存Label表中的整数编码（NULL表示没有label） 编码从1开始
+    # 内存中保存整个字典 label()/hasLabel()等仍然使用字符串 编码与解码对遍历API透明
+    # 同一个数据库可能被多个Teamo实例修改 字典中找不到时先重新读取一次
+    # MySQL默认的排序规则不区分大小写且忽略末尾空格 'person'与'Person'会违反UNIQUE 所以name按字节保存与比较
+    def _create_label_table(self) -> None:
+        c = self._conn.cursor()
+        name_type = 'VARBINARY({})'.format(Teamo.LABEL_NAME_BYTES) if self._base_db == 'MySQL' else 'VARCHAR(191)'
+        c.execute('''
+            CREATE TABLE `Label` (
+                `code`	INTEGER PRIMARY KEY NOT NULL UNIQUE /*!40101 AUTO_INCREMENT */,
+                `name`	{}	NOT NULL UNIQUE
+            );
+        '''.format(name_type))
+
+    def _load_labels(self) -> None:
+        if not self._has_table('Label'):
+            shouldNotHappen('旧版本的图（label没有编码） 请先调用upgrade()')
+        c = self._conn.cursor()
+        c.execute('''SELECT `code`, `name` FROM `Label`''')
+        rows = [ (code, name.decode('utf-8') if isinstance(name, (bytes, bytearray)) else name)
+            for (code, name) in c.fetchall() ]
+        self._label_codes = { name: code for (code, name) in rows }
+        self._label_names = { code: name for (code, name) in rows }
+
+    # label的编码 label不在字典中时加入字典（与当前的修改在同一个事务中）
+    def _encode_label(self, label: Optional[str]) -> Optional[int]:
+        if label is None:
+            return None
+        if self._label_codes is None or label not in self._label_codes:
+            self._load_labels()
+        code = self._label_codes.get(label)
+        if code is None:
+            c = self._conn.cursor()
+            c.execute('''INSERT INTO `Label` (`name`) VALUES ({ph})'''.format(ph=self._ph), (label,))
+            code = c.lastrowid
+            self._label_codes[label] = code
+            self._label_names[code] = label
+        return code
+
+    def _decode_label(self, code: Optional[int]) -> Optional[str]:
+        if code is None:
+            return None
+        if self._label_names is None or code not in self._label_names:
+            self._load_labels()
+        if code not in self._label_names:
+            shouldNotHappen('label编码不存在')
+        return self._label_names[code]
+
+    # 一组label中已有的编码 不在字典中的label不会匹配任何点/边 直接忽略
+    def _label_codes_of(self, labels: Sequence[str]) -> List[int]:
+        if self._label_codes is None or any(label not in self._label_codes for label in labels):
+            self._load_labels()
+        return [ self._label_codes[label] for label in labels if label in self._label_codes ]
+
+    ##########################################
+    #            degree counters             #
+    ##########################################
+
+    # Vertex上的out_degree/in_degree为点的出度与入度 Degree表为点在每个label上的出度与入度（只有带label的边）
+    # 加边、删边、删点、批量加边与修改边的label时在同一个事务中更新 查询度数不必遍历邻接边
+    # 度数为0的 (点, label) 行随即删除
+    def _create_degree_table(self) -> None:
+        c = self._conn.cursor()
+        suffix = ' WITHOUT ROWID' if self._base_db == 'SQLite3' else ''
+        c.execute('''
+            CREATE TABLE `Degree` (
+                `vertex`	INTEGER NOT NULL,
+                `label`	INTEGER NOT NULL,
+                `out_degree`	INTEGER NOT NULL DEFAULT 0,
+                `in_degree`	INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (`vertex`, `label`)
+            ){};
+        '''.format(suffix))
+
+    # 按一组边增减度数 edges中的每一项为 (tail, head, label编码) sign为1（加边）或-1（删边）
+    # with_total为False时只更新Degree表（修改边的label时总度数不变）
+    def _adjust_degrees(self, edges: Iterable[Tuple[int, int, Optional[int]]], sign: int, *,
+            with_total: bool = True) -> None:
+        edges = list(edges)
+        if len(edges) == 0:
+            return
+        (tails, heads, codes) = zip(*edges)
+        label_counts = {}
+        for (offset, owners) in ((0, tails), (1, heads)):
+            for key in zip(owners, codes):
+                if key[1] is not None:
+                    label_counts.setdefault(key, [ 0, 0 ])[offset] += 1
+        self._apply_degrees(
+            Counter(tails).items() if with_total else (), Counter(heads).items() if with_total else (),
+            [ (vertex, code, out_n, in_n) for ((vertex, code), (out_n, in_n)) in label_counts.items() ], sign)
+
+    # 把计好的度数增量写入数据库 out_counts/in_counts为 (点id, 边数) 的序列
+    # label_rows为 (点id, label编码, 出边数, 入边数) 的序列 同一个 (点id, label编码) 可以出现多次 增量累加
+    # 三者都可以是生成器 批量加边时不必先在内存中汇总
+    def _apply_degrees(self, out_counts: Iterable[Tuple[int, int]], in_counts: Iterable[Tuple[int, int]],
+            label_rows: Iterable[Tuple[int, int, int, int]], sign: int) -> None:
+        for (column, counts) in (('out_degree', out_counts), ('in_degree', in_counts)):
+            self._update_by_id('Vertex', column, ( (v, sign * n) for (v, n) in counts ), increment=True)
+        c = self._conn.cursor()
+        rows = ( (vertex, code, sign * out_n, sign * in_n) for (vertex, code, out_n, in_n) in label_rows )
+        if self._base_db == 'SQLite3':
+            upsert = '''ON CONFLICT(`vertex`, `label`) DO UPDATE
+                SET `out_degree`=`out_degree`+excluded.`out_degree`, `in_degree`=`in_degree`+excluded.`in_degree`'''
+        else:
+            upsert = '''ON DUPLICATE KEY UPDATE
+                `out_degree`=`out_degree`+VALUES(`out_degree`), `in_degree`=`in_degree`+VALUES(`in_degree`)'''
+        for chunk in chunked(rows, Teamo.ADD_EDGE_BATCH):
+            c.executemany(
+                '''INSERT INTO `Degree` (`vertex`, `label`, `out_degree`, `in_degree`) VALUES ({ph}, {ph}, {ph}, {ph})
+                {upsert}'''.format(ph=self._ph, upsert=upsert),
+                chunk
+            )
+            if sign < 0:
+                c.executemany(
+                    '''DELETE FROM `Degree` WHERE `vertex`={ph} AND `label`={ph} AND `out_degree`=0 AND `in_degree`=0'''.format(
+                        ph=self._ph),
+                    [ (vertex, code) for (vertex, code, _, _) in chunk ]
+                )
+
+    # 修改一组边的label之前调用：把这些边的度数从旧label移到新label
+    def _relabel_degrees(self, edge_ids: Iterable[int], code: Optional[int]) -> None:
+        c = self._conn.cursor()
+        edges = []
+        for chunk in chunked(edge_ids, Teamo.QUERY_BATCH):
+            c.execute(
+                '''SELECT `tail`, `head`, `label` FROM Edge WHERE `id` IN ({})'''.format(self._placeholders(len(chunk))),
+                chunk
+            )
+            edges.extend(c.fetchall())
+        self._adjust_degrees(edges, -1, with_total=False)
+        self._adjust_degrees([ (tail, head, code) for (tail, head, _) in edges ], 1, with_total=False)
+
+    # 批量获取一块点的出度(direction='out')或入度(direction='in') labels非空时只计这些label的边
+    # 返回 {点id: 度数} 不存在的点不在结果中
+    def _get_degree_in_batch(self, vertex_ids: Sequence[int], direction: str,
+            labels: Optional[Sequence[str]] = None) -> Dict[int, int]:
+        vertex_ids = list(set(vertex_ids))
+        if len(vertex_ids) == 0:
+            return {}
+        column = '{}_degree'.format(direction)
+        codes = self._label_codes_of(labels) if labels else None
+        c = self._conn.cursor()
+        if codes is None:
+            c.execute(
+                '''SELECT `id`, `{}` FROM Vertex WHERE `id` IN ({})'''.format(column, self._placeholders(len(vertex_ids))),
+                vertex_ids
+            )
+        elif len(codes) == 0:
+            c.execute(
+                '''SELECT `id`, 0 FROM Vertex WHERE `id` IN ({})'''.format(self._placeholders(len(vertex_ids))), vertex_ids
+            )
+        else:
+            c.execute(
+                '''SELECT Vertex.`id`, COALESCE(SUM(d.`{column}`), 0) FROM Vertex
+                LEFT JOIN `Degree` AS d ON d.`vertex`=Vertex.`id` AND d.`label` IN ({ls})
+                WHERE Vertex.`id` IN ({vs}) GROUP BY Vertex.`id`'''.format(column=column,
+                    ls=self._placeholders(len(codes)), vs=self._placeholders(len(vertex_ids))),
+                list(codes) + vertex_ids
+            )
+        return { id_: int(degree) for (id_, degree) in c.fetchall() }
+
+    def _get_out_degree_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, int]:
+        return self._get_degree_in_batch(vertex_ids, 'out', labels)
+
+    def _get_in_degree_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, int]:
+        return self._get_degree_in_batch(vertex_ids, 'in', labels)
+
+    ##########################################
+    #              maintenance               #
+    ##########################################
+
+    # 整理边表：按点的id顺序、每个点出边链表的顺序给边重新编号 使每个点的出边在表中连续存放
+    # 重建四个链表指针与点的链表头 链表中边的先后顺序不变 vacuum为True时SQLite3随后VACUUM回收空间
+    # 边的id会改变 之前取得的边id、快照与包(pack)中的边都会失效；不能在写入批次中调用
+    def compact(self, *, vacuum: bool = True) -> None:
+        if self.in_batch():
+            shouldNotHappen('不能在写入批次中整理边表')
+        c = self._conn.cursor()
+        # clustered布局的邻接表本身就按点聚簇存放 不需要重新编号
+        if self._is_clustered():
+            if vacuum and self._base_db == 'SQLite3':
+                c.execute('''VACUUM''')
+            return
+        c.execute('''SELECT MAX(`id`), COUNT(*) FROM Edge''')
+        (max_edge_id, edge_number) = c.fetchone()
+        if max_edge_id is None:
+            return
+        forward = array('q', [ 0 ]) * (max_edge_id + 1)
+        for (id_, next_) in self._iter_query('''SELECT `id`, `forward` FROM Edge'''):
+            forward[id_] = 0 if next_ is None else next_
+        # 新编号：按点的id顺序依次走每个点的出边链表
+        new_ids = array('q', [ 0 ]) * (max_edge_id + 1)
+        count = 0
+        for (edge_id,) in self._iter_query('''SELECT `out_edge` FROM Vertex WHERE `out_edge` IS NOT NULL ORDER BY `id`'''):
+            while edge_id:
+                count += 1
+                new_ids[edge_id] = count
+                edge_id = forward[edge_id]
+        del forward
+        if count != edge_number:
+            shouldNotHappen('十字链表已损坏：出边链表中的边数与边表不一致')
+        # 编号对照表和新边表在数据库中 整张表的改写由几条INSERT ... SELECT/UPDATE完成
+        edge_indexes = [ columns for (_, table, columns) in self.list_indexes() if table == 'Edge' ]
+        c.execute('''DROP TABLE IF EXISTS `EdgeCompactMap`''')
+        c.execute('''DROP TABLE IF EXISTS `EdgeCompact`''')
+        c.execute('''CREATE TABLE `EdgeCompactMap` (`old` INTEGER PRIMARY KEY NOT NULL, `new` INTEGER NOT NULL)''')
+        self._create_edge_table('EdgeCompact')
+        pairs = ( (old, new) for (old, new) in enumerate(new_ids) if new )
+        for chunk in chunked(pairs, Teamo.ADD_EDGE_BATCH):
+            c.executemany(
+                '''INSERT INTO `EdgeCompactMap` (`old`, `new`) VALUES ({ph}, {ph})'''.format(ph=self._ph), chunk
+            )
+        del new_ids
+        renumber = '''(SELECT `new` FROM `EdgeCompactMap` WHERE `old`={})'''
+        c.execute(
+            '''INSERT INTO `EdgeCompact` (`id`, `tail`, `head`, `backward`, `forward`, `revback`, `revfor`, `label`, `data`,
+                `out_rank`, `in_rank`)
+            SELECT m.`new`, e.`tail`, e.`head`, {}, {}, {}, {}, e.`label`, e.`data`, e.`out_rank`, e.`in_rank`
+            FROM `EdgeCompactMap` AS m JOIN Edge AS e ON e.`id`=m.`old`
+            ORDER BY m.`new`'''.format(*( renumber.format('e.`{}`'.format(column))
+                for column in ('backward', 'forward', 'revback', 'revfor') ))
+        )
+        c.execute(
+            '''UPDATE Vertex SET `out_edge`={}, `in_edge`={}'''.format(
+                renumber.format('Vertex.`out_edge`'), renumber.format('Vertex.`in_edge`'))
+        )
+        c.execute('''DROP TABLE Edge''')
+        c.execute('''ALTER TABLE `EdgeCompact` RENAME TO `Edge`''')
+        c.execute('''DROP TABLE `EdgeCompactMap`''')
+        self._conn.commit()
+        # 旧表的索引随旧表一起删除了 在新表上重建
+        self._indexes = None
+        for columns in edge_indexes:
+            if columns[0].startswith('data.'):
+                self.create_property_index('Edge', columns[0][len('data.'):])
+            else:
+                self.create_index('Edge', *columns)
+        self.clear_cache()
+        if vacuum and self._base_db == 'SQLite3':
+            c.execute('''VACUUM''')
+
+    # 把旧版本的图升级为当前格式 已是当前格式时什么也不做 返回是否进行了升级
+    #   1. 建立Label表 把Vertex/Edge的label列由文本改为编码 并重建label上的索引 clustered布局的邻接表由Edge重新生成
+    #   2. 为Edge加上位次列 沿链表计算每条边的位次 并把Edge上的tail/head索引换成 (所属点, label, 位次) 索引
+    #   3. 为Vertex加上出度、入度两列 建立Degree表 由Edge统计出所有度数
+    # SQLite3需要3.35以上（ALTER TABLE DROP COLUMN）；不能在写入批次中调用
+    def upgrade(self) -> bool:
+        steps = [ step for (done, step) in (
+            (self._has_table('Label'), self._upgrade_labels),
+            (self._has_column('Edge', 'out_rank'), self._upgrade_ranks),
+            (self._has_table('Degree'), self._upgrade_degrees),
+        ) if not done ]
+        if len(steps) == 0:
+            return False
+        if self.in_batch():
+            shouldNotHappen('不能在写入批次中升级')
+        if self._base_db == 'SQLite3' and sqlite3.sqlite_version_info < (3, 35, 0):
+            shouldNotHappen('升级需要SQLite3 3.35以上（ALTER TABLE DROP COLUMN） 当前为{}'.format(sqlite3.sqlite_version))
+        for step in steps:
+            step()
+        self.clear_cache()
+        return True
+
+    def _has_column(self, table: str, column: str) -> bool:
+        c = self._conn.cursor()
+        if self._base_db == 'SQLite3':
+            c.execute('''PRAGMA table_info(`{}`)'''.format(table))
+            return any(row[1] == column for row in c.fetchall())
+        c.execute(
+            '''SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME`={ph} AND `COLUMN_NAME`={ph}'''.format(ph=self._ph),
+            (table, column)
+        )
+        (found,) = c.fetchone()
+        return found > 0
+
+    def _upgrade_labels(self) -> None:
+        label_indexes = [ (table, columns) for (_, table, columns) in self.list_indexes() if 'label' in columns ]
+        for (table, columns) in label_indexes:
+            self.drop_index(table, *columns)
+        c = self._conn.cursor()
+        self._create_label_table()
+        # MySQL中旧的文本列按字节去重与比较 否则只有大小写不同的label会被合并
+        label_sql = 'CAST(`label` AS BINARY)' if self._base_db == 'MySQL' else '`label`'
+        c.execute(
+            '''INSERT INTO `Label` (`name`)
+            SELECT `label` FROM (SELECT {label} AS `label` FROM Vertex UNION SELECT {label} FROM Edge) AS t
+            WHERE `label` IS NOT NULL ORDER BY `label`'''.format(label=label_sql)
+        )
+        for table in ('Vertex', 'Edge'):
+            c.execute('''ALTER TABLE `{}` ADD COLUMN `label_code` INTEGER'''.format(table))
+            c.execute(
+                '''UPDATE `{table}` SET `label_code`=(SELECT `code` FROM `Label` WHERE `Label`.`name`={label})'''.format(
+                    table=table, label=label_sql.replace('`label`', '`{}`.`label`'.format(table)))
+            )
+            c.execute('''ALTER TABLE `{}` DROP COLUMN `label`'''.format(table))
+            c.execute('''ALTER TABLE `{}` RENAME COLUMN `label_code` TO `label`'''.format(table))
+        if self._is_clustered():
+            c.execute('''DROP TABLE `OutAdj`''')
+            c.execute('''DROP TABLE `InAdj`''')
+            self._create_adjacency_tables()
+            for (table, owner, other) in Teamo.ADJACENCY_TABLES.values():
+                c.execute(
+                    '''INSERT INTO `{table}` (`{owner}`, `label`, `id`, `{other}`)
+                    SELECT `{owner}`, COALESCE(`label`, 0), `id`, `{other}` FROM Edge'''.format(
+                        table=table, owner=owner, other=other)
+                )
+        self._conn.commit()
+        self._indexes = None
+        for (table, columns) in label_indexes:
+            self.create_index(table, *columns)
+
+    # 链表中的第k条边（从0开始）位次为k clustered布局不使用位次 只加上两列
+    def _upgrade_ranks(self) -> None:
+        c = self._conn.cursor()
+        for (_, rank_column) in Teamo.RANK_COLUMNS.values():
+            c.execute('''ALTER TABLE Edge ADD COLUMN `{}` INTEGER'''.format(rank_column))
+        if self._is_clustered():
+            self._conn.commit()
+            return
+        for vertex_ids in chunked(self._get_all_vertex(), Teamo.QUERY_BATCH):
+            for (direction, (_, rank_column)) in Teamo.RANK_COLUMNS.items():
+                ranks = [ (edge_id, rank) for edges in self._walk_edge_chains(vertex_ids, direction).values()
+                    for (rank, edge_id) in enumerate(edges) ]
+                self._update_by_id('Edge', rank_column, ranks)
+        self._conn.commit()
+        for (direction, (key_column, rank_column)) in Teamo.RANK_COLUMNS.items():
+            if self._has_index('Edge', key_column) and not self._has_rank_index(direction):
+                self.create_index('Edge', key_column, 'label', rank_column)
+                self.drop_index('Edge', key_column)
+
+    def _upgrade_degrees(self) -> None:
+        c = self._conn.cursor()
+        for (direction, key_column) in (('out', 'tail'), ('in', 'head')):
+            c.execute('''ALTER TABLE Vertex ADD COLUMN `{}_degree` INTEGER NOT NULL DEFAULT 0'''.format(direction))
+            c.execute(
+                '''UPDATE Vertex SET `{}_degree`=(SELECT COUNT(*) FROM Edge WHERE Edge.`{}`=Vertex.`id`)'''.format(
+                    direction, key_column)
+            )
+        self._create_degree_table()
+        c.execute(
+            '''INSERT INTO `Degree` (`vertex`, `label`, `out_degree`, `in_degree`)
+            SELECT `vertex`, `label`, SUM(`o`), SUM(`i`) FROM (
+                SELECT `tail` AS `vertex`, `label`, 1 AS `o`, 0 AS `i` FROM Edge WHERE `label` IS NOT NULL
+                UNION ALL
+                SELECT `head` AS `vertex`, `label`, 0 AS `o`, 1 AS `i` FROM Edge WHERE `label` IS NOT NULL
+            ) AS t GROUP BY `vertex`, `label`'''
+        )
+        self._conn.commit()
+
+    ##########################################
+    #       clustered adjacency layout       #
+    ##########################################
+
+    # clustered布局：Edge仍保存边的端点、label与data（链表指针为NULL） 另有两张按点聚簇的邻接表
+    #   OutAdj (tail, label, id, head) 主键 (tail, label, id)
+    #   InAdj  (head, label, id, tail) 主键 (head, label, id)
+    # SQLite3中为WITHOUT ROWID表 MySQL(InnoDB)中主键即聚簇索引 一个点（某个label）的邻接边是主键上的一次范围扫描
+    # label为编码 主键列不能为NULL 没有label的边在邻接表中的label记为0
+    # 每个点的边按 (label, id) 排序 而不是十字链表中的顺序
+    def _create_adjacency_tables(self) -> None:
+        c = self._conn.cursor()
+        suffix = ' WITHOUT ROWID' if self._base_db == 'SQLite3' else ''
+        for (table, owner, other) in Teamo.ADJACENCY_TABLES.values():
+            c.execute('''
+                CREATE TABLE `{table}` (
+                    `{owner}`	INTEGER NOT NULL,
+                    `label`	INTEGER NOT NULL,
+                    `id`	INTEGER NOT NULL,
+                    `{other}`	INTEGER NOT NULL,
+                    PRIMARY KEY (`{owner}`, `label`, `id`)
+                ){suffix};
+            '''.format(table=table, owner=owner, other=other, suffix=suffix))
+
+    # 把新边写入两张邻接表 edges中的每一项为 (id, tail, head, label编码)
+    def _add_adjacency(self, edges: Sequence[Tuple[int, int, int, Optional[str]]]) -> None:
+        c = self._conn.cursor()
+        for chunk in chunked(edges, Teamo.ADD_EDGE_BATCH):
+            c.executemany(
+                '''INSERT INTO `OutAdj` (`tail`, `label`, `id`, `head`) VALUES ({ph}, {ph}, {ph}, {ph})'''.format(ph=self._ph),
+                [ (tail, label or 0, id_, head) for (id_, tail, head, label) in chunk ]
+            )
+            c.executemany(
+                '''INSERT INTO `InAdj` (`head`, `label`, `id`, `tail`) VALUES ({ph}, {ph}, {ph}, {ph})'''.format(ph=self._ph),
+                [ (head, label or 0, id_, tail) for (id_, tail, head, label) in chunk ]
+            )
+
+    # 从两张邻接表中删除一组边并删除Edge中的行 edge_ids中的边必须都存在
+    def _remove_adjacency(self, edge_ids: Iterable[int]) -> None:
+        c = self._conn.cursor()
+        for chunk in chunked(edge_ids, Teamo.QUERY_BATCH):
+            c.execute(
+                '''SELECT `id`, `tail`, `head`, `label` FROM Edge WHERE `id` IN ({})'''.format(self._placeholders(len(chunk))),
+                chunk
+            )
+            rows = c.fetchall()
+            if len(rows) != len(chunk):
+                shouldNotHappen('要删除的边不存在')
+            self._adjust_degrees([ (tail, head, label) for (_, tail, head, label) in rows ], -1)
+            # 主键的首列加上id 只在该点的范围内查找
+            c.executemany(
+                '''DELETE FROM `OutAdj` WHERE `tail`={ph} AND `id`={ph}'''.format(ph=self._ph),
+                [ (tail, id_) for (id_, tail, _, _) in rows ]
+            )
+            c.executemany(
+                '''DELETE FROM `InAdj` WHERE `head`={ph} AND `id`={ph}'''.format(ph=self._ph),
+                [ (head, id_) for (id_, _, head, _) in rows ]
+            )
+            c.execute(
+                '''DELETE FROM Edge WHERE `id` IN ({})'''.format(self._placeholders(len(chunk))), chunk
+            )
+            for edge_id in chunk:
+                self._invalidate('Edge', edge_id)
+
+    # 修改边的label时同步邻接表中的label编码（它是主键的一部分）
+    def _relabel_adjacency(self, edge_ids: Iterable[int], code: Optional[int]) -> None:
+        c = self._conn.cursor()
+        for chunk in chunked(edge_ids, Teamo.QUERY_BATCH):
+            c.execute(
+                '''SELECT `id`, `tail`, `head` FROM Edge WHERE `id` IN ({})'''.format(self._placeholders(len(chunk))), chunk
+            )
+            rows = c.fetchall()
+            c.executemany(
+                '''UPDATE `OutAdj` SET `label`={ph} WHERE `tail`={ph} AND `id`={ph}'''.format(ph=self._ph),
+                [ (code or 0, tail, id_) for (id_, tail, _) in rows ]
+            )
+            c.executemany(
+                '''UPDATE `InAdj` SET `label`={ph} WHERE `head`={ph} AND `id`={ph}'''.format(ph=self._ph),
+                [ (code or 0, head, id_) for (id_, _, head) in rows ]
+            )
+
+    # 一个点的出边(direction='out')或入边(direction='in') labels非空时只取这些label的边
+    def _get_adjacent_edge(self, vertex_id: int, direction: str, labels: Sequence[str] = ()) -> List[int]:
+        return self._scan_adjacency([ vertex_id ], direction, labels).get(vertex_id, [])
+
+    # 按主键范围扫描一组点的邻接边 target_column为'id'时取边 为另一端点的列(head/tail)时取邻接点
+    # 返回 {点id: [target, ...]} 每个点的结果按 (label, id) 排序
+    def _scan_adjacency(self, vertex_ids: Sequence[int], direction: str,
+            labels: Optional[Sequence[str]] = None, target_column: str = 'id') -> Dict[int, List[int]]:
+        vertex_ids = list(set(vertex_ids))
+        if len(vertex_ids) == 0:
+            return {}
+        (table, owner, _) = Teamo.ADJACENCY_TABLES[direction]
+        args = list(vertex_ids)
+        label_filter = ''
+        if labels:
+            codes = self._label_codes_of(labels)
+            if len(codes) == 0:
+                return {}
+            label_filter = 'AND `label` IN ({})'.format(self._placeholders(len(codes)))
+            args.extend(codes)
+        c = self._conn.cursor()
+        c.execute(
+            '''SELECT `{owner}`, `{target}` FROM `{table}` WHERE `{owner}` IN ({vs}) {where}
+            ORDER BY `{owner}`, `label`, `id`'''.format(owner=owner, target=target_column, table=table,
+                vs=self._placeholders(len(vertex_ids)), where=label_filter),
+            args
+        )
+        adjacency = {}
+        for (vertex, target) in c.fetchall():
+            adjacency.setdefault(vertex, []).append(target)
+        return adjacency
 
     ##########################################
     #       add/remove the vertex/edge       #
@@ -93,25 +1027,79 @@ class Teamo:
         # 获取新插入的顶点的id
         new_vertex_id = c.lastrowid
         if do_commit:
-            self._conn.commit()
+            self._commit()
         return new_vertex_id
 
+    # 批量添加点 vertices中的每一项为 (label, data) 返回新点的id区间（连续）
+    # 与_add_edge_in_one_branch一样 先取出当前最大id 再手动指定新点的id 用executemany分块插入
+    def _add_vertex_in_batch(self, vertices: Iterable[Tuple[Optional[str], Optional[str]]]) -> range:
+        c = self._conn.cursor()
+        c.execute('''SELECT MAX(id) FROM Vertex;''')
+        (max_vertex_id,) = c.fetchone()
+        if max_vertex_id is None:
+            max_vertex_id = 0
+        new_id = max_vertex_id + 1
+        count = 0
+        for chunk in chunked(vertices, Teamo.ADD_VERTEX_BATCH):
+            c.executemany(
+                '''INSERT INTO Vertex (`id`, `in_edge`, `out_edge`, `label`, `data`)
+                VALUES ({ph}, NULL, NULL, {ph}, {ph})'''.format(ph=self._ph),
+                [ (new_id + count + i, self._encode_label(label), data) for i, (label, data) in enumerate(chunk) ]
+            )
+            count += len(chunk)
+        self._commit(count)
+        return range(new_id, new_id + count)
+
+    # 批量添加number个没有label与data的点 返回新点的id区间（连续）
+    # SQLite3中用递归CTE生成id 整个插入只有一条语句；MySQL的递归深度受cte_max_recursion_depth限制 仍用executemany
+    def _add_empty_vertex_in_batch(self, number: int) -> range:
+        if self._base_db != 'SQLite3':
+            return self._add_vertex_in_batch(itertools.repeat((None, None), number))
+        c = self._conn.cursor()
+        c.execute('''SELECT MAX(id) FROM Vertex;''')
+        (max_vertex_id,) = c.fetchone()
+        if max_vertex_id is None:
+            max_vertex_id = 0
+        new_id = max_vertex_id + 1
+        if number > 0:
+            c.execute(
+                '''WITH RECURSIVE seq(`id`) AS (
+                    SELECT ? UNION ALL SELECT `id` + 1 FROM seq WHERE `id` < ?
+                )
+                INSERT INTO Vertex (`id`, `in_edge`, `out_edge`, `label`, `data`)
+                SELECT `id`, NULL, NULL, NULL, NULL FROM seq''',
+                (new_id, new_id + number - 1)
+            )
+        self._commit(number)
+        return range(new_id, new_id + number)
+
     # 删除顶点x，如果它在那里 （谨慎使用do_commit参数 后果自负）
     def _remove_vertex(self, vertex_id: int, *, do_commit: bool = True) -> None:
         c = self._conn.cursor()
+        if self._is_clustered():
+            self._remove_adjacency(dict.fromkeys(self._get_out_edge(vertex_id) + self._get_in_edge(vertex_id)))
+            c.execute('''DELETE FROM Vertex WHERE `id`={ph}'''.format(ph=self._ph), (vertex_id,))
+            self._invalidate('Vertex', vertex_id)
+            if do_commit:
+                self._commit()
+            return
         # 先获得顶点的出边链表引用和入边链表引用（根据惯例，先处理出后处理入）
         c.execute(
             '''SELECT `in_edge`, `out_edge` FROM Vertex WHERE `id`={ph}'''.format(ph=self._ph), (vertex_id,)
         )
         (in_edge, out_edge) = c.fetchone()
+        # 删除的边 (tail, head, label) 最后一起扣减度数
+        removed_edges = []
         current_id = out_edge
         while current_id is not None:
             # 首次进入循环 获得出边链表头节点
             c.execute(
-                '''SELECT `tail`, `head`, `backward`, `forward`, `revback`, `revfor` FROM Edge WHERE `id`={ph}'''.format(ph=self._ph),
+                '''SELECT `tail`, `head`, `backward`, `forward`, `revback`, `revfor`, `label` FROM Edge WHERE `id`={ph}'''.format(
+                    ph=self._ph),
                 (current_id,)
             )
-            (tail, head, backward, forward, revback, revfor) = c.fetchone()
+            (tail, head, backward, forward, revback, revfor, label) = c.fetchone()
+            removed_edges.append((tail, head, label))
             # 衔接指向此边节点的和此边节点所指向的包含此节点的某个入边链表（即在双向链表中移除此节点）
             if revback is None:
                 # 它一定是作为某入边链表的头 因为一条边必然会同时作为出边和入边
@@ -136,14 +1124,18 @@ class Teamo:
             c.execute(
                 '''DELETE FROM Edge WHERE `id`={ph}'''.format(ph=self._ph), (current_id,)
             )
+            self._invalidate('Edge', current_id)
             current_id = forward
         current_id = in_edge
         while current_id is not None:
             # 首次进入循环 获得入边链表头节点
             c.execute(
-                '''SELECT `tail`, `head`, `backward`, `forward`, `revback`, `revfor` FROM Edge WHERE `id`={ph}'''.format(ph=self._ph), (current_id,)
+                '''SELECT `tail`, `head`, `backward`, `forward`, `revback`, `revfor`, `label` FROM Edge WHERE `id`={ph}'''.format(
+                    ph=self._ph),
+                (current_id,)
             )
-            (tail, head, backward, forward, revback, revfor) = c.fetchone()
+            (tail, head, backward, forward, revback, revfor, label) = c.fetchone()
+            removed_edges.append((tail, head, label))
             # 衔接指向此边节点的和此边节点所指向的包含此节点的某个出边链表（即在双向链表中移除此节点）
             if revfor is None:
                 # 它一定是作为某出边链表的头 因为一条边必然会同时作为出边和入边
@@ -168,12 +1160,15 @@ class Teamo:
             c.execute(
                 '''DELETE FROM Edge WHERE `id`={ph}'''.format(ph=self._ph), (current_id,)
             )
+            self._invalidate('Edge', current_id)
             current_id = backward
+        self._adjust_degrees(removed_edges, -1)
         c.execute(
             '''DELETE FROM Vertex WHERE `id`={ph}'''.format(ph=self._ph), (vertex_id,)
         )
+        self._invalidate('Vertex', vertex_id)
         if do_commit:
-            self._conn.commit()
+            self._commit()
 
     # 添加x到y的一条边，返回这条边 （谨慎使用do_commit参数 后果自负）
     def _add_edge(self, from_vertex: int, to_vertex: int, *, do_commit: bool = True) -> int:
@@ -185,12 +1180,19 @@ class Teamo:
         )
         # 获取新插入的边的id
         new_edge_id = c.lastrowid
+        self._adjust_degrees([ (from_vertex, to_vertex, None) ], 1)
+        if self._is_clustered():
+            self._add_adjacency([ (new_edge_id, from_vertex, to_vertex, None) ])
+            if do_commit:
+                self._commit()
+            return new_edge_id
         # ----------- 这里是关于放置新边在尾顶点的出边out_edge链表头部的代码 ----------- #
-        # 获取from_vertex也就是tail的出边链表表头引用
+        # 获取from_vertex也就是tail的出边链表表头引用 以及表头的位次
         c.execute(
-            '''SELECT `out_edge` FROM Vertex WHERE `id`={ph}'''.format(ph=self._ph), (from_vertex,)
+            '''SELECT Vertex.`out_edge`, Edge.`out_rank` FROM Vertex LEFT JOIN Edge ON Edge.`id`=Vertex.`out_edge`
+            WHERE Vertex.`id`={ph}'''.format(ph=self._ph), (from_vertex,)
         )
-        (out_id,) = c.fetchone()
+        (out_id, out_rank) = c.fetchone()
         if out_id is None:
             # 空引用则直接连到新的边上，因为新边在此作为链表表头，所以不需要反向引用，revfor为空
             c.execute(
@@ -211,11 +1213,12 @@ class Teamo:
             )
             # 至此出边链表的更新完成
         # ----------- 这里是关于放置新边在头顶点的出边in_edge链表头部的代码 ----------- #
-        # 获取to_vertex也就是head的出边链表表头引用
+        # 获取to_vertex也就是head的出边链表表头引用 以及表头的位次
         c.execute(
-            '''SELECT `in_edge` FROM Vertex WHERE `id`={ph}'''.format(ph=self._ph), (to_vertex,)
+            '''SELECT Vertex.`in_edge`, Edge.`in_rank` FROM Vertex LEFT JOIN Edge ON Edge.`id`=Vertex.`in_edge`
+            WHERE Vertex.`id`={ph}'''.format(ph=self._ph), (to_vertex,)
         )
-        (in_id,) = c.fetchone()
+        (in_id, in_rank) = c.fetchone()
         if in_id is None:
             # 空引用则直接连到新的边上，因为新边在此作为链表表头，所以不需要反向引用，revback为空
             c.execute(
@@ -235,18 +1238,30 @@ class Teamo:
                 '''UPDATE Vertex SET `in_edge`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (new_edge_id, to_vertex)
             )
             # 至此入边链表的更新完成
+        # 新边是两个链表的新表头 位次排在旧表头之前
+        c.execute(
+            '''UPDATE Edge SET `out_rank`={ph}, `in_rank`={ph} WHERE `id`={ph}'''.format(ph=self._ph),
+            (Teamo._rank_before(out_rank), Teamo._rank_before(in_rank), new_edge_id)
+        )
         if do_commit:
-            self._conn.commit()
+            self._commit()
         return new_edge_id
 
     # 删除边 （谨慎使用do_commit参数 后果自负）
     def _remove_edge(self, edge_id: int, *, do_commit: bool = True) -> None:
+        if self._is_clustered():
+            self._remove_adjacency([ edge_id ])
+            if do_commit:
+                self._commit()
+            return
         c = self._conn.cursor()
         c.execute(
-            '''SELECT `tail`, `head`, `backward`, `forward`, `revback`, `revfor` FROM Edge WHERE `id`={ph}'''.format(ph=self._ph),
+            '''SELECT `tail`, `head`, `backward`, `forward`, `revback`, `revfor`, `label` FROM Edge WHERE `id`={ph}'''.format(
+                ph=self._ph),
             (edge_id,)
         )
-        (tail, head, backward, forward, revback, revfor) = c.fetchone()
+        (tail, head, backward, forward, revback, revfor, label) = c.fetchone()
+        self._adjust_degrees([ (tail, head, label) ], -1)
         # 在出边链表中删除节点
         if revfor is None:
             # 此边节点作为出边链表头结点
@@ -290,19 +1305,121 @@ class Teamo:
         c.execute(
             '''DELETE FROM Edge WHERE `id`={ph}'''.format(ph=self._ph), (edge_id,)
         )
+        self._invalidate('Edge', edge_id)
         if do_commit:
-            self._conn.commit()
+            self._commit()
+
+    # 批量删除一组点及其所有邻接边 整个过程在一个事务中完成 返回删除的点数
+    def _remove_vertex_in_batch(self, vertex_ids: Iterable[int]) -> int:
+        vertex_ids = set(vertex_ids)
+        if len(vertex_ids) == 0:
+            return 0
+        c = self._conn.cursor()
+        with self.batch():
+            # 沿十字链表批量取出这些点的出边与入边
+            edge_ids = set()
+            for chunk in chunked(vertex_ids, Teamo.QUERY_BATCH):
+                for adjacency in (self._get_out_edge_in_batch(chunk), self._get_in_edge_in_batch(chunk)):
+                    for edges in adjacency.values():
+                        edge_ids.update(edges)
+            self._unlink_edges(edge_ids, vertex_ids)
+            removed = 0
+            for chunk in chunked(vertex_ids, Teamo.QUERY_BATCH):
+                c.execute(
+                    '''DELETE FROM Vertex WHERE `id` IN ({})'''.format(self._placeholders(len(chunk))), chunk
+                )
+                removed += c.rowcount
+            for vertex_id in vertex_ids:
+                self._invalidate('Vertex', vertex_id)
+            if removed != len(vertex_ids):
+                shouldNotHappen('要删除的点不存在')
+            self._commit(len(vertex_ids) + len(edge_ids))
+        return removed
+
+    # 批量删除一组边 整个过程在一个事务中完成 返回删除的边数
+    def _remove_edge_in_batch(self, edge_ids: Iterable[int]) -> int:
+        edge_ids = set(edge_ids)
+        if len(edge_ids) == 0:
+            return 0
+        with self.batch():
+            self._unlink_edges(edge_ids, set())
+            self._commit(len(edge_ids))
+        return len(edge_ids)
+
+    # 从十字链表中摘除并删除一组边 dropped_vertices为随后一同删除的点（不必再改写它们的链表头）
+    # 先取出这些边的指针 在内存中找出每个链表里连续被删除的一段 只需把这段前后存活的边（或点的链表头）衔接起来
+    # 因此同一链表中相邻的被删除边也只衔接一次 所有指针的改写按列合并成几条语句执行
+    def _unlink_edges(self, edge_ids: Set[int], dropped_vertices: Set[int]) -> None:
+        if len(edge_ids) == 0:
+            return
+        if self._is_clustered():
+            self._remove_adjacency(edge_ids)
+            return
+        c = self._conn.cursor()
+        nodes = {}
+        for chunk in chunked(edge_ids, Teamo.QUERY_BATCH):
+            c.execute(
+                '''SELECT `id`, `tail`, `head`, `backward`, `forward`, `revback`, `revfor`, `label` FROM Edge
+                WHERE `id` IN ({})'''.format(self._placeholders(len(chunk))),
+                chunk
+            )
+            for (id_, tail, head, backward, forward, revback, revfor, label) in c.fetchall():
+                nodes[id_] = (tail, forward, revfor, head, backward, revback, label)
+        if len(nodes) != len(edge_ids):
+            shouldNotHappen('要删除的边不存在')
+        self._adjust_degrees([ (node[0], node[3], node[6]) for node in nodes.values() ], -1)
+        updates = {}
+        # 出边链表取 (tail, forward, revfor) 入边链表取 (head, backward, revback)
+        for (offset, vertex_column, next_column, prev_column) in (
+                (0, 'out_edge', 'forward', 'revfor'), (3, 'in_edge', 'backward', 'revback')):
+            vertex_pairs = updates.setdefault(('Vertex', vertex_column), [])
+            next_pairs = updates.setdefault(('Edge', next_column), [])
+            prev_pairs = updates.setdefault(('Edge', prev_column), [])
+            for node in nodes.values():
+                (owner, next_, previous) = node[offset:offset + 3]
+                # 只从每段的第一条边出发 向后走到这段的最后一条边
+                if previous in nodes:
+                    continue
+                while next_ in nodes:
+                    next_ = nodes[next_][offset + 1]
+                if previous is None:
+                    if owner not in dropped_vertices:
+                        vertex_pairs.append((owner, next_))
+                else:
+                    next_pairs.append((previous, next_))
+                if next_ is not None:
+                    prev_pairs.append((next_, previous))
+        for ((table, column), pairs) in updates.items():
+            if pairs:
+                self._update_by_id(table, column, pairs)
+        for chunk in chunked(edge_ids, Teamo.QUERY_BATCH):
+            c.execute(
+                '''DELETE FROM Edge WHERE `id` IN ({})'''.format(self._placeholders(len(chunk))), chunk
+            )
+        for edge_id in edge_ids:
+            self._invalidate('Edge', edge_id)
 
     # 批量插入边，前提是输入的数据是能保证正确的
-    def _add_edge_in_branch(self, edges: Sequence[Tuple[int, int]], number: int = 10000000) -> None:
+    # edges中的每一项为 (tail, head) 或 (tail, head, label, data) 返回新边的id区间（连续）
+    def _add_edge_in_branch(self, edges: Sequence[Tuple], number: int = 10000000) -> range:
         length = len(edges)
         if number > length:
             number = length
+        first = None
+        last = None
         for i in range(0, len(edges), number):
-            self._add_edge_in_one_branch(edges[i:(i+number)])
+            new_ids = self._add_edge_in_one_branch(edges[i:(i+number)])
+            if first is None:
+                first = new_ids.start
+            last = new_ids.stop
+        if first is None:
+            return range(0)
+        return range(first, last)
 
     # 单词批量插入 将输入的所有边一次性在内存里构建好然后插入
-    def _add_edge_in_one_branch(self, edges: Sequence[Tuple[int, int]]) -> None:
+    def _add_edge_in_one_branch(self, edges: Sequence[Tuple]) -> range:
+        if len(edges) == 0:
+            return range(0)
         c = self._conn.cursor()
         # 分批次进行(暂不实现)
         # 思路是，在一个十字链表的网里加入另一个在内存里构建好的十字链表网（合并两个网）
@@ -317,125 +1434,225 @@ class Teamo:
         (max_vertex_id,) = c.fetchone()
         if max_vertex_id is None:
             shouldNotHappen('不能在不存在点的情况下批量添加边')
+        if self._is_clustered():
+            return self._add_edge_to_adjacency(edges, new_id)
         # 首先在内存里构建新网 最终以表的形式拼接到原数据库中
-        new_table = [ [ e[0], e[1], None, None, None, None ] for e in edges ]
-        # out_table[0] 不使用
-        out_table = [ [] for _ in range(max_vertex_id + 1) ]
-        # in_table[0] 不使用
-        in_table = [ [] for _ in range(max_vertex_id + 1) ]
-        for i, e in enumerate(edges):
-            # 在出边表中对应的尾顶点处的list尾部加上此边在new_table中的索引
-            out_table[e[0]].append(i)
-            # 在出边表中对应的尾顶点处的list尾部加上此边在new_table中的索引
-            in_table[e[1]].append(i)
-        for i in range(1, len(out_table)):
-            # 此顶点i的出链表
-            k = out_table[i]
-            k_len = len(k)
-            # k_len == 0 时 此顶点出链表为空
-            # k_len == 1 时 此顶点出链表仅有一个节点 forward & revfor 都为 NULL
-            if k_len < 2:
-                continue
-            # list head
-            new_table[k[0]][3] = k[1]
-            new_table[k[1]][5] = k[0]
-            for j in range(1, k_len - 1):
-                # forward
-                new_table[k[j]][3] = k[j + 1]
-                # revfor
-                new_table[k[j + 1]][5] = k[j]
-            # list tail
-            new_table[k[k_len - 2]][3] = k[k_len - 1]
-            new_table[k[k_len - 1]][5] = k[k_len - 2]
-        for i in range(1, len(in_table)):
-            # 此顶点i的入链表
-            k = in_table[i]
-            k_len = len(k)
-            # k_len == 0 时 此顶点入链表为空
-            # k_len == 1 时 此顶点入链表仅有一个节点 backward & revback 都为 NULL
-            if k_len < 2:
-                continue
-            # list head
-            new_table[k[0]][2] = k[1]
-            new_table[k[1]][4] = k[0]
-            for j in range(1, k_len - 1):
-                # backward
-                new_table[k[j]][2] = k[j + 1]
-                # revback
-                new_table[k[j + 1]][4] = k[j]
-            # list tail
-            new_table[k[k_len - 2]][2] = k[k_len - 1]
-            new_table[k[k_len - 1]][4] = k[k_len - 2]
-        adjust_id = lambda x, i=new_id: None if x is None else x + i
-        for i, row in enumerate(new_table):
+        # 新网的每一列都是一个紧凑的array('q')（每条边每列8字节） -1 表示 NULL 下标即边在edges中的索引
+        number = len(edges)
+        tails = array('q', (e[0] for e in edges))
+        heads = array('q', (e[1] for e in edges))
+        forwards, revfors, out_first, out_last, out_behind = self._link_chain(tails, max_vertex_id)
+        backwards, revbacks, in_first, in_last, in_behind = self._link_chain(heads, max_vertex_id)
+        # 只有带label/data的边才需要额外的两列 label编码同样放在array('q')中 0表示没有label
+        labels = array('q', ((self._encode_label(e[2]) or 0) if len(e) > 2 else 0 for e in edges)) \
+            if any(len(e) > 2 for e in edges) else None
+        datas = [ e[3] if len(e) > 3 else None for e in edges ] if any(len(e) > 3 for e in edges) else None
+        # 涉及到的点按第一次出现的顺序编号 position[点id]为其编号（-1表示不涉及）
+        position = array('q', [ -1 ]) * (max_vertex_id + 1)
+        touched = array('q')
+        for v in itertools.chain(tails, heads):
+            if position[v] < 0:
+                position[v] = len(touched)
+                touched.append(v)
+        # 一次性取出所有涉及到的点的旧链表头（-1表示空链表）与插在旧链表头之前的位次 按点的编号存放
+        old_out_heads = array('q', [ -1 ]) * len(touched)
+        old_in_heads = array('q', [ -1 ]) * len(touched)
+        out_ranks = array('q', [ -1 ]) * len(touched)
+        in_ranks = array('q', [ -1 ]) * len(touched)
+        found = 0
+        for chunk in chunked(touched, Teamo.QUERY_BATCH):
             c.execute(
-                '''INSERT INTO Edge (`id`, `tail`, `head`, `backward`, `forward`, `revback`, `revfor`)
-                VALUES ({ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph})'''.format(ph=self._ph), 
-                (adjust_id(i), row[0], row[1], adjust_id(row[2]), adjust_id(row[3]), adjust_id(row[4]), adjust_id(row[5]))
+                '''SELECT Vertex.`id`, Vertex.`out_edge`, Vertex.`in_edge`, o.`out_rank`, i.`in_rank`
+                FROM Vertex LEFT JOIN Edge AS o ON o.`id`=Vertex.`out_edge` LEFT JOIN Edge AS i ON i.`id`=Vertex.`in_edge`
+                WHERE Vertex.`id` IN ({})'''.format(self._placeholders(len(chunk))),
+                chunk
             )
-        for i, j in enumerate(out_table):
-            # 同时排除了out_table[0]
-            if len(j) == 0:
-                continue
-            # 获取旧链表的表头
-            c.execute(
-                '''SELECT `out_edge` FROM Vertex WHERE `id`={ph}'''.format(ph=self._ph), (i,)
+            for (vertex_id, out_edge, in_edge, out_rank, in_rank) in c.fetchall():
+                p = position[vertex_id]
+                if out_edge is not None:
+                    old_out_heads[p] = out_edge
+                if in_edge is not None:
+                    old_in_heads[p] = in_edge
+                out_ranks[p] = Teamo._rank_before(out_rank)
+                in_ranks[p] = Teamo._rank_before(in_rank)
+                found += 1
+        if found != len(touched):
+            shouldNotHappen('边的端点不存在')
+        adjust_id = lambda x, i=new_id: None if x < 0 else x + i
+        nullable = lambda x: None if x < 0 else x
+        # label与data、位次和指针一起写入 不需要再逐条设置
+        # 新链表的最后一条边(后继为-1 即该点最早加入的新边)在插入时直接指向旧链表头 衔接新链表尾部与旧链表头部
+        # 新链表中排在第i条边之后的新边有behind[i]条 第i条边的位次为旧链表头的位次减一再减去behind[i]
+        for start in range(0, number, Teamo.ADD_EDGE_BATCH):
+            c.executemany(
+                '''INSERT INTO Edge (`id`, `tail`, `head`, `backward`, `forward`, `revback`, `revfor`, `label`, `data`,
+                    `out_rank`, `in_rank`)
+                VALUES ({ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph})'''.format(ph=self._ph),
+                [ (i + new_id, tails[i], heads[i],
+                    nullable(old_in_heads[position[heads[i]]]) if backwards[i] < 0 else backwards[i] + new_id,
+                    nullable(old_out_heads[position[tails[i]]]) if forwards[i] < 0 else forwards[i] + new_id,
+                    adjust_id(revbacks[i]), adjust_id(revfors[i]),
+                    None if labels is None else (labels[i] or None), None if datas is None else datas[i],
+                    out_ranks[position[tails[i]]] - out_behind[i],
+                    in_ranks[position[heads[i]]] - in_behind[i])
+                    for i in range(start, min(start + Teamo.ADD_EDGE_BATCH, number)) ]
             )
-            (out_id,) = c.fetchone()
-            # 更新Vertex上的顶点的出边链表表头索引
+        # 沿一个点的新链表数出它在每个label上新增的边数 逐个点产出Degree表的增量行 不必汇总整批边
+        def label_degrees(first: array, nexts: array, out: bool) -> Iterator[Tuple[int, int, int, int]]:
+            for v in touched:
+                counts = {}
+                i = first[v]
+                while i >= 0:
+                    if labels[i]:
+                        counts[labels[i]] = counts.get(labels[i], 0) + 1
+                    i = nexts[i]
+                for (code, n) in counts.items():
+                    yield (v, code, n, 0) if out else (v, code, 0, n)
+        # 每个点新增的度数即链表第一条新边之后的新边数加一 不必再逐条边计数
+        self._apply_degrees(
+            ( (v, out_behind[out_first[v]] + 1) for v in touched if out_first[v] >= 0 ),
+            ( (v, in_behind[in_first[v]] + 1) for v in touched if in_first[v] >= 0 ),
+            itertools.chain(label_degrees(out_first, forwards, True), label_degrees(in_first, backwards, False))
+                if labels else (), 1)
+        # 更新Vertex上的顶点的出边/入边链表表头索引
+        self._update_by_id('Vertex', 'out_edge', ( (v, out_first[v] + new_id) for v in touched if out_first[v] >= 0 ))
+        self._update_by_id('Vertex', 'in_edge', ( (v, in_first[v] + new_id) for v in touched if in_first[v] >= 0 ))
+        # 将旧的链表头节点的逆向参数revfor/revback补上
+        self._update_by_id('Edge', 'revfor', ( (old_out_heads[p], out_last[v] + new_id)
+            for (p, v) in enumerate(touched) if out_first[v] >= 0 and old_out_heads[p] >= 0 ))
+        self._update_by_id('Edge', 'revback', ( (old_in_heads[p], in_last[v] + new_id)
+            for (p, v) in enumerate(touched) if in_first[v] >= 0 and old_in_heads[p] >= 0 ))
+        self._commit(len(edges))
+        return range(new_id, new_id + len(edges))
+
+    # clustered布局的批量加边：新边的id从new_id开始 Edge中不写链表指针
+    def _add_edge_to_adjacency(self, edges: Sequence[Tuple], new_id: int) -> range:
+        c = self._conn.cursor()
+        touched = sorted(set(e[0] for e in edges).union(e[1] for e in edges))
+        found = 0
+        for chunk in chunked(touched, Teamo.QUERY_BATCH):
             c.execute(
-                '''UPDATE Vertex SET `out_edge`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (j[0] + new_id, i)
+                '''SELECT COUNT(*) FROM Vertex WHERE `id` IN ({})'''.format(self._placeholders(len(chunk))), chunk
             )
-            if out_id is not None:
-                # 衔接新链表尾部与旧链表头部
-                c.execute(
-                    '''UPDATE Edge SET `forward`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (out_id, j[-1] + new_id)
-                )
-                # 将旧的链表头节点的逆向参数revfor补上
-                c.execute(
-                    '''UPDATE Edge SET `revfor`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (j[-1] + new_id, out_id)
-                )
-        for i, j in enumerate(in_table):
-            # 同时排除了in_table[0]
-            if len(j) == 0:
-                continue
-            # 获取旧链表的表头
-            c.execute(
-                '''SELECT `in_edge` FROM Vertex WHERE `id`={ph}'''.format(ph=self._ph), (i,)
+            found += c.fetchone()[0]
+        if found != len(touched):
+            shouldNotHappen('边的端点不存在')
+        rows = [ (new_id + i, e[0], e[1], self._encode_label(e[2]) if len(e) > 2 else None, e[3] if len(e) > 3 else None)
+            for (i, e) in enumerate(edges) ]
+        for chunk in chunked(rows, Teamo.ADD_EDGE_BATCH):
+            c.executemany(
+                '''INSERT INTO Edge (`id`, `tail`, `head`, `label`, `data`) VALUES ({ph}, {ph}, {ph}, {ph}, {ph})'''.format(
+                    ph=self._ph),
+                chunk
+            )
+        self._add_adjacency([ (id_, tail, head, label) for (id_, tail, head, label, _) in rows ])
+        self._adjust_degrees([ (tail, head, label) for (_, tail, head, label, _) in rows ], 1)
+        self._commit(len(edges))
+        return range(new_id, new_id + len(edges))
+
+    # 按id批量更新某一列 pairs中的每一项为 (id, 新值) increment为True时为 (id, 增量)
+    # SQLite3中executemany没有网络往返；MySQL中则把一块 (id, 新值) 拼成派生表 用一条 UPDATE ... JOIN 完成
+    def _update_by_id(self, table: str, column: str, pairs: Iterable[Tuple[int, Any]], *,
+            increment: bool = False) -> None:
+        c = self._conn.cursor()
+        if self._base_db == 'SQLite3':
+            value_sql = '`{}`+{}'.format(column, self._ph) if increment else self._ph
+            c.executemany(
+                '''UPDATE `{}` SET `{}`={} WHERE `id`={ph}'''.format(table, column, value_sql, ph=self._ph),
+                ( (value, id_) for (id_, value) in pairs )
             )
-            (in_id,) = c.fetchone()
-            # 更新Vertex上的顶点的入边链表表头索引
+            return
+        value_sql = 't.`{}` + s.`value`'.format(column) if increment else 's.`value`'
+        for chunk in chunked(pairs, Teamo.QUERY_BATCH):
+            rows = ' UNION ALL '.join([ 'SELECT {ph} AS `id`, {ph} AS `value`'.format(ph=self._ph) ] * len(chunk))
             c.execute(
-                '''UPDATE Vertex SET `in_edge`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (j[0] + new_id, i)
+                '''UPDATE `{}` AS t JOIN ({}) AS s ON t.`id` = s.`id` SET t.`{}` = {}'''.format(table, rows, column, value_sql),
+                [ x for pair in chunk for x in pair ]
             )
-            if in_id is not None:
-                # 衔接新链表尾部与旧链表头部
-                c.execute(
-                    '''UPDATE Edge SET `backward`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (in_id, j[-1] + new_id)
-                )
-                # 将旧的链表头节点的逆向参数revback补上
-                c.execute(
-                    '''UPDATE Edge SET `revback`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (j[-1] + new_id, in_id)
-                )
-        self._conn.commit()
-
-    def _get_all_vertex(self) -> Sequence[int]:
-        c = self._conn.cursor()
-        # 获取Vertex Table中所有的rows中的id
-        c.execute(
-            '''SELECT `id` FROM Vertex'''
-        )
-        vertex_list = [ v[0] for v in c.fetchall() ]
-        return vertex_list
 
-    def _get_all_edge(self) -> Sequence[int]:
+    # 为新边构建一个方向上的链表：owners[i]为第i条边所属的点（出链表为tail 入链表为head）
+    # 与逐条_add_edge一样 同一个点下标越大（越晚加入）的新边在链表中越靠前 从前往后扫描一遍即可得到每条边的后继
+    # 返回 (后继, 前驱, 每个点链表的第一条边, 每个点链表的最后一条边, 每条边在链表中之后的新边数)
+    # 前四个都是下标 -1表示没有
+    @staticmethod
+    def _link_chain(owners: array, max_vertex_id: int) -> Tuple[array, array, array, array, array]:
+        number = len(owners)
+        nexts = array('q', [ -1 ]) * number
+        prevs = array('q', [ -1 ]) * number
+        behind = array('q', [ 0 ]) * number
+        first = array('q', [ -1 ]) * (max_vertex_id + 1)
+        last = array('q', [ -1 ]) * (max_vertex_id + 1)
+        for i in range(number):
+            owner = owners[i]
+            if owner < 1 or owner > max_vertex_id:
+                shouldNotHappen('边的端点不存在')
+            following = first[owner]
+            if following < 0:
+                last[owner] = i
+            else:
+                nexts[i] = following
+                prevs[following] = i
+                behind[i] = behind[following] + 1
+            first[owner] = i
+        return (nexts, prevs, first, last, behind)
+
+    # 插在位次为rank的链表头之前的边的位次 rank为None（空链表）时为-1
+    @staticmethod
+    def _rank_before(rank: Optional[int]) -> int:
+        return -1 if rank is None else rank - 1
+
+    # 流式导入SNAP格式的边列表文件：每行 "tail head"（多余的列忽略），以comment开头的行与空行跳过 支持.gz
+    # 文件中的id加上offset即为点的id 点不够时自动补齐（没有label与data）
+    # 每chunk_size条边调用一次_add_edge_in_one_branch 内存只与chunk_size和点数有关 与文件大小无关
+    # 返回导入的边数
+    def import_edge_list(self, path: str, *, offset: int = 0, chunk_size: int = 1000000,
+            comment: str = '#', verbose: bool = False) -> int:
+        if chunk_size <= 0:
+            shouldNotHappen('chunk_size必须是正整数')
         c = self._conn.cursor()
-        # 获取Edge Table中所有的rows中的id
-        c.execute(
-            '''SELECT `id` FROM Edge'''
-        )
-        edge_list = [ e[0] for e in c.fetchall() ]
-        return edge_list
+        c.execute('''SELECT MAX(id) FROM Vertex;''')
+        (max_vertex_id,) = c.fetchone()
+        if max_vertex_id is None:
+            max_vertex_id = 0
+        opener = gzip.open if path.endswith('.gz') else open
+        count = 0
+        t = time.time()
+        with opener(path, 'rt') as f:
+            def parse(lines):
+                for line in lines:
+                    if line.startswith(comment):
+                        continue
+                    fields = line.split()
+                    if len(fields) == 0:
+                        continue
+                    if len(fields) < 2:
+                        shouldNotHappen('无法解析的边: {}'.format(line.rstrip()))
+                    tail = int(fields[0]) + offset
+                    head = int(fields[1]) + offset
+                    if tail < 1 or head < 1:
+                        shouldNotHappen('点的id必须从1开始，请调整offset')
+                    yield (tail, head)
+            for edges in chunked(parse(f), chunk_size):
+                chunk_max_vertex_id = max(max(tail, head) for (tail, head) in edges)
+                if chunk_max_vertex_id > max_vertex_id:
+                    self._add_empty_vertex_in_batch(chunk_max_vertex_id - max_vertex_id)
+                    max_vertex_id = chunk_max_vertex_id
+                self._add_edge_in_one_branch(edges)
+                count += len(edges)
+                if verbose:
+                    elapsed = time.time() - t
+                    print('edge {} done. {:.2f}s {:.0f} edges/s'.format(count, elapsed, count / max(elapsed, 1e-9)))
+        return count
+
+    # 逐块取出Vertex Table中所有的rows中的id（按id排序 保证有其他索引时顺序不变）
+    def _get_all_vertex(self, size: int = QUERY_BATCH) -> Iterator[int]:
+        for (id_,) in self._iter_query('''SELECT `id` FROM Vertex ORDER BY `id`''', size=size):
+            yield id_
+
+    # 逐块取出Edge Table中所有的rows中的id（按id排序 保证有其他索引时顺序不变）
+    def _get_all_edge(self, size: int = QUERY_BATCH) -> Iterator[int]:
+        for (id_,) in self._iter_query('''SELECT `id` FROM Edge ORDER BY `id`''', size=size):
+            yield id_
 
     def _get_some_vertex(self, ids: Sequence[int]) -> Sequence[int]:
         # 通过id获得点 然而在这个项目中 点的id就代表点 只需要检查id是否合法
@@ -471,58 +1688,241 @@ class Teamo:
 
     # 获取点上附着的数据
     def _get_vertex_data(self, vertex_id: int) -> Optional[str]:
+        if self._cache is not None:
+            (hit, data) = self._cache.get(('Vertex', 'data', vertex_id))
+            if hit:
+                return data
         c = self._conn.cursor()
         c.execute('''SELECT `data` FROM Vertex WHERE `id`={ph}'''.format(ph=self._ph), (vertex_id,))
         (data,) = c.fetchone()
+        if self._cache is not None:
+            self._cache.put(('Vertex', 'data', vertex_id), data)
         return data
 
     # 设置点上附着的数据
     def _set_vertex_data(self, vertex_id: int, data: str):
         c = self._conn.cursor()
         c.execute('''UPDATE Vertex SET `data`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (data, vertex_id))
-        self._conn.commit()
+        if self._cache is not None:
+            self._cache.discard(('Vertex', 'data', vertex_id))
+            self._cache.discard(('Vertex', 'json', vertex_id))
+        self._commit()
 
     # 获取点上附着的label
     def _get_vertex_label(self, vertex_id: int) -> Optional[str]:
+        if self._cache is not None:
+            (hit, label) = self._cache.get(('Vertex', 'label', vertex_id))
+            if hit:
+                return label
         c = self._conn.cursor()
         c.execute('''SELECT `label` FROM Vertex WHERE `id`={ph}'''.format(ph=self._ph), (vertex_id,))
-        (label,) = c.fetchone()
+        (code,) = c.fetchone()
+        label = self._decode_label(code)
+        if self._cache is not None:
+            self._cache.put(('Vertex', 'label', vertex_id), label)
         return label
 
     # 设置点上附着的label
     def _set_vertex_label(self, vertex_id: int, label: str):
         c = self._conn.cursor()
-        c.execute('''UPDATE Vertex SET `label`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (label, vertex_id))
-        self._conn.commit()
+        c.execute('''UPDATE Vertex SET `label`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (self._encode_label(label), vertex_id))
+        if self._cache is not None:
+            self._cache.discard(('Vertex', 'label', vertex_id))
+        self._commit()
 
     # 获取边上附着的数据
     def _get_edge_data(self, edge_id: int) -> Optional[str]:
+        if self._cache is not None:
+            (hit, data) = self._cache.get(('Edge', 'data', edge_id))
+            if hit:
+                return data
         c = self._conn.cursor()
         c.execute('''SELECT `data` FROM Edge WHERE `id`={ph}'''.format(ph=self._ph), (edge_id,))
         (data,) = c.fetchone()
+        if self._cache is not None:
+            self._cache.put(('Edge', 'data', edge_id), data)
         return data
 
     # 设置边上附着的数据 
     def _set_edge_data(self, edge_id: int, data: str):
         c = self._conn.cursor()
         c.execute('''UPDATE Edge SET `data`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (data, edge_id))
-        self._conn.commit()
+        if self._cache is not None:
+            self._cache.discard(('Edge', 'data', edge_id))
+            self._cache.discard(('Edge', 'json', edge_id))
+        self._commit()
 
     # 获取边上附着的label
     def _get_edge_label(self, edge_id: int) -> Optional[str]:
+        if self._cache is not None:
+            (hit, label) = self._cache.get(('Edge', 'label', edge_id))
+            if hit:
+                return label
         c = self._conn.cursor()
         c.execute('''SELECT `label` FROM Edge WHERE `id`={ph}'''.format(ph=self._ph), (edge_id,))
-        (label,) = c.fetchone()
+        (code,) = c.fetchone()
+        label = self._decode_label(code)
+        if self._cache is not None:
+            self._cache.put(('Edge', 'label', edge_id), label)
         return label
 
     # 设置边上附着的label 
     def _set_edge_label(self, edge_id: int, label: str):
         c = self._conn.cursor()
-        c.execute('''UPDATE Edge SET `label`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (label, edge_id))
-        self._conn.commit()
+        code = self._encode_label(label)
+        self._relabel_degrees([ edge_id ], code)
+        c.execute('''UPDATE Edge SET `label`={ph} WHERE `id`={ph}'''.format(ph=self._ph), (code, edge_id))
+        if self._is_clustered():
+            self._relabel_adjacency([ edge_id ], code)
+        if self._cache is not None:
+            self._cache.discard(('Edge', 'label', edge_id))
+        self._commit()
+
+    # 批量获取一块点/边（不超过QUERY_BATCH个）的label或data 返回 {id: 值}
+    # table为'Vertex'或'Edge' column为'label'或'data'
+    def _get_column_in_batch(self, table: str, column: str, ids: Sequence[int], *,
+            use_cache: bool = True) -> Dict[int, Optional[str]]:
+        found = {}
+        ids = set(ids)
+        use_cache = use_cache and self._cache is not None
+        if use_cache:
+            for id_ in ids:
+                (hit, value) = self._cache.get((table, column, id_))
+                if hit:
+                    found[id_] = value
+            ids = [ id_ for id_ in ids if id_ not in found ]
+        else:
+            ids = list(ids)
+        if len(ids) == 0:
+            return found
+        c = self._conn.cursor()
+        c.execute(
+            '''SELECT `id`, `{}` FROM `{}` WHERE `id` IN ({})'''.format(column, table, self._placeholders(len(ids))),
+            ids
+        )
+        for (id_, value) in c.fetchall():
+            if column == 'label':
+                value = self._decode_label(value)
+            found[id_] = value
+            if use_cache:
+                self._cache.put((table, column, id_), value)
+        return found
+
+    # 把一组点/边的label或data设为同一个值 每块一条 UPDATE ... WHERE id IN (...)，全部在同一个事务中提交
+    def _set_column_in_batch(self, table: str, column: str, ids: Iterable[int], value: Optional[str]) -> None:
+        ids = set(ids)
+        c = self._conn.cursor()
+        try:
+            if column == 'label':
+                value = self._encode_label(value)
+            if table == 'Edge' and column == 'label':
+                self._relabel_degrees(ids, value)
+            for chunk in chunked(ids, Teamo.QUERY_BATCH):
+                c.execute(
+                    '''UPDATE `{}` SET `{}`={} WHERE `id` IN ({})'''.format(
+                        table, column, self._ph, self._placeholders(len(chunk))),
+                    [ value ] + chunk
+                )
+            if table == 'Edge' and column == 'label' and self._is_clustered():
+                self._relabel_adjacency(ids, value)
+        except Exception:
+            # 在批次中由batch()负责回滚
+            if not self.in_batch():
+                self._conn.rollback()
+                # 回滚后新加入的label编码可能已不存在
+                self._label_codes = None
+                self._label_names = None
+            raise
+        finally:
+            if self._cache is not None:
+                for id_ in ids:
+                    self._cache.discard((table, column, id_))
+                    if column == 'data':
+                        self._cache.discard((table, 'json', id_))
+        self._commit(len(ids))
+
+    def _get_vertex_label_in_batch(self, vertex_ids: Sequence[int]) -> Dict[int, Optional[str]]:
+        return self._get_column_in_batch('Vertex', 'label', vertex_ids)
+
+    def _get_vertex_data_in_batch(self, vertex_ids: Sequence[int]) -> Dict[int, Optional[str]]:
+        return self._get_column_in_batch('Vertex', 'data', vertex_ids)
+
+    def _get_edge_label_in_batch(self, edge_ids: Sequence[int]) -> Dict[int, Optional[str]]:
+        return self._get_column_in_batch('Edge', 'label', edge_ids)
+
+    def _get_edge_data_in_batch(self, edge_ids: Sequence[int]) -> Dict[int, Optional[str]]:
+        return self._get_column_in_batch('Edge', 'data', edge_ids)
+
+    def _set_vertex_label_in_batch(self, vertex_ids: Iterable[int], label: Optional[str]) -> None:
+        self._set_column_in_batch('Vertex', 'label', vertex_ids, label)
+
+    def _set_vertex_data_in_batch(self, vertex_ids: Iterable[int], data: Optional[str]) -> None:
+        self._set_column_in_batch('Vertex', 'data', vertex_ids, data)
+
+    def _set_edge_label_in_batch(self, edge_ids: Iterable[int], label: Optional[str]) -> None:
+        self._set_column_in_batch('Edge', 'label', edge_ids, label)
+
+    def _set_edge_data_in_batch(self, edge_ids: Iterable[int], data: Optional[str]) -> None:
+        self._set_column_in_batch('Edge', 'data', edge_ids, data)
+
+    # 批量取出一块点/边的data中keys对应的值 返回 {id: {key: 值}} data中不存在的key不出现在字典中
+    # 返回的字典至少含有keys（在Python中解析时就是整个data 不再另外投影）；data为NULL时视为没有任何属性
+    # 开启缓存时 整个解析后的字典以 (表名, 'json', id) 缓存 重复投影时不再传输与解析；
+    # 否则MySQL把取值下推到数据库（JSON_EXTRACT返回JSON文本） 只传输需要的部分
+    # SQLite3在进程内 没有传输开销 逐个key在库内解析反而比在Python中解析一次整个data更慢
+    def _get_properties_in_batch(self, table: str, ids: Sequence[int],
+            keys: Optional[Sequence[str]] = None) -> Dict[int, Dict[str, Any]]:
+        if keys is None or self._cache is not None or not self._support_json_extract(keys):
+            return self._get_parsed_data_in_batch(table, ids)
+        ids = list(set(ids))
+        if len(ids) == 0:
+            return {}
+        c = self._conn.cursor()
+        c.execute(
+            '''SELECT `id`, {} FROM `{}` WHERE `id` IN ({})'''.format(
+                ', '.join([ 'JSON_EXTRACT(`data`, {})'.format(self._ph) ] * len(keys)), table, self._placeholders(len(ids))),
+            [ self._json_path(key) for key in keys ] + ids
+        )
+        properties = {}
+        for row in c.fetchall():
+            properties[row[0]] = { key: json.loads(value) for key, value in zip(keys, row[1:]) if value is not None }
+        return properties
+
+    # 批量取出一块点/边解析后的data 返回 {id: 字典}
+    def _get_parsed_data_in_batch(self, table: str, ids: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+        if self._cache is None:
+            return { id_: {} if data is None else json.loads(data)
+                for (id_, data) in self._get_column_in_batch(table, 'data', ids).items() }
+        parsed = {}
+        missing = []
+        for id_ in set(ids):
+            (hit, props) = self._cache.get((table, 'json', id_))
+            if hit:
+                parsed[id_] = props
+            else:
+                missing.append(id_)
+        # 只缓存解析后的字典 不再重复缓存原始的data
+        for (id_, data) in self._get_column_in_batch(table, 'data', missing, use_cache=False).items():
+            props = {} if data is None else json.loads(data)
+            parsed[id_] = props
+            self._cache.put((table, 'json', id_), props)
+        return parsed
+
+    # 只有MySQL下推取值；含有引号或反斜杠的key无法写成JSON路径 只能在Python中解析
+    def _support_json_extract(self, keys: Sequence[str]) -> bool:
+        if any('"' in key or '\\' in key for key in keys):
+            return False
+        return self._base_db == 'MySQL'
+
+    # data中顶层key对应的JSON路径 例如 name => $."name"
+    @staticmethod
+    def _json_path(key: str) -> str:
+        return '$."{}"'.format(key)
 
     # 获取点的所有出边
     def _get_out_edge(self, vertex_id: int) -> Sequence[int]:
+        if self._is_clustered():
+            return self._get_adjacent_edge(vertex_id, 'out')
         c = self._conn.cursor()
         edge_list = []
         # 先获得顶点的出边链表引用
@@ -542,6 +1942,11 @@ class Teamo:
         return edge_list
 
     def _get_out_edge_by_label(self, vertex_id: int, labels: Sequence[str]) -> Sequence[int]:
+        if self._is_clustered():
+            return self._get_adjacent_edge(vertex_id, 'out', labels) if labels else []
+        if self._has_rank_index('out'):
+            return self._walk_edge_chains([ vertex_id ], 'out', labels).get(vertex_id, []) if labels else []
+        codes = set(self._label_codes_of(labels))
         c = self._conn.cursor()
         edge_list = []
         c.execute(
@@ -554,14 +1959,16 @@ class Teamo:
             c.execute(
                 '''SELECT `id`, `forward`, `label` FROM Edge WHERE `id`={ph}'''.format(ph=self._ph), (current_id,)
             )
-            (id_, forward, label) = c.fetchone()
-            if label in labels:
+            (id_, forward, code) = c.fetchone()
+            if code in codes:
                 edge_list.append(id_)
             current_id = forward
         return edge_list
 
     # 获取点的所有入边
     def _get_in_edge(self, vertex_id: int) -> Sequence[int]:
+        if self._is_clustered():
+            return self._get_adjacent_edge(vertex_id, 'in')
         c = self._conn.cursor()
         edge_list = []
         # 先获得顶点的出边链表引用
@@ -581,6 +1988,11 @@ class Teamo:
         return edge_list
 
     def _get_in_edge_by_label(self, vertex_id: int, labels: Sequence[str]) -> Sequence[int]:
+        if self._is_clustered():
+            return self._get_adjacent_edge(vertex_id, 'in', labels) if labels else []
+        if self._has_rank_index('in'):
+            return self._walk_edge_chains([ vertex_id ], 'in', labels).get(vertex_id, []) if labels else []
+        codes = set(self._label_codes_of(labels))
         c = self._conn.cursor()
         edge_list = []
         c.execute(
@@ -593,12 +2005,140 @@ class Teamo:
             c.execute(
                 '''SELECT `id`, `backward`, `label` FROM Edge WHERE `id`={ph}'''.format(ph=self._ph), (current_id,)
             )
-            (id_, backward, label) = c.fetchone()
-            if label in labels:
+            (id_, backward, code) = c.fetchone()
+            if code in codes:
                 edge_list.append(id_)
             current_id = backward
         return edge_list
 
+    # 沿十字链表批量遍历一组点的出边或入边链表 direction为'out'或'in'
+    # target_column为要取出的Edge列：`id`即邻接边，`head`/`tail`即邻接点
+    # 返回 {点id: [target, ...]}，每个点的结果保持其在链表中的顺序
+    # 若Edge上有链表所属点(tail/head)的索引 则按索引一次取出整块点的所有边再在内存中按指针排序
+    # 否则整块点用一条沿指针的递归查询完成 递归深度即最长链表的长度；指定labels且有 (所属点, label, 位次) 索引时只扫描这些label的边
+    # MySQL的递归深度受cte_max_recursion_depth（默认1000）限制 因此总是按tail/head取出后在内存中排序（没有索引时为全表扫描）
+    def _walk_edge_chains(self, vertex_ids: Sequence[int], direction: str,
+            labels: Optional[Sequence[str]] = None, target_column: str = 'id') -> Dict[int, List[int]]:
+        if self._is_clustered():
+            return self._scan_adjacency(vertex_ids, direction, labels, target_column)
+        vertex_ids = list(set(vertex_ids))
+        if len(vertex_ids) == 0:
+            return {}
+        (head_column, next_column, key_column) = Teamo.CHAIN_COLUMNS[direction]
+        if labels:
+            labels = self._label_codes_of(labels)
+            if len(labels) == 0:
+                return {}
+            if self._has_rank_index(direction):
+                return self._scan_ranks(vertex_ids, direction, labels, target_column)
+        c = self._conn.cursor()
+        if self._has_index('Edge', key_column) or self._base_db == 'MySQL':
+            c.execute(
+                '''SELECT `id`, `{}` FROM Vertex WHERE `id` IN ({})'''.format(
+                    head_column, self._placeholders(len(vertex_ids))),
+                vertex_ids
+            )
+            chain_heads = c.fetchall()
+            c.execute(
+                '''SELECT `id`, `{}`, `{}`, `label` FROM Edge WHERE `{}` IN ({})'''.format(
+                    next_column, target_column, key_column, self._placeholders(len(vertex_ids))),
+                vertex_ids
+            )
+            nodes = { id_: (next_, target, label) for (id_, next_, target, label) in c.fetchall() }
+            adjacency = {}
+            for (vertex, current_id) in chain_heads:
+                targets = []
+                while current_id is not None:
+                    (current_id, target, label) = nodes[current_id]
+                    if not labels or label in labels:
+                        targets.append(target)
+                if targets:
+                    adjacency[vertex] = targets
+            return adjacency
+        args = list(vertex_ids)
+        label_filter = ''
+        if labels:
+            label_filter = 'WHERE `label` IN ({})'.format(self._placeholders(len(labels)))
+            args.extend(labels)
+        c.execute(
+            '''WITH RECURSIVE chain(`vertex`, `target`, `next`, `label`, `depth`) AS (
+                SELECT Vertex.`id`, Edge.`{target}`, Edge.`{next}`, Edge.`label`, 0
+                FROM Vertex JOIN Edge ON Edge.`id`=Vertex.`{head}`
+                WHERE Vertex.`id` IN ({vs})
+                UNION ALL
+                SELECT chain.`vertex`, Edge.`{target}`, Edge.`{next}`, Edge.`label`, chain.`depth` + 1
+                FROM chain JOIN Edge ON Edge.`id`=chain.`next`
+            )
+            SELECT `vertex`, `target` FROM chain {where} ORDER BY `vertex`, `depth`'''.format(
+                head=head_column, next=next_column, target=target_column,
+                vs=self._placeholders(len(vertex_ids)), where=label_filter),
+            args
+        )
+        adjacency = {}
+        for (vertex, target) in c.fetchall():
+            adjacency.setdefault(vertex, []).append(target)
+        return adjacency
+
+    # Edge上是否有某个方向的 (所属点, label, 位次) 索引
+    def _has_rank_index(self, direction: str) -> bool:
+        (key_column, rank_column) = Teamo.RANK_COLUMNS[direction]
+        return any(table == 'Edge' and columns[:3] == (key_column, 'label', rank_column)
+            for (_, table, columns) in self.list_indexes())
+
+    # 按 (所属点, label, 位次) 索引取出一组点中label编码属于codes的邻接边 每个点的结果按位次排序 即链表中的顺序
+    # 只读取匹配的边 与点的其他label的边数无关
+    def _scan_ranks(self, vertex_ids: Sequence[int], direction: str, codes: Sequence[int],
+            target_column: str = 'id') -> Dict[int, List[int]]:
+        (key_column, rank_column) = Teamo.RANK_COLUMNS[direction]
+        c = self._conn.cursor()
+        c.execute(
+            '''SELECT `{key}`, `{target}` FROM Edge WHERE `{key}` IN ({vs}) AND `label` IN ({ls})
+            ORDER BY `{key}`, `{rank}`'''.format(key=key_column, target=target_column, rank=rank_column,
+                vs=self._placeholders(len(vertex_ids)), ls=self._placeholders(len(codes))),
+            list(vertex_ids) + list(codes)
+        )
+        adjacency = {}
+        for (vertex, target) in c.fetchall():
+            adjacency.setdefault(vertex, []).append(target)
+        return adjacency
+
+    # 批量获取一块点（不超过QUERY_BATCH个）的出边 每个点的结果与_get_out_edge/_get_out_edge_by_label一致
+    def _get_out_edge_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, List[int]]:
+        return self._walk_edge_chains(vertex_ids, 'out', labels)
+
+    # 批量获取一块点（不超过QUERY_BATCH个）的入边 每个点的结果与_get_in_edge/_get_in_edge_by_label一致
+    def _get_in_edge_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, List[int]]:
+        return self._walk_edge_chains(vertex_ids, 'in', labels)
+
+    # 批量获取一块点的出边邻接点（即出边的head） 不经过中间的边集
+    def _get_out_neighbor_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, List[int]]:
+        return self._walk_edge_chains(vertex_ids, 'out', labels, 'head')
+
+    # 批量获取一块点的入边邻接点（即入边的tail） 不经过中间的边集
+    def _get_in_neighbor_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, List[int]]:
+        return self._walk_edge_chains(vertex_ids, 'in', labels, 'tail')
+
+    # 批量获取一块边（不超过QUERY_BATCH个）的两个端点 返回 {边id: (tail, head)}
+    def _get_vertex_of_edge_in_batch(self, edge_ids: Sequence[int]) -> Dict[int, Tuple[int, int]]:
+        edge_ids = list(set(edge_ids))
+        if len(edge_ids) == 0:
+            return {}
+        c = self._conn.cursor()
+        c.execute(
+            '''SELECT `id`, `tail`, `head` FROM Edge WHERE `id` IN ({})'''.format(self._placeholders(len(edge_ids))),
+            edge_ids
+        )
+        return { id_: (tail, head) for (id_, tail, head) in c.fetchall() }
+
+    # 顺序扫描整个Edge表逐块取出所有边的端点 (tail, head)，顺序与_get_all_edge一致
+    # 用于边集为全部边时（如 g.E().bothV()），避免再按id逐块查询
+    def _get_vertex_of_all_edge(self, size: int = QUERY_BATCH) -> Iterator[Tuple[int, int]]:
+        return self._iter_query('''SELECT `tail`, `head` FROM Edge ORDER BY `id`''', size=size)
+
     def _get_in_vertex(self, edge_id: int) -> int:
         c = self._conn.cursor()
         c.execute(
@@ -615,76 +2155,499 @@ class Teamo:
         (tail,) = c.fetchone()
         return tail
 
+    # 保留点集中label属于labels的点 顺序与重复均保持不变
     def _filter_vertex_by_labels(self, vertex_ids: Sequence[int], labels: Sequence[str]) -> Sequence[int]:
-        if len(vertex_ids) == 0 or len(labels) == 0:
-            return vertex_ids
+        return self._filter_by_labels('Vertex', vertex_ids, labels)
+
+    # 保留边集中label属于labels的边 顺序与重复均保持不变
+    def _filter_edge_by_labels(self, edge_ids: Sequence[int], labels: Sequence[str]) -> Sequence[int]:
+        return self._filter_by_labels('Edge', edge_ids, labels)
+
+    def _filter_by_labels(self, table: str, ids: Sequence[int], labels: Sequence[str]) -> Sequence[int]:
+        if len(ids) == 0 or len(labels) == 0:
+            return ids
+        codes = self._label_codes_of(labels)
+        if len(codes) == 0:
+            return []
         c = self._conn.cursor()
-        args = list(vertex_ids) + list(labels)
-        c.execute(
-            '''SELECT `id` FROM Vertex WHERE `id` IN ({ph}'''.format(ph=self._ph) +
-            ',{ph}'.format(ph=self._ph) * (len(vertex_ids) - 1) +
-            ''') AND `label` IN ({ph}'''.format(ph=self._ph) +
-            ',{ph}'.format(ph=self._ph) * (len(labels) - 1) +
-            ')',
-            args
+        result = []
+        # 分块按主键查询 避免一次性构造巨大的 IN (...)
+        for chunk in chunked(ids, Teamo.QUERY_BATCH):
+            unique_ids = list(set(chunk))
+            c.execute(
+                '''SELECT `id` FROM `{}` WHERE `id` IN ({}) AND `label` IN ({})'''.format(
+                    table, self._placeholders(len(unique_ids)), self._placeholders(len(codes))),
+                unique_ids + codes
+            )
+            matched = set(row[0] for row in c.fetchall())
+            result.extend(i for i in chunk if i in matched)
+        return result
+
+    ##########################################
+    #      property filter (has step)        #
+    ##########################################
+
+    # 与P中的类型对应的JSON类型名
+    JSON_TYPES = {
+        'SQLite3': { 'number': ('integer', 'real'), 'string': ('text',), 'boolean': ('true', 'false') },
+        'MySQL': { 'number': ('INTEGER', 'UNSIGNED INTEGER', 'DOUBLE', 'DECIMAL'), 'string': ('STRING',),
+            'boolean': ('BOOLEAN',) },
+    }
+    SQL_OPERATORS = { 'eq': '=', 'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>=' }
+
+    # 把 has(key) / has(key, predicate) 编译成作用于data列的SQL条件 返回 (条件, 参数)
+    # SQLite3用json_type/json_extract；MySQL用JSON_TYPE/JSON_EXTRACT 并把值转为JSON再比较
+    # 先判断JSON类型再比较值 与P.test的语义一致（不同类型的值之间不比较）
+    # JSON路径直接写进SQL而不是作为参数 这样SQLite3才能匹配上属性索引的表达式；
+    # MySQL中字符串的比较改用属性索引的生成列（按字节比较） 生成列中没有的长字符串仍按JSON路径比较
+    def _property_condition(self, table: str, key: str, predicate: Optional[P]) -> Tuple[str, List[Any]]:
+        path = "'{}'".format(self._json_path(key).replace("'", "''"))
+        if self._base_db == 'SQLite3':
+            type_sql = 'json_type(`data`, {})'.format(path)
+            value_sql = 'json_extract(`data`, {})'.format(path)
+            null_type = 'null'
+        else:
+            type_sql = 'JSON_TYPE(JSON_EXTRACT(`data`, {}))'.format(path)
+            value_sql = 'JSON_EXTRACT(`data`, {})'.format(path)
+            null_type = 'NULL'
+        indexed_column = None
+        if self._base_db == 'MySQL' and self._has_property_index(table, key):
+            indexed_column = '`{}`'.format(Teamo._property_column(key))
+        if predicate is None:
+            return ('{} IS NOT NULL'.format(type_sql), [])
+        def compare(operator: str, value: Any) -> Tuple[str, List[Any]]:
+            kind = P._kind(value)
+            types = ', '.join("'{}'".format(t) for t in Teamo.JSON_TYPES[self._base_db][kind])
+            sql_operator = Teamo.SQL_OPERATORS[operator]
+            if self._base_db == 'SQLite3':
+                return ('({} IN ({}) AND {} {} ?)'.format(type_sql, types, value_sql, sql_operator), [ value ])
+            json_sql = '{} {} CAST(%s AS JSON)'.format(value_sql, sql_operator)
+            if indexed_column is None or kind != 'string':
+                return ('({} IN ({}) AND {})'.format(type_sql, types, json_sql), [ json.dumps(value) ])
+            if operator == 'eq':
+                # 生成列中只有不超过长度的字符串 超过长度的值只可能等于生成列之外的字符串
+                if len(value.encode('utf-8')) > Teamo.PROPERTY_INDEX_BYTES:
+                    return ('({} IN ({}) AND {})'.format(type_sql, types, json_sql), [ json.dumps(value) ])
+                # 写成IS NOT NULL AND 使生成列为NULL时条件为假而不是NULL（neq/without会对它取NOT）
+                return ('({} IS NOT NULL AND {} = CAST(%s AS BINARY))'.format(indexed_column, indexed_column), [ value ])
+            # 范围比较：生成列为NULL的字符串即超过长度的字符串 只能按JSON路径比较
+            return ('({} IN ({}) AND ({} {} CAST(%s AS BINARY) OR {} IS NULL AND {}))'.format(type_sql, types,
+                indexed_column, sql_operator, indexed_column, json_sql), [ value, json.dumps(value) ])
+        if predicate.operator in ('within', 'without', 'neq'):
+            parts = [ compare('eq', value) for value in predicate.values ]
+            matched = '({})'.format(' OR '.join(sql for (sql, _) in parts))
+            args = [ arg for (_, part_args) in parts for arg in part_args ]
+            if predicate.operator == 'within':
+                return (matched, args)
+            # neq/without：key存在且值不为null 且不等于任何一个值
+            return ("({} IS NOT NULL AND {} <> '{}' AND NOT {})".format(type_sql, type_sql, null_type, matched), args)
+        return compare(predicate.operator, predicate.values[0])
+
+    # key中含有引号或反斜杠时无法写成JSON路径 只能取出data在Python中判断
+    @staticmethod
+    def _can_push_down(key: str) -> bool:
+        return '"' not in key and '\\' not in key
+
+    # 过滤出data满足 has(key, predicate) 的点/边 保持ids的顺序（重复的id重复输出）
+    def _filter_by_property(self, table: str, ids: Sequence[int], key: str, predicate: Optional[P]) -> Sequence[int]:
+        if len(ids) == 0:
+            return ids
+        result = []
+        if not Teamo._can_push_down(key):
+            for chunk in chunked(ids, Teamo.QUERY_BATCH):
+                properties = self._get_parsed_data_in_batch(table, chunk)
+                result.extend(i for i in chunk if i in properties and (key in properties[i]
+                    if predicate is None else predicate.test(properties[i], key)))
+            return result
+        (condition, args) = self._property_condition(table, key, predicate)
+        c = self._conn.cursor()
+        for chunk in chunked(ids, Teamo.QUERY_BATCH):
+            unique_ids = list(set(chunk))
+            c.execute(
+                '''SELECT `id` FROM `{}` WHERE `id` IN ({}) AND {}'''.format(
+                    table, self._placeholders(len(unique_ids)), condition),
+                unique_ids + args
+            )
+            matched = set(row[0] for row in c.fetchall())
+            result.extend(i for i in chunk if i in matched)
+        return result
+
+    def _filter_vertex_by_property(self, vertex_ids: Sequence[int], key: str, predicate: Optional[P]) -> Sequence[int]:
+        return self._filter_by_property('Vertex', vertex_ids, key, predicate)
+
+    def _filter_edge_by_property(self, edge_ids: Sequence[int], key: str, predicate: Optional[P]) -> Sequence[int]:
+        return self._filter_by_property('Edge', edge_ids, key, predicate)
+
+    # 逐块取出整张表中data满足 has(key, predicate) 的点/边（按id排序） 即 g.V().has(...)
+    def _get_by_property(self, table: str, key: str, predicate: Optional[P], size: int = QUERY_BATCH) -> Iterator[int]:
+        if not Teamo._can_push_down(key):
+            for chunk in chunked(self._iter_query('''SELECT `id` FROM `{}` ORDER BY `id`'''.format(table), (), size), size):
+                yield from self._filter_by_property(table, [ id_ for (id_,) in chunk ], key, predicate)
+            return
+        yield from self._iter_where(table, [ self._property_condition_of(table, key, predicate) ], size)
+
+    # has(key, predicate)的条件 (条件, 参数, 是否有属性索引) 用于_iter_where/_count_where
+    def _property_condition_of(self, table: str, key: str, predicate: Optional[P]) -> Tuple[str, List[Any], bool]:
+        (condition, args) = self._property_condition(table, key, predicate)
+        return (condition, args, self._has_property_index(table, key))
+
+    # hasLabel(*labels)的条件 (条件, 参数, False) 字典中没有的label不会匹配任何点/边
+    def _label_condition(self, labels: Sequence[str]) -> Tuple[str, List[Any], bool]:
+        codes = self._label_codes_of(labels)
+        if len(codes) == 0:
+            return ('1=0', [], False)
+        return ('`label` IN ({})'.format(self._placeholders(len(codes))), codes, False)
+
+    # 把一组条件用AND连接成WHERE子句 返回 (子句, 参数)
+    @staticmethod
+    def _where_clause(conditions: Sequence[Tuple[str, List[Any], bool]]) -> Tuple[str, List[Any]]:
+        if len(conditions) == 0:
+            return ('', [])
+        return ('WHERE ' + ' AND '.join(sql for (sql, _, _) in conditions), [ arg for (_, args, _) in conditions for arg in args ])
+
+    # 逐块取出表中满足所有条件的id（按id排序） 即由V()/E()起始、只经过hasLabel/has的点集/边集
+    # limit不为None时只取下标在 [offset, offset + limit) 中的id；limit为None而offset大于0时取到末尾
+    def _iter_where(self, table: str, conditions: Sequence[Tuple[str, List[Any], bool]], size: int = QUERY_BATCH, *,
+            limit: Optional[int] = None, offset: int = 0) -> Iterator[int]:
+        (where, args) = Teamo._where_clause(conditions)
+        # 有属性索引时写成 +id：否则SQLite3为避免排序会选择按id全表扫描 而不走属性索引的范围查找
+        order = '+`id`' if any(indexed for (_, _, indexed) in conditions) else '`id`'
+        page = ''
+        if limit is not None or offset > 0:
+            # SQLite3中LIMIT -1即不限行数；MySQL没有这种写法 只能写一个足够大的数
+            if limit is None:
+                limit = -1 if self._base_db == 'SQLite3' else 2 ** 64 - 1
+            page = 'LIMIT {ph} OFFSET {ph}'.format(ph=self._ph)
+            args = args + [ limit, offset ]
+        rows = self._iter_query(
+            '''SELECT `id` FROM `{}` {} ORDER BY {} {}'''.format(table, where, order, page), args, size
         )
-        result_vertexs = [ row[0] for row in c.fetchall() ]
-        return result_vertexs
+        for (id_,) in rows:
+            yield id_
+
+    # 表中满足所有条件的行数 即 g.V().hasLabel(...).count() 不取出任何id
+    def _count_where(self, table: str, conditions: Sequence[Tuple[str, List[Any], bool]]) -> int:
+        (where, args) = Teamo._where_clause(conditions)
+        c = self._conn.cursor()
+        c.execute('''SELECT COUNT(*) FROM `{}` {}'''.format(table, where), args)
+        (number,) = c.fetchone()
+        return number
+
+    def _get_vertex_by_property(self, key: str, predicate: Optional[P], size: int = QUERY_BATCH) -> Iterator[int]:
+        return self._get_by_property('Vertex', key, predicate, size)
+
+    def _get_edge_by_property(self, key: str, predicate: Optional[P], size: int = QUERY_BATCH) -> Iterator[int]:
+        return self._get_by_property('Edge', key, predicate, size)
+
+    # 逐块取出所有label属于labels的点（按id排序） 即 g.V().hasLabel(*labels)，可走Vertex(label)索引
+    def _get_vertex_by_labels(self, labels: Sequence[str], size: int = QUERY_BATCH) -> Iterator[int]:
+        return self._get_by_labels('Vertex', labels, size)
+
+    # 逐块取出所有label属于labels的边（按id排序） 即 g.E().hasLabel(*labels)，可走Edge(label)索引
+    def _get_edge_by_labels(self, labels: Sequence[str], size: int = QUERY_BATCH) -> Iterator[int]:
+        return self._get_by_labels('Edge', labels, size)
+
+    def _get_by_labels(self, table: str, labels: Sequence[str], size: int) -> Iterator[int]:
+        if len(self._label_codes_of(labels)) == 0:
+            return
+        yield from self._iter_where(table, [ self._label_condition(labels) ], size)
+
+    # 顺序扫描Vertex表与Edge表 构建只读的内存CSR快照（见CSRSnapshot）
+    def snapshot(self) -> 'CSRSnapshot':
+        return CSRSnapshot(self)
+
+    # 传入snapshot时 遍历中的邻接/端点/label过滤等只读步骤都在快照上执行 不再查询数据库
+    # chunk_size为遍历中每块处理的id个数（也是每个 IN (...) 的大小） 越大往返越少但内存峰值越高
+    # compiled为True时V()/E()返回CompiledTraversal 把连续的可编译步骤写成一条SQL（见CompiledTraversal）
+    def traversal(self, *, snapshot: Optional['CSRSnapshot'] = None,
+            chunk_size: int = QUERY_BATCH, compiled: bool = False) -> 'GraphTraversalSource':
+        return GraphTraversalSource(self, snapshot=snapshot, chunk_size=chunk_size, compiled=compiled)
+
+
+# 图的只读内存快照 以CSR（压缩稀疏行）格式保存出、入两个方向的邻接关系
+# 每个方向由offset数组和target/边id/label编码三个数组组成：
+#   点在_vertex_ids中的下标为i，则其出边为 _out_edges[_out_offsets[i]:_out_offsets[i+1]]
+# 每个点的边按其在十字链表中的顺序排列，因此遍历结果与直接查询数据库一致
+# 快照只在构建时扫描一遍Vertex表与Edge表，之后对图的修改不会反映到快照中
+# 它实现了Teamo中遍历所用的批量读方法，GraphTraversal在快照模式下直接调用它们
+class CSRSnapshot:
+    def __init__(self, graph: Teamo):
+        # label字典 编码0表示没有label(None)
+        self._label_names = [ None ]
+        self._label_codes = { None: 0 }
+        # 点（按id排序）
+        self._vertex_ids = array('q')
+        self._vertex_labels = array('i')
+        out_heads = array('q')
+        in_heads = array('q')
+        rows = graph._iter_query('''SELECT `id`, `out_edge`, `in_edge`, `label` FROM Vertex ORDER BY `id`''')
+        for (id_, out_edge, in_edge, label) in rows:
+            self._vertex_ids.append(id_)
+            out_heads.append(out_edge or 0)
+            in_heads.append(in_edge or 0)
+            self._vertex_labels.append(self._encode_label(graph._decode_label(label)))
+        # 边（按id排序） forward/backward只在构建时使用
+        self._edge_ids = array('q')
+        self._edge_tails = array('q')
+        self._edge_heads = array('q')
+        self._edge_labels = array('i')
+        forwards = array('q')
+        backwards = array('q')
+        rows = graph._iter_query('''SELECT `id`, `tail`, `head`, `forward`, `backward`, `label` FROM Edge ORDER BY `id`''')
+        for (id_, tail, head, forward, backward, label) in rows:
+            self._edge_ids.append(id_)
+            self._edge_tails.append(tail)
+            self._edge_heads.append(head)
+            forwards.append(forward or 0)
+            backwards.append(backward or 0)
+            self._edge_labels.append(self._encode_label(graph._decode_label(label)))
+        # id连续（没有删除过）时 下标可以直接由id算出 不必二分查找
+        self._vertex_base = CSRSnapshot._dense_base(self._vertex_ids)
+        self._edge_base = CSRSnapshot._dense_base(self._edge_ids)
+        # clustered布局没有链表指针 按邻接表的主键顺序把每个点的边串成链表 与直接查询数据库的顺序一致
+        if graph._is_clustered():
+            for (direction, chain_heads, nexts) in (('out', out_heads, forwards), ('in', in_heads, backwards)):
+                (table, owner, _) = Teamo.ADJACENCY_TABLES[direction]
+                (last_vertex, last_edge) = (None, 0)
+                rows = graph._iter_query(
+                    '''SELECT `{owner}`, `id` FROM `{table}` ORDER BY `{owner}`, `label`, `id`'''.format(owner=owner, table=table)
+                )
+                for (vertex, id_) in rows:
+                    if vertex == last_vertex:
+                        nexts[self._edge_index(last_edge)] = id_
+                    else:
+                        chain_heads[self._vertex_index(vertex)] = id_
+                    (last_vertex, last_edge) = (vertex, id_)
+        # 沿链表把每个点的边依次排进CSR数组
+        (self._out_offsets, self._out_edges, self._out_targets, self._out_labels) = \
+            self._build_direction(out_heads, forwards, self._edge_heads)
+        (self._in_offsets, self._in_edges, self._in_targets, self._in_labels) = \
+            self._build_direction(in_heads, backwards, self._edge_tails)
+
+    def _encode_label(self, label: Optional[str]) -> int:
+        code = self._label_codes.get(label)
+        if code is None:
+            code = len(self._label_names)
+            self._label_names.append(label)
+            self._label_codes[label] = code
+        return code
+
+    def _build_direction(self, chain_heads: array, nexts: array, targets: array) -> Tuple[array, array, array, array]:
+        offsets = array('q', [ 0 ])
+        edges = array('q')
+        direction_targets = array('q')
+        labels = array('i')
+        for head in chain_heads:
+            current_id = head
+            while current_id:
+                i = self._edge_index(current_id)
+                edges.append(current_id)
+                direction_targets.append(targets[i])
+                labels.append(self._edge_labels[i])
+                current_id = nexts[i]
+            offsets.append(len(edges))
+        return (offsets, edges, direction_targets, labels)
+
+    # 有序数组中的id若连续 返回首个id 否则返回None
+    @staticmethod
+    def _dense_base(ids: array) -> Optional[int]:
+        if len(ids) == 0 or ids[-1] - ids[0] + 1 == len(ids):
+            return ids[0] if len(ids) else 0
+        return None
+
+    # id在有序数组中的下标 不存在时返回None
+    @staticmethod
+    def _index(ids: array, base: Optional[int], id_: int) -> Optional[int]:
+        if base is not None:
+            i = id_ - base
+            return i if 0 <= i < len(ids) else None
+        i = bisect_left(ids, id_)
+        if i < len(ids) and ids[i] == id_:
+            return i
+        return None
+
+    def _vertex_index(self, vertex_id: int) -> Optional[int]:
+        return CSRSnapshot._index(self._vertex_ids, self._vertex_base, vertex_id)
+
+    def _edge_index(self, edge_id: int) -> Optional[int]:
+        return CSRSnapshot._index(self._edge_ids, self._edge_base, edge_id)
+
+    # 点/边的label编码 不存在的点/边返回-1
+    def _vertex_label_code(self, vertex_id: int) -> int:
+        i = self._vertex_index(vertex_id)
+        return -1 if i is None else self._vertex_labels[i]
+
+    def _edge_label_code(self, edge_id: int) -> int:
+        i = self._edge_index(edge_id)
+        return -1 if i is None else self._edge_labels[i]
+
+    def _codes(self, labels: Sequence[str]) -> set:
+        return set(self._label_codes[label] for label in labels if label in self._label_codes)
+
+    # 快照占用的内存（字节） 只统计各数组
+    def memory_usage(self) -> int:
+        arrays = [ self._vertex_ids, self._vertex_labels,
+            self._edge_ids, self._edge_tails, self._edge_heads, self._edge_labels,
+            self._out_offsets, self._out_edges, self._out_targets, self._out_labels,
+            self._in_offsets, self._in_edges, self._in_targets, self._in_labels ]
+        return sum(a.buffer_info()[1] * a.itemsize for a in arrays)
+
+    def vertex_number(self) -> int:
+        return len(self._vertex_ids)
+
+    def edge_number(self) -> int:
+        return len(self._edge_ids)
+
+    ##########################################
+    #    与Teamo同名的批量读方法（遍历时使用）    #
+    ##########################################
+
+    def _get_all_vertex(self, size: int = Teamo.QUERY_BATCH) -> Iterator[int]:
+        return iter(self._vertex_ids)
+
+    def _get_all_edge(self, size: int = Teamo.QUERY_BATCH) -> Iterator[int]:
+        return iter(self._edge_ids)
+
+    def _get_some_vertex(self, ids: Sequence[int]) -> Sequence[int]:
+        if any(self._vertex_index(i) is None for i in ids):
+            shouldNotHappen('存在不合法ID')
+        return ids
+
+    def _get_some_edge(self, ids: Sequence[int]) -> Sequence[int]:
+        if any(self._edge_index(i) is None for i in ids):
+            shouldNotHappen('存在不合法ID')
+        return ids
+
+    def _slice_adjacency(self, vertex_ids: Sequence[int], offsets: array, values: array, value_labels: array,
+            labels: Optional[Sequence[str]]) -> Dict[int, List[int]]:
+        codes = self._codes(labels) if labels else None
+        adjacency = {}
+        for v in set(vertex_ids):
+            i = self._vertex_index(v)
+            if i is None:
+                continue
+            (begin, end) = (offsets[i], offsets[i + 1])
+            if codes is None:
+                adjacency[v] = values[begin:end].tolist()
+            else:
+                adjacency[v] = [ values[j] for j in range(begin, end) if value_labels[j] in codes ]
+        return adjacency
+
+    def _get_out_edge_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, List[int]]:
+        return self._slice_adjacency(vertex_ids, self._out_offsets, self._out_edges, self._out_labels, labels)
+
+    def _get_in_edge_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, List[int]]:
+        return self._slice_adjacency(vertex_ids, self._in_offsets, self._in_edges, self._in_labels, labels)
+
+    def _get_out_neighbor_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, List[int]]:
+        return self._slice_adjacency(vertex_ids, self._out_offsets, self._out_targets, self._out_labels, labels)
+
+    def _get_in_neighbor_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, List[int]]:
+        return self._slice_adjacency(vertex_ids, self._in_offsets, self._in_targets, self._in_labels, labels)
+
+    # 快照中的度数即CSR中的边数
+    def _get_out_degree_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, int]:
+        return { v: len(edges) for (v, edges) in self._get_out_edge_in_batch(vertex_ids, labels).items() }
+
+    def _get_in_degree_in_batch(self, vertex_ids: Sequence[int],
+            labels: Optional[Sequence[str]] = None) -> Dict[int, int]:
+        return { v: len(edges) for (v, edges) in self._get_in_edge_in_batch(vertex_ids, labels).items() }
+
+    def _get_vertex_of_edge_in_batch(self, edge_ids: Sequence[int]) -> Dict[int, Tuple[int, int]]:
+        endpoints = {}
+        for e in set(edge_ids):
+            i = self._edge_index(e)
+            if i is not None:
+                endpoints[e] = (self._edge_tails[i], self._edge_heads[i])
+        return endpoints
+
+    def _get_vertex_of_all_edge(self, size: int = Teamo.QUERY_BATCH) -> Iterator[Tuple[int, int]]:
+        return zip(self._edge_tails, self._edge_heads)
+
+    def _filter_vertex_by_labels(self, vertex_ids: Sequence[int], labels: Sequence[str]) -> Sequence[int]:
+        if len(vertex_ids) == 0 or len(labels) == 0:
+            return vertex_ids
+        codes = self._codes(labels)
+        return [ v for v in vertex_ids if self._vertex_label_code(v) in codes ]
 
     def _filter_edge_by_labels(self, edge_ids: Sequence[int], labels: Sequence[str]) -> Sequence[int]:
         if len(edge_ids) == 0 or len(labels) == 0:
             return edge_ids
-        c = self._conn.cursor()
-        args = list(edge_ids) + list(labels)
-        c.execute(
-            '''SELECT `id` FROM Edge WHERE `id` IN ({ph}'''.format(ph=self._ph) +
-            ',{ph}'.format(ph=self._ph) * (len(edge_ids) - 1) +
-            ''') AND `label` IN ({ph}'''.format(ph=self._ph) +
-            ',{ph}'.format(ph=self._ph) * (len(labels) - 1) +
-            ')',
-            args
-        )
-        result_edges = [ row[0] for row in c.fetchall() ]
-        return result_edges
+        codes = self._codes(labels)
+        return [ e for e in edge_ids if self._edge_label_code(e) in codes ]
+
+    def _get_vertex_by_labels(self, labels: Sequence[str], size: int = Teamo.QUERY_BATCH) -> Iterator[int]:
+        codes = self._codes(labels)
+        return ( v for (v, code) in zip(self._vertex_ids, self._vertex_labels) if code in codes )
 
-    # TODO
-    def traversal(self) -> 'GraphTraversal':
-        return GraphTraversalSource(self)
+    def _get_edge_by_labels(self, labels: Sequence[str], size: int = Teamo.QUERY_BATCH) -> Iterator[int]:
+        codes = self._codes(labels)
+        return ( e for (e, code) in zip(self._edge_ids, self._edge_labels) if code in codes )
 
 
 # 整个GraphTraversal（图遍历）的起点
 # 加边加点必须在起点处进行
 class GraphTraversalSource:
-    def __init__(self, graph: Teamo):
+    # chunk_size为遍历中每次从数据库取出/处理的id个数 决定了遍历过程中的内存峰值
+    def __init__(self, graph: Teamo, *, snapshot: Optional[CSRSnapshot] = None, chunk_size: int = Teamo.QUERY_BATCH,
+            compiled: bool = False):
+        if compiled and snapshot is not None:
+            shouldNotHappen('快照模式下的遍历不查询数据库 不能编译成SQL')
+        # 编译时按边在链表中的位次排序 旧版本的图需要先upgrade()
+        if compiled and not graph._is_clustered() and not graph._has_column('Edge', 'out_rank'):
+            shouldNotHappen('Edge表没有位次列 请先调用upgrade()')
         self._graph = graph
+        self._snapshot = snapshot
+        self._chunk_size = chunk_size
+        self._compiled = compiled
         self._package_pool = {}
+        # 只读查询的执行者：快照模式下为快照 否则为图本身
+        self._reader = graph if snapshot is None else snapshot
+
+    def _new_traversal(self) -> 'GraphTraversal':
+        return GraphTraversal(self._graph, self._package_pool, snapshot=self._snapshot, chunk_size=self._chunk_size)
 
     ##########################################
     #          boot graph traversal          #
     ##########################################
 
     # return new traversal with some vertexs
-    def V(self, *ids: int) -> 'GraphTraversal':
-        graph_traversal = GraphTraversal(self._graph, self._package_pool)
-        vertex_id_list = []
+    # 不带参数时不会立即取出所有点 而是在后续步骤需要时逐块取出
+    def V(self, *ids: int) -> Union['GraphTraversal', 'CompiledTraversal']:
+        graph_traversal = self._new_traversal()
         # 我可以写成三元运算符但偏不
         if ids:
-            vertex_id_list = self._graph._get_some_vertex(ids)
+            vertex_ids = self._reader._get_some_vertex(ids)
         else:
-            vertex_id_list = self._graph._get_all_vertex()
-        graph_traversal._set_vertex(vertex_id_list)
+            vertex_ids = self._reader._get_all_vertex(self._chunk_size)
+        graph_traversal._set_vertex(vertex_ids)
+        graph_traversal._whole_table = not ids
+        if not ids and self._snapshot is None:
+            graph_traversal._query = ('Vertex', [])
+        if self._compiled:
+            return CompiledTraversal(graph_traversal)
         return graph_traversal
 
     # return new traversal with some edges
-    def E(self, *ids: int) -> 'GraphTraversal':
-        graph_traversal = GraphTraversal(self._graph, self._package_pool)
-        edge_id_list = []
+    # 不带参数时不会立即取出所有边 而是在后续步骤需要时逐块取出
+    def E(self, *ids: int) -> Union['GraphTraversal', 'CompiledTraversal']:
+        graph_traversal = self._new_traversal()
         # 我可以写成三元运算符但偏不
         if ids:
-            edge_id_list = self._graph._get_some_edge(ids)
+            edge_ids = self._reader._get_some_edge(ids)
         else:
-            edge_id_list = self._graph._get_all_edge()
-        graph_traversal._set_edge(edge_id_list)
+            edge_ids = self._reader._get_all_edge(self._chunk_size)
+        graph_traversal._set_edge(edge_ids)
+        graph_traversal._whole_table = not ids
+        if not ids and self._snapshot is None:
+            graph_traversal._query = ('Edge', [])
+        if self._compiled:
+            return CompiledTraversal(graph_traversal)
         return graph_traversal
 
     def Between(self, from_vertex: int, to_vertex: int) -> 'GraphTraversal':
@@ -694,7 +2657,7 @@ class GraphTraversalSource:
     # Return new traversal with the new vertex
     def addV(self) -> 'GraphTraversal':
         vertex_id = self._graph._add_vertex()
-        graph_traversal = GraphTraversal(self._graph, self._package_pool)
+        graph_traversal = self._new_traversal()
         graph_traversal._set_vertex([vertex_id])
         return graph_traversal
 
@@ -702,23 +2665,76 @@ class GraphTraversalSource:
     # Return new traversal with the new edges
     def addE(self, from_vertex: int, to_vertex: int) -> 'GraphTraversal':
         edge_id = self._graph._add_edge(from_vertex, to_vertex)
-        graph_traversal = GraphTraversal(self._graph, self._package_pool)
+        graph_traversal = self._new_traversal()
         graph_traversal._set_edge([edge_id])
         return graph_traversal
 
-    # [!] @Deprecated
+    # Add many new vertices to graph in one pass
+    # g.addVs(3) / g.addVs(labels=[...], datas=[...]) / g.addVs([(label, data), ...])
+    # 新点的id是连续的 返回的traversal的点集即为这段id区间(range)
+    def addVs(self, vertices: Union[int, Iterable[Tuple[Optional[str], Optional[str]]], None] = None, *,
+            labels: Optional[Sequence[Optional[str]]] = None,
+            datas: Optional[Sequence[Optional[str]]] = None) -> 'GraphTraversal':
+        if vertices is None or isinstance(vertices, int):
+            lengths = { len(column) for column in (labels, datas) if column is not None }
+            if vertices is not None:
+                lengths.add(vertices)
+            if len(lengths) == 0:
+                shouldNotHappen('addVs需要点数或label/data序列')
+            if len(lengths) != 1:
+                shouldNotHappen('点数与label/data序列的长度不一致')
+            number = lengths.pop()
+            if labels is None and datas is None:
+                vertex_ids = self._graph._add_empty_vertex_in_batch(number)
+            else:
+                vertex_ids = self._graph._add_vertex_in_batch(zip(
+                    itertools.repeat(None, number) if labels is None else labels,
+                    itertools.repeat(None, number) if datas is None else datas
+                ))
+        else:
+            if labels is not None or datas is not None:
+                shouldNotHappen('传入(label, data)序列时不能再传入labels/datas')
+            vertex_ids = self._graph._add_vertex_in_batch(vertices)
+        graph_traversal = self._new_traversal()
+        graph_traversal._set_vertex(vertex_ids)
+        return graph_traversal
+
+    # Add many new edges to graph in one pass
+    # g.addEs([(x, y), ...]) / g.addEs([(x, y), ...], labels=[...], datas=[...]) / g.addEs([(x, y, label, data), ...])
+    # 指针、label与data在同一遍中写入 新边的id是连续的 返回的traversal的边集即为这段id区间(range)
+    def addEs(self, edges: Sequence[Tuple], *,
+            labels: Optional[Sequence[Optional[str]]] = None,
+            datas: Optional[Sequence[Optional[str]]] = None) -> 'GraphTraversal':
+        if labels is not None or datas is not None:
+            if any(column is not None and len(column) != len(edges) for column in (labels, datas)):
+                shouldNotHappen('边数与label/data序列的长度不一致')
+            if any(len(e) != 2 for e in edges):
+                shouldNotHappen('传入labels/datas时边只能是(tail, head)')
+            edges = [ (e[0], e[1], label, data) for e, label, data in zip(edges,
+                itertools.repeat(None) if labels is None else labels,
+                itertools.repeat(None) if datas is None else datas) ]
+        edge_ids = self._graph._add_edge_in_branch(edges)
+        graph_traversal = self._new_traversal()
+        graph_traversal._set_edge(edge_ids)
+        return graph_traversal
+
+    # with g.batch(commit_every=N): 等同于 with graph.batch(commit_every=N):
+    def batch(self, commit_every: Optional[int] = None):
+        return self._graph.batch(commit_every)
+
+    # [!] @Deprecated 请改用 with g.batch(): g.addV()
     # [!] Warning: You had better know what you are doing.
     def addVinRaw(self) -> 'GraphTraversal':
         vertex_id = self._graph._add_vertex(do_commit=False)
-        graph_traversal = GraphTraversal(self._graph, self._package_pool)
+        graph_traversal = self._new_traversal()
         graph_traversal._set_vertex([vertex_id])
         return graph_traversal
 
-    # [!] @Deprecated
+    # [!] @Deprecated 请改用 with g.batch(): g.addE(x, y)
     # [!] Warning: You had better know what you are doing.
     def addEinRaw(self, from_vertex: int, to_vertex: int) -> 'GraphTraversal':
         edge_id = self._graph._add_edge(from_vertex, to_vertex, do_commit=False)
-        graph_traversal = GraphTraversal(self._graph, self._package_pool)
+        graph_traversal = self._new_traversal()
         graph_traversal._set_edge([edge_id])
         return graph_traversal
 
@@ -739,12 +2755,25 @@ class GraphTraversalSource:
         return self._package_pool[package_name]
 
      
+# 遍历中的点集/边集是一条惰性的生成器流水线：
+# 每个步骤只是在上一步的点集/边集上再套一层生成器，以chunk_size为单位逐块查询、逐块产出
+# 只有终止步骤（identity/id/label()/data()/values/drop）与pack才会真正取出全部结果
+# 因此遍历过程中的内存峰值约为chunk_size个id（加上终止步骤返回的结果本身）
 class GraphTraversal:
-    def __init__(self, graph: Teamo, package_pool: Dict[str, Any]):
+    def __init__(self, graph: Teamo, package_pool: Dict[str, Any], *,
+            snapshot: Optional[CSRSnapshot] = None, chunk_size: int = Teamo.QUERY_BATCH):
         self._graph = graph
         self._package_pool = package_pool
-        self._vertexs = None # Optional[Sequence[int]]
-        self._edges = None # Optional[Sequence[int]]
+        # 只读查询（邻接、端点、label过滤）的执行者：快照模式下为快照 否则为图本身
+        self._reader = graph if snapshot is None else snapshot
+        self._chunk_size = chunk_size
+        self._vertexs = None # Optional[Iterable[int]]
+        self._edges = None # Optional[Iterable[int]]
+        # 当前的点集/边集是否恰为整张表（由不带参数的V()/E()产生，且按id排序）
+        self._whole_table = False
+        # 当前的点集/边集可以写成对一张表的查询时为 (表名, [(条件, 参数, 是否有属性索引), ...]) 结果按id排序
+        # 由V()/E()产生 之后的hasLabel/has追加条件；count/limit/range据此编译成SQL 快照模式下为None
+        self._query = None
 
     def _is_vertex_in_use(self):
         return self._vertexs is not None
@@ -780,27 +2809,31 @@ class GraphTraversal:
 
     # @Deprecated
     def _push_vertex(self, vertex: int):
-        self._vertexs.append(vertex)
+        self._materialize_vertex().append(vertex)
 
     # @Deprecated
     def _push_edge(self, edge: int):
-        self._edges.append(edge)
+        self._materialize_edge().append(edge)
 
-    def _set_vertex(self, vertexs: Sequence[int]):
+    # 不拷贝 vertexs可以是list也可以是生成器
+    def _set_vertex(self, vertexs: Iterable[int]):
         del self._vertexs
-        # 浅拷贝
-        self._vertexs = list(vertexs)
+        self._vertexs = vertexs
+        self._whole_table = False
+        self._query = None
 
-    def _set_edge(self, edges: Sequence[int]):
+    # 不拷贝 edges可以是list也可以是生成器
+    def _set_edge(self, edges: Iterable[int]):
         del self._edges
-        # 浅拷贝
-        self._edges = list(edges)
+        self._edges = edges
+        self._whole_table = False
+        self._query = None
 
-    def _extend_vertex(self, vertexs: Sequence[int]):
-        self._vertexs.extend(vertexs)
+    def _extend_vertex(self, vertexs: Iterable[int]):
+        self._vertexs = itertools.chain(self._vertexs, vertexs)
 
-    def _extend_edge(self, edges: Sequence[int]):
-        self._edges.extend(edges)
+    def _extend_edge(self, edges: Iterable[int]):
+        self._edges = itertools.chain(self._edges, edges)
 
     def _clean_vertex(self):
         del self._vertexs
@@ -810,155 +2843,123 @@ class GraphTraversal:
         del self._edges
         self._edges = None
 
+    # 把点集/边集真正取出成list（终止步骤、写操作或需要多次遍历时使用）
+    def _materialize_vertex(self) -> List[int]:
+        if not isinstance(self._vertexs, list):
+            self._vertexs = list(self._vertexs)
+        return self._vertexs
+
+    def _materialize_edge(self) -> List[int]:
+        if not isinstance(self._edges, list):
+            self._edges = list(self._edges)
+        return self._edges
+
     ##########################################
     #         gremlin vertex step            #
     ##########################################
 
     # Move to the outgoing adjacent vertices given the edge labels.
+    # 与outE(*labels).inV()结果一致 但直接由点走到点 不生成中间的边集
     def out(self, *labels: str) -> 'GraphTraversal':
-        return self.outE(*labels).inV()
+        self._expect_vertex_in_use()
+        vertexs = self._iter_adjacency(self._vertexs, self._reader._get_out_neighbor_in_batch, labels=labels)
+        self._set_vertex(vertexs)
+        self._clean_edge()
+        return self
     
     # Move to the incoming adjacent vertices given the edge labels.
+    # 与inE(*labels).outV()结果一致 但直接由点走到点 不生成中间的边集
     def in_(self, *labels: str) -> 'GraphTraversal':
-        return self.inE(*labels).outV()
+        self._expect_vertex_in_use()
+        vertexs = self._iter_adjacency(self._vertexs, self._reader._get_in_neighbor_in_batch, labels=labels)
+        self._set_vertex(vertexs)
+        self._clean_edge()
+        return self
 
     # Move to both the incoming and outgoing adjacent vertices given the edge labels.
     def both(self, *labels: str) -> 'GraphTraversal':
         self._expect_vertex_in_use()
-        # 存放结果的点集
-        vertex_list = []
-        # 先找出边的入点
-        out_edge_list = []
-        # 下面与outE一致 不要问我为什么写重复的代码
-        if labels:
-            for v in self._vertexs:
-                for e in self._graph._get_out_edge_by_label(v, labels):
-                    out_edge_list.append(e)
-        else:
-            for v in self._vertexs:
-                for e in self._graph._get_out_edge(v):
-                    out_edge_list.append(e)
-        # 下面与inV一致 同上
-        for e in out_edge_list:
-            v = self._graph._get_in_vertex(e)
-            vertex_list.append(v)
-        # 再找入边的出点
-        in_edge_list = []
-        # 下面与inE一致 同上
-        if labels:
-            for v in self._vertexs:
-                for e in self._graph._get_in_edge_by_label(v, labels):
-                    in_edge_list.append(e)
-        else:
-            for v in self._vertexs:
-                for e in self._graph._get_in_edge(v):
-                    in_edge_list.append(e)
-        # 下面与inV一致 同上
-        for e in in_edge_list:
-            v = self._graph._get_out_vertex(e)
-            vertex_list.append(v)
+        # 与bothE()一样逐块展开 不取出整个点集：每个点先出边的入点 后入边的出点
+        vertexs = self._iter_adjacency(
+            self._vertexs, self._reader._get_out_neighbor_in_batch, self._reader._get_in_neighbor_in_batch, labels=labels)
         # 最后结果存进去
-        self._set_vertex(vertex_list)
+        self._set_vertex(vertexs)
         self._clean_edge()
         return self
 
+    # 以块为单位查出点集中每个点的邻接边或邻接点 fetch为Teamo上的批量方法
+    # 结果顺序：按点集中点的顺序（重复的点重复展开），每个点内部按其链表顺序
+    def _iter_adjacency(self, vertexs: Iterable[int], *fetchs, labels: Sequence[str] = ()) -> Iterator[int]:
+        for chunk in chunked(vertexs, self._chunk_size):
+            adjacencys = [ fetch(chunk, labels) for fetch in fetchs ]
+            for v in chunk:
+                for adjacency in adjacencys:
+                    yield from adjacency.get(v, ())
+
     # Move to the outgoing incident edges given the edge labels.
     def outE(self, *labels: str) -> 'GraphTraversal':
         self._expect_vertex_in_use()
-        edge_list = []
-        if labels:
-            # 注释如下
-            for v in self._vertexs:
-                for e in self._graph._get_out_edge_by_label(v, labels):
-                    edge_list.append(e)
-        else:
-            # 对点集中每个点找出边
-            for v in self._vertexs:
-                # 对找到的出边边集进行生成Edge对象的列表
-                for e in self._graph._get_out_edge(v):
-                    edge_list.append(e)
-        # 把Edge对象的列表保存起来到self这个Traversal里
-        self._set_edge(edge_list)
+        edges = self._iter_adjacency(self._vertexs, self._reader._get_out_edge_in_batch, labels=labels)
+        # 把边集保存起来到self这个Traversal里
+        self._set_edge(edges)
         self._clean_vertex()
         return self
     
     # Move to the incoming incident edges given the edge labels.
     def inE(self, *labels: str) -> 'GraphTraversal':
         self._expect_vertex_in_use()
-        edge_list = []
-        if labels:
-            # 注释如下
-            for v in self._vertexs:
-                for e in self._graph._get_in_edge_by_label(v, labels):
-                    edge_list.append(e)
-        else:
-            # 对点集中每个点找入边
-            for v in self._vertexs:
-                # 对找到的入边边集进行生成Edge对象的列表
-                for e in self._graph._get_in_edge(v):
-                    edge_list.append(e)
-        # 把Edge对象的列表保存起来到self这个Traversal里
-        self._set_edge(edge_list)
+        edges = self._iter_adjacency(self._vertexs, self._reader._get_in_edge_in_batch, labels=labels)
+        # 把边集保存起来到self这个Traversal里
+        self._set_edge(edges)
         self._clean_vertex()
         return self
 
     # Move to both the incoming and outgoing incident edges given the edge labels.
     def bothE(self, *labels: str) -> 'GraphTraversal':
         self._expect_vertex_in_use()
-        edge_list = []
-        if labels:
-            for v in self._vertexs:
-                # 获取入边
-                for e in self._graph._get_in_edge_by_label(v, labels):
-                    edge_list.append(e)
-                # 获取出边
-                for e in self._graph._get_out_edge_by_label(v, labels):
-                    edge_list.append(e)
-        else:
-            for v in self._vertexs:
-                # 获取入边
-                for e in self._graph._get_in_edge(v):
-                    edge_list.append(e)
-                # 获取出边
-                for e in self._graph._get_out_edge(v):
-                    edge_list.append(e)
-        # 把Edge对象的列表保存起来到self这个Traversal里
-        self._set_edge(edge_list)
+        # 每个点先入边后出边
+        edges = self._iter_adjacency(
+            self._vertexs, self._reader._get_in_edge_in_batch, self._reader._get_out_edge_in_batch, labels=labels)
+        # 把边集保存起来到self这个Traversal里
+        self._set_edge(edges)
         self._clean_vertex()
         return self
 
+    # 以块为单位查出当前边集中每条边的端点 逐个产出 (tail, head)，与边集一一对应（含重复）
+    # 若当前边集为整张Edge表 则直接顺序扫描一遍
+    def _iter_vertexs_of_edges(self) -> Iterator[Tuple[int, int]]:
+        if self._whole_table:
+            return self._reader._get_vertex_of_all_edge(self._chunk_size)
+        return self._iter_endpoints(self._edges)
+
+    def _iter_endpoints(self, edges: Iterable[int]) -> Iterator[Tuple[int, int]]:
+        for chunk in chunked(edges, self._chunk_size):
+            endpoints = self._reader._get_vertex_of_edge_in_batch(chunk)
+            for e in chunk:
+                yield endpoints[e]
+
     # Move to the outgoing vertex.
     def outV(self) -> 'GraphTraversal':
         self._expect_edge_in_use()
-        vertex_list = []
-        for e in self._edges:
-            v = self._graph._get_out_vertex(e)
-            vertex_list.append(v)
-        self._set_vertex(vertex_list)
+        vertexs = ( tail for (tail, _) in self._iter_vertexs_of_edges() )
+        self._set_vertex(vertexs)
         self._clean_edge()
         return self
 
     # Move to the incoming vertex.
     def inV(self) -> 'GraphTraversal':
         self._expect_edge_in_use()
-        vertex_list = []
-        for e in self._edges:
-            v = self._graph._get_in_vertex(e)
-            vertex_list.append(v)
-        self._set_vertex(vertex_list)
+        vertexs = ( head for (_, head) in self._iter_vertexs_of_edges() )
+        self._set_vertex(vertexs)
         self._clean_edge()
         return self
 
     # Move to both vertices.
     def bothV(self) -> 'GraphTraversal':
         self._expect_edge_in_use()
-        vertex_list = []
-        for e in self._edges:
-            in_v = self._graph._get_in_vertex(e)
-            vertex_list.append(in_v)
-            out_v = self._graph._get_out_vertex(e)
-            vertex_list.append(out_v)
-        self._set_vertex(vertex_list)
+        # 每条边先入点(head)后出点(tail)
+        vertexs = ( v for (tail, head) in self._iter_vertexs_of_edges() for v in (head, tail) )
+        self._set_vertex(vertexs)
         self._clean_edge()
         return self
 
@@ -970,14 +2971,73 @@ class GraphTraversal:
         self._expect_vertex_or_edge_in_use()
         if not labels:
             shouldNotHappen('需要参数 一个或多个labels')
+        if self._query is not None:
+            return self._narrow_query(self._graph._label_condition(labels))
+        # 当前集合为整张表时 直接按label查询（可走label索引） 而不是再按id逐块过滤
         if self._is_vertex_in_use():
-            result_vertexs = self._graph._filter_vertex_by_labels(self._vertexs, labels)
+            if self._whole_table:
+                result_vertexs = self._reader._get_vertex_by_labels(labels, self._chunk_size)
+            else:
+                result_vertexs = self._iter_filter(self._vertexs, self._reader._filter_vertex_by_labels, labels)
             self._set_vertex(result_vertexs)
         if self._is_edge_in_use():
-            result_edges = self._graph._filter_edge_by_labels(self._edges, labels)
+            if self._whole_table:
+                result_edges = self._reader._get_edge_by_labels(labels, self._chunk_size)
+            else:
+                result_edges = self._iter_filter(self._edges, self._reader._filter_edge_by_labels, labels)
             self._set_edge(result_edges)
         return self
 
+    # has(key)：data中有key；has(key, value)：等同于has(key, P.eq(value))；has(key, P.gt(30))等
+    # 条件下推到数据库 当前集合为整张表时直接扫描表 否则按块过滤 只有满足条件的id会被取回
+    # data不在快照中 快照模式下也查询数据库
+    def has(self, key: str, *predicate: Any) -> 'GraphTraversal':
+        self._expect_vertex_or_edge_in_use()
+        if len(predicate) > 1:
+            shouldNotHappen('has只接受一个值或谓词')
+        predicate = GraphTraversal._predicate_of(predicate)
+        if self._query is not None and Teamo._can_push_down(key):
+            return self._narrow_query(self._graph._property_condition_of(self._query[0], key, predicate))
+        if self._is_vertex_in_use():
+            if self._whole_table:
+                result_vertexs = self._graph._get_vertex_by_property(key, predicate, self._chunk_size)
+            else:
+                result_vertexs = self._iter_filter(self._vertexs, self._graph._filter_vertex_by_property, key, predicate)
+            self._set_vertex(result_vertexs)
+        if self._is_edge_in_use():
+            if self._whole_table:
+                result_edges = self._graph._get_edge_by_property(key, predicate, self._chunk_size)
+            else:
+                result_edges = self._iter_filter(self._edges, self._graph._filter_edge_by_property, key, predicate)
+            self._set_edge(result_edges)
+        return self
+
+    # has的值或谓词：没有时为None 不是P的值视为P.eq(值)
+    @staticmethod
+    def _predicate_of(predicate: Sequence[Any]) -> Optional[P]:
+        if len(predicate) == 0:
+            return None
+        if isinstance(predicate[0], P):
+            return predicate[0]
+        return P.eq(predicate[0])
+
+    # 当前集合为对表的查询时 追加一个条件 整个集合仍是一条按id排序逐块取出的查询
+    def _narrow_query(self, condition: Tuple[str, List[Any], bool]) -> 'GraphTraversal':
+        (table, conditions) = self._query
+        conditions = conditions + [ condition ]
+        ids = self._graph._iter_where(table, conditions, self._chunk_size)
+        if table == 'Vertex':
+            self._set_vertex(ids)
+        else:
+            self._set_edge(ids)
+        self._query = (table, conditions)
+        return self
+
+    # 以块为单位过滤 filter_为Teamo上的批量过滤方法
+    def _iter_filter(self, ids: Iterable[int], filter_, *args) -> Iterator[int]:
+        for chunk in chunked(ids, self._chunk_size):
+            yield from filter_(chunk, *args)
+
     ##########################################
     #      set/get label/data step (end)     #
     ##########################################
@@ -985,31 +3045,36 @@ class GraphTraversal:
     # **但凡修改内容而非查询内容，都直接结束遍历(GraphTraversal)**
     # 另：获取或设置label和data 都直接结束遍历(GraphTraversal)
 
+    # 按块批量取出ids对应的label/data 结果保持ids的顺序（重复的id重复输出）
+    def _collect_column(self, ids: Iterable[int], fetch) -> List[Optional[str]]:
+        values = []
+        for chunk in chunked(ids, self._chunk_size):
+            found = fetch(chunk)
+            for i in chunk:
+                if i not in found:
+                    shouldNotHappen('id为{}的点/边不存在'.format(i))
+                values.append(found[i])
+        return values
+
     # If label is not None, set the label of vertex(s)/edge(s)
     def label(self, label: Optional[str] = None) -> Union[Sequence[str], 'GraphTraversal']:
         self._expect_vertex_or_edge_in_use()
         if self._is_vertex_in_use():
             if label is None: # means 'get label'
-                labels = []
-                for v in self._vertexs:
-                    labels.append(self._graph._get_vertex_label(v))
+                labels = self._collect_column(self._vertexs, self._graph._get_vertex_label_in_batch)
                 # 注意这里有一个出口
                 self._clean_vertex()
                 return labels
             else:
-                for v in self._vertexs:
-                    self._graph._set_vertex_label(v, label)
+                self._graph._set_vertex_label_in_batch(self._materialize_vertex(), label)
         elif self._is_edge_in_use():
             if label is None: # means 'get label'
-                labels = []
-                for e in self._edges:
-                    labels.append(self._graph._get_edge_label(e))
+                labels = self._collect_column(self._edges, self._graph._get_edge_label_in_batch)
                 # 注意这里有一个出口
                 self._clean_edge()
                 return labels
             else:
-                for e in self._edges:
-                    self._graph._set_edge_label(e, label)
+                self._graph._set_edge_label_in_batch(self._materialize_edge(), label)
         return self
 
     # If data is not None, set the data of vertex(s)/edge(s)
@@ -1017,28 +3082,50 @@ class GraphTraversal:
         self._expect_vertex_or_edge_in_use()
         if self._is_vertex_in_use():
             if data is None: # means 'get data'
-                datas = []
-                for v in self._vertexs:
-                    datas.append(self._graph._get_vertex_data(v))
+                datas = self._collect_column(self._vertexs, self._graph._get_vertex_data_in_batch)
                 # 注意这里有一个出口
                 self._clean_vertex()
                 return datas
             else:
-                for v in self._vertexs:
-                    self._graph._set_vertex_data(v, data)
+                self._graph._set_vertex_data_in_batch(self._materialize_vertex(), data)
         elif self._is_edge_in_use():
             if data is None: # means 'get data'
-                datas = []
-                for e in self._edges:
-                    datas.append(self._graph._get_edge_data(e))
+                datas = self._collect_column(self._edges, self._graph._get_edge_data_in_batch)
                 # 注意这里有一个出口
                 self._clean_edge()
                 return datas
             else:
-                for e in self._edges:
-                    self._graph._set_edge_data(e, data)
+                self._graph._set_edge_data_in_batch(self._materialize_edge(), data)
         return self
 
+    ##########################################
+    #            degree step (end)           #
+    ##########################################
+
+    # 点集中每个点的出度 labels非空时只计这些label的出边 与逐个点数outE(*labels)的结果一致
+    # 直接读取维护好的度数 不遍历邻接边
+    def outDegree(self, *labels: str) -> List[int]:
+        return self._collect_degrees(self._reader._get_out_degree_in_batch, labels=labels)
+
+    # 点集中每个点的入度
+    def inDegree(self, *labels: str) -> List[int]:
+        return self._collect_degrees(self._reader._get_in_degree_in_batch, labels=labels)
+
+    # 点集中每个点的出度与入度之和（自环计两次 与bothE()一致）
+    def bothDegree(self, *labels: str) -> List[int]:
+        return self._collect_degrees(self._reader._get_out_degree_in_batch, self._reader._get_in_degree_in_batch,
+            labels=labels)
+
+    def _collect_degrees(self, *fetchs, labels: Sequence[str]) -> List[int]:
+        self._expect_vertex_in_use()
+        def fetch(ids: Sequence[int]) -> Dict[int, int]:
+            found = [ f(ids, labels) for f in fetchs ]
+            return { v: sum(degrees[v] for degrees in found) for v in found[0] }
+        degrees = self._collect_column(self._vertexs, fetch)
+        # 注意这里有一个出口
+        self._clean_vertex()
+        return degrees
+
     ##########################################
     #              unknown step              #
     ##########################################
@@ -1048,9 +3135,9 @@ class GraphTraversal:
         self._expect_vertex_or_edge_in_use()
         ids = []
         if self._is_vertex_in_use():
-            ids = self._vertexs
+            ids = self._materialize_vertex()
         elif self._is_edge_in_use():
-            ids = self._edges
+            ids = self._materialize_edge()
         self._clean_edge()
         self._clean_vertex()
         return ids
@@ -1064,55 +3151,482 @@ class GraphTraversal:
         return ids[0]
 
     # 将当前的Traversal中的边集或点集保存到名称为var的package中，之后可以取出使用
+    # 需要取出当前的整个集合
     def pack(self, var: str) -> 'GraphTraversal':
         self._expect_vertex_or_edge_in_use()
         ids = []
         if self._is_vertex_in_use():
-            ids = self._vertexs
+            ids = self._materialize_vertex()
         elif self._is_edge_in_use():
-            ids = self._edges
+            ids = self._materialize_edge()
         # 浅拷贝
         self._package_pool[var] = list(ids)
         return self
 
-    # 将当前的Traversal中的边集或点集去重
+    # 点集/边集中元素的个数（重复的id重复计数）
+    # 由V()/E()起始且只经过hasLabel/has时编译成一条 SELECT COUNT(*) 否则逐块数出个数 不保存任何id
+    def count(self) -> int:
+        self._expect_vertex_or_edge_in_use()
+        if self._query is not None:
+            number = self._graph._count_where(*self._query)
+        elif self._is_vertex_in_use():
+            number = sum(1 for _ in self._vertexs)
+        else:
+            number = sum(1 for _ in self._edges)
+        self._clean_vertex()
+        self._clean_edge()
+        return number
+
+    # 只保留前n个点/边 即range(0, n)
+    def limit(self, n: int) -> 'GraphTraversal':
+        return self.range(0, n)
+
+    # 只保留下标在 [low, high) 中的点/边 high为-1时保留到末尾（与Gremlin一致）
+    # 集合为对表的查询时编译成 LIMIT ... OFFSET ...；否则惰性截取 取够high个后不再向前面的步骤取数据
+    def range(self, low: int, high: int) -> 'GraphTraversal':
+        self._expect_vertex_or_edge_in_use()
+        if low < 0 or (high != -1 and high < low):
+            shouldNotHappen('range的参数不合法')
+        limit = None if high == -1 else high - low
+        if self._query is not None:
+            ids = self._graph._iter_where(*self._query, self._chunk_size, limit=limit, offset=low)
+        elif self._is_vertex_in_use():
+            ids = itertools.islice(self._vertexs, low, None if high == -1 else high)
+        else:
+            ids = itertools.islice(self._edges, low, None if high == -1 else high)
+        if self._is_vertex_in_use():
+            self._set_vertex(ids)
+        else:
+            self._set_edge(ids)
+        return self
+
+    # 将当前的Traversal中的边集或点集去重 保留每个id第一次出现的位置
     def dedup(self) -> 'GraphTraversal':
         self._expect_vertex_or_edge_in_use()
         if self._is_vertex_in_use():
-            self._set_vertex(list(set(self._vertexs)))
+            self._set_vertex(GraphTraversal._iter_unique(self._vertexs))
         if self._is_edge_in_use():
-            self._set_edge(list(set(self._edges)))
+            self._set_edge(GraphTraversal._iter_unique(self._edges))
         return self
 
+    @staticmethod
+    def _iter_unique(ids: Iterable[int]) -> Iterator[int]:
+        seen = set()
+        for i in ids:
+            if i not in seen:
+                seen.add(i)
+                yield i
+
     # 即property。获取data里键值对中的值
     # 前提是以JSON为格式的data必须正确 并且有这个key
-    def values(self, key: str) -> Any:
+    # 依次输出每个点/边的data中keys对应的值（与Gremlin一样 不存在的key直接跳过）
+    def values(self, *keys: str) -> List[Any]:
+        if len(keys) == 0:
+            shouldNotHappen('values至少需要一个key')
+        return [ props[key] for props in self._collect_properties(keys) for key in keys if key in props ]
+
+    # 每个点/边输出一个只含keys的字典 keys为空时输出整个data
+    def valueMap(self, *keys: str) -> List[Dict[str, Any]]:
+        if len(keys) == 0:
+            return [ dict(props) for props in self._collect_properties(None) ]
+        return [ { key: props[key] for key in keys if key in props } for props in self._collect_properties(keys) ]
+
+    def _collect_properties(self, keys: Optional[Sequence[str]]) -> List[Dict[str, Any]]:
         self._expect_vertex_or_edge_in_use()
         if self._is_vertex_in_use():
-            v_data = self.data()
-            return [ json.loads(d)[key] for d in v_data ]
-        if self._is_edge_in_use():
-            e_data = self.data()
-            return [ json.loads(d)[key] for d in e_data ]
+            properties = self._collect_column(self._vertexs,
+                lambda ids: self._graph._get_properties_in_batch('Vertex', ids, keys))
+            # 注意这里有一个出口
+            self._clean_vertex()
+        else:
+            properties = self._collect_column(self._edges,
+                lambda ids: self._graph._get_properties_in_batch('Edge', ids, keys))
+            # 注意这里有一个出口
+            self._clean_edge()
+        return properties
 
     def drop(self) -> Any:
         self._expect_vertex_or_edge_in_use()
         if self._is_vertex_in_use():
-            if len(self._vertexs) == 0:
+            if len(self._materialize_vertex()) == 0:
                 shouldNotHappen('不能drop一个只含有空的顶点集合的Traversal')
-            for v in self._vertexs:
-                self._graph._remove_vertex(v)
+            self._graph._remove_vertex_in_batch(self._vertexs)
             self._clean_vertex()
         if self._is_edge_in_use():
-            if len(self._edges) == 0:
+            if len(self._materialize_edge()) == 0:
                 shouldNotHappen('不能drop一个只含有空的边集合的Traversal')
-            for e in self._edges:
-                self._graph._remove_edge(e)
+            self._graph._remove_edge_in_batch(self._edges)
             self._clean_edge()
             
-# 放在这里啥也不干
-def main():
-    pass
+# 编译模式下的遍历 由 graph.traversal(compiled=True) 的V()/E()返回
+# 可编译的步骤（见COMPILABLE_STEPS）只记录下来 直到遇到其他步骤或终止步骤时 才把记录的一段写成一条SQL：
+# 每一步都是对上一步的子查询 子查询的列为元素的 `id` 与排序键 `k0`, `k1`, ...
+#   起点的排序键为id（由V()/E()起始时）或元素在上一步结果中的下标（否则 每块起点一条SQL）
+#   每走一跳追加这条边在链表中的位次（clustered布局为 label, id）；both()/bothE()/bothV()在最后追加一个分支键
+# 按全部排序键排序即为逐步执行时的顺序 因此结果（包括顺序与重复）与GraphTraversal逐步执行完全一致
+# 其余步骤先执行已记录的一段 再交给GraphTraversal逐步执行；之后的可编译步骤从那一步的结果开始记录新的一段
+# dedup()需要看到整个集合 只在只有一条SQL的一段中编译（由V()/E()或不超过一块的V(*ids)/E(*ids)起始）
+# 需要窗口函数与 VALUES 行构造（SQLite3 3.25+ / MySQL 8.0.19+）
+class CompiledTraversal:
+    # 可编译的步骤 => (要求的元素类型, 之后的元素类型) None表示不限/不变
+    COMPILABLE_STEPS = {
+        'hasLabel': (None, None), 'has': (None, None), 'dedup': (None, None),
+        'out': ('vertex', 'vertex'), 'in_': ('vertex', 'vertex'), 'both': ('vertex', 'vertex'),
+        'outE': ('vertex', 'edge'), 'inE': ('vertex', 'edge'), 'bothE': ('vertex', 'edge'),
+        'outV': ('edge', 'vertex'), 'inV': ('edge', 'vertex'), 'bothV': ('edge', 'vertex'),
+    }
+    # 走一跳的步骤 => 依次展开的方向（与GraphTraversal中的顺序一致）
+    HOP_DIRECTIONS = {
+        'out': ('out',), 'in_': ('in',), 'both': ('out', 'in'),
+        'outE': ('out',), 'inE': ('in',), 'bothE': ('in', 'out'),
+    }
+    # 由边到点的步骤 => 依次取出的端点列
+    ENDPOINT_COLUMNS = { 'outV': ('tail',), 'inV': ('head',), 'bothV': ('head', 'tail') }
+    TABLES = { 'vertex': 'Vertex', 'edge': 'Edge' }
+
+    def __init__(self, traversal: GraphTraversal):
+        # 逐步执行的遍历 不可编译的步骤交给它
+        self._traversal = traversal
+        self._graph = traversal._graph
+        # 正在记录的一段：起点 ('query', 表名, 条件) 或 ('ids', 表名, 上一步的id序列)，及其后的步骤 [(步骤名, 参数), ...]
+        # 没有正在记录的一段时均为None
+        self._root = None
+        self._steps = None
+        # 正在记录的一段走到最后一步时的元素类型 'vertex' 或 'edge'
+        self._kind = None
+
+    # 其余步骤：先执行已记录的一段 再逐步执行；返回GraphTraversal本身的步骤仍返回self以便继续编译
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = getattr(self._traversal, name)
+        def step(*args, **kwargs):
+            self._flush()
+            result = method(*args, **kwargs)
+            return self if result is self._traversal else result
+        return step
+
+    ##########################################
+    #            compilable step             #
+    ##########################################
+
+    def out(self, *labels: str) -> 'CompiledTraversal':
+        return self._record('out', labels)
+
+    def in_(self, *labels: str) -> 'CompiledTraversal':
+        return self._record('in_', labels)
+
+    def both(self, *labels: str) -> 'CompiledTraversal':
+        return self._record('both', labels)
+
+    def outE(self, *labels: str) -> 'CompiledTraversal':
+        return self._record('outE', labels)
+
+    def inE(self, *labels: str) -> 'CompiledTraversal':
+        return self._record('inE', labels)
+
+    def bothE(self, *labels: str) -> 'CompiledTraversal':
+        return self._record('bothE', labels)
+
+    def outV(self) -> 'CompiledTraversal':
+        return self._record('outV', ())
+
+    def inV(self) -> 'CompiledTraversal':
+        return self._record('inV', ())
+
+    def bothV(self) -> 'CompiledTraversal':
+        return self._record('bothV', ())
+
+    def hasLabel(self, *labels: str) -> 'CompiledTraversal':
+        return self._record('hasLabel', labels)
+
+    def has(self, key: str, *predicate: Any) -> 'CompiledTraversal':
+        return self._record('has', (key,) + predicate)
+
+    def dedup(self) -> 'CompiledTraversal':
+        return self._record('dedup', ())
+
+    def _record(self, name: str, args: Tuple) -> 'CompiledTraversal':
+        # 起点上的hasLabel/has在GraphTraversal中已经是对表的查询 直接追加条件
+        if self._steps is None and self._traversal._query is not None and name in ('hasLabel', 'has'):
+            getattr(self._traversal, name)(*args)
+            return self
+        if not self._can_compile(name, args):
+            self._flush()
+            getattr(self._traversal, name)(*args)
+            return self
+        if self._steps is None:
+            self._begin()
+        self._steps.append((name, args))
+        self._kind = CompiledTraversal.COMPILABLE_STEPS[name][1] or self._kind
+        return self
+
+    # 当前的元素类型 点集与边集不是恰好一个在用时为None（交给GraphTraversal报错）
+    def _current_kind(self) -> Optional[str]:
+        if self._steps is not None:
+            return self._kind
+        traversal = self._traversal
+        if traversal._is_vertex_in_use() and not traversal._is_edge_in_use():
+            return 'vertex'
+        if traversal._is_edge_in_use() and not traversal._is_vertex_in_use():
+            return 'edge'
+        return None
+
+    def _can_compile(self, name: str, args: Tuple) -> bool:
+        kind = self._current_kind()
+        (expected, _) = CompiledTraversal.COMPILABLE_STEPS[name]
+        if kind is None or (expected is not None and kind != expected):
+            return False
+        if name == 'dedup' and not self._is_single_statement():
+            return False
+        if name == 'hasLabel':
+            return len(args) > 0
+        if name == 'has':
+            return len(args) in (1, 2) and Teamo._can_push_down(args[0])
+        if name in CompiledTraversal.HOP_DIRECTIONS and not self._graph._is_clustered():
+            # 十字链表布局下按 所属点 的索引连接Edge表 没有索引时逐步执行（沿链表）
+            return all(self._graph._has_index('Edge', Teamo.RANK_COLUMNS[direction][0])
+                for direction in CompiledTraversal.HOP_DIRECTIONS[name])
+        return True
+
+    # 记录的一段是否只编译成一条SQL：由V()/E()起始 或起点是不超过一块的id列表（如V(*ids)）
+    def _is_single_statement(self) -> bool:
+        if self._steps is not None:
+            return self._root[0] == 'query' or CompiledTraversal._fits_in_chunk(self._root[2], self._traversal._chunk_size)
+        traversal = self._traversal
+        ids = traversal._vertexs if traversal._is_vertex_in_use() else traversal._edges
+        return traversal._query is not None or CompiledTraversal._fits_in_chunk(ids, traversal._chunk_size)
+
+    @staticmethod
+    def _fits_in_chunk(ids: Iterable[int], chunk_size: int) -> bool:
+        return isinstance(ids, (list, tuple)) and len(ids) <= chunk_size
+
+    def _begin(self) -> None:
+        traversal = self._traversal
+        self._kind = self._current_kind()
+        table = CompiledTraversal.TABLES[self._kind]
+        if traversal._query is not None:
+            self._root = ('query',) + traversal._query
+        else:
+            self._root = ('ids', table, traversal._vertexs if self._kind == 'vertex' else traversal._edges)
+        self._steps = []
+
+    # 把记录的一段交给GraphTraversal：点集/边集为逐条取出这段SQL结果的生成器
+    def _flush(self) -> None:
+        if self._steps is None:
+            return
+        traversal = self._traversal
+        ids = self._iter_ids(self._root, self._steps, self._kind)
+        traversal._clean_vertex()
+        traversal._clean_edge()
+        if self._kind == 'vertex':
+            traversal._set_vertex(ids)
+        else:
+            traversal._set_edge(ids)
+        self._end()
+
+    def _end(self) -> None:
+        self._root = None
+        self._steps = None
+        self._kind = None
+
+    ##########################################
+    #             terminal step              #
+    ##########################################
+
+    def identity(self) -> Sequence[int]:
+        self._flush()
+        return self._traversal.identity()
+
+    # SELECT COUNT(*) 不取出任何id
+    def count(self) -> int:
+        if self._steps is None:
+            return self._traversal.count()
+        c = self._graph._conn.cursor()
+        number = 0
+        for (sql, args) in self._statements(self._root, self._steps, self._kind, 'count'):
+            c.execute(sql, args)
+            number += c.fetchone()[0]
+        self._clean()
+        return number
+
+    # 与取出id的同一条SQL中连接点/边表取出data
+    def values(self, *keys: str) -> List[Any]:
+        if self._steps is None or len(keys) == 0:
+            return self._traversal.values(*keys)
+        result = []
+        for (sql, args) in self._statements(self._root, self._steps, self._kind, 'data'):
+            for (data,) in self._graph._iter_query(sql, args, self._traversal._chunk_size):
+                props = {} if data is None else json.loads(data)
+                result.extend(props[key] for key in keys if key in props)
+        self._clean()
+        return result
+
+    def _clean(self) -> None:
+        self._traversal._clean_vertex()
+        self._traversal._clean_edge()
+        self._end()
+
+    def _iter_ids(self, root: Tuple, steps: List[Tuple[str, Tuple]], kind: str) -> Iterator[int]:
+        for (sql, args) in self._statements(root, steps, kind, 'ids'):
+            for (id_,) in self._graph._iter_query(sql, args, self._traversal._chunk_size):
+                yield id_
+
+    ##########################################
+    #               planner                  #
+    ##########################################
+
+    # 一段步骤的SQL 由表起始时只有一条；由上一步的id起始时每块一条 块内的下标写在 VALUES 中
+    # terminal：'ids' 按顺序取出id；'count' 个数；'data' 按顺序取出data
+    def _statements(self, root: Tuple, steps: List[Tuple[str, Tuple]], kind: str,
+            terminal: str) -> Iterator[Tuple[str, List[Any]]]:
+        if root[0] == 'query':
+            (_, table, conditions) = root
+            (where, args) = Teamo._where_clause(conditions)
+            relation = ('SELECT `id`, `id` AS `k0` FROM `{}` {}'.format(table, where), args, 1)
+            yield self._compile(relation, root[1], steps, kind, terminal)
+            return
+        (_, table, ids) = root
+        row = '({ph}, {i})' if self._graph._base_db == 'SQLite3' else 'ROW({ph}, {i})'
+        for chunk in chunked(ids, self._traversal._chunk_size):
+            frontier = 'WITH `Frontier`(`id`, `k0`) AS (VALUES {}) '.format(
+                ', '.join(row.format(ph=self._graph._ph, i=i) for i in range(len(chunk))))
+            (sql, args) = self._compile(('SELECT `id`, `k0` FROM `Frontier`', [], 1), table, steps, kind, terminal)
+            yield (frontier + sql, list(chunk) + args)
+
+    # relation为 (SQL, 参数, 排序键个数)
+    def _compile(self, relation: Tuple[str, List[Any], int], table: str, steps: List[Tuple[str, Tuple]],
+            kind: str, terminal: str) -> Tuple[str, List[Any]]:
+        # 个数与顺序无关 最后一步的dedup()直接写成 COUNT(DISTINCT id)
+        distinct = terminal == 'count' and steps[-1][0] == 'dedup'
+        if distinct:
+            steps = steps[:-1]
+        step_kind = 'vertex' if table == 'Vertex' else 'edge'
+        for (name, args) in steps:
+            relation = self._compile_step(relation, step_kind, name, args)
+            step_kind = CompiledTraversal.COMPILABLE_STEPS[name][1] or step_kind
+        (sql, args, key_number) = relation
+        order = CompiledTraversal._keys('s', key_number)
+        if terminal == 'count':
+            return ('SELECT COUNT({}s.`id`) FROM ({}) AS s'.format('DISTINCT ' if distinct else '', sql), args)
+        if terminal == 'data':
+            return ('SELECT t.`data` FROM ({}) AS s JOIN `{}` AS t ON t.`id` = s.`id` ORDER BY {}'.format(
+                sql, CompiledTraversal.TABLES[kind], order), args)
+        return ('SELECT s.`id` FROM ({}) AS s ORDER BY {}'.format(sql, order), args)
+
+    def _compile_step(self, relation: Tuple[str, List[Any], int], kind: str, name: str,
+            args: Tuple) -> Tuple[str, List[Any], int]:
+        (sql, sql_args, key_number) = relation
+        table = CompiledTraversal.TABLES[kind]
+        if name in ('hasLabel', 'has'):
+            if name == 'hasLabel':
+                (condition, condition_args, _) = self._graph._label_condition(args)
+            else:
+                (condition, condition_args, _) = self._graph._property_condition_of(
+                    table, args[0], GraphTraversal._predicate_of(args[1:]))
+            return ('SELECT s.* FROM ({}) AS s JOIN `{}` AS t ON t.`id` = s.`id` WHERE {}'.format(
+                sql, table, condition), sql_args + condition_args, key_number)
+        if name == 'dedup':
+            # 每个id只保留排序键最小的一行 即第一次出现的位置
+            keys = CompiledTraversal._keys('s', key_number)
+            return ('''SELECT `id`, {} FROM (SELECT s.*, ROW_NUMBER() OVER (PARTITION BY s.`id` ORDER BY {}) AS `occurrence`
+                FROM ({}) AS s) AS d WHERE `occurrence` = 1'''.format(
+                    CompiledTraversal._keys(None, key_number), keys, sql), sql_args, key_number)
+        if name in CompiledTraversal.ENDPOINT_COLUMNS:
+            columns = CompiledTraversal.ENDPOINT_COLUMNS[name]
+            branches = []
+            for (branch, column) in enumerate(columns):
+                keys = [ 's.`k{}`'.format(i) for i in range(key_number) ]
+                if len(columns) > 1:
+                    keys.append(str(branch))
+                branches.append(('SELECT e.`{}` AS `id`, {} FROM ({}) AS s JOIN `Edge` AS e ON e.`id` = s.`id`'.format(
+                    column, CompiledTraversal._aliases(keys), sql), sql_args))
+            return CompiledTraversal._union(branches, key_number + (len(columns) > 1))
+        return self._compile_hop(relation, name, args)
+
+    # 走一跳：连接邻接边 每个分支追加边在链表中的位次（clustered布局为 label, id）作为排序键
+    def _compile_hop(self, relation: Tuple[str, List[Any], int], name: str,
+            labels: Sequence[str]) -> Tuple[str, List[Any], int]:
+        (sql, sql_args, key_number) = relation
+        directions = CompiledTraversal.HOP_DIRECTIONS[name]
+        to_edge = name.endswith('E')
+        label_filter = ''
+        label_args = []
+        if labels:
+            codes = self._graph._label_codes_of(labels)
+            if len(codes) == 0:
+                label_filter = 'AND 1=0'
+            else:
+                label_filter = 'AND e.`label` IN ({})'.format(self._graph._placeholders(len(codes)))
+                label_args = codes
+        branches = []
+        for (branch, direction) in enumerate(directions):
+            if self._graph._is_clustered():
+                (table, owner, other) = Teamo.ADJACENCY_TABLES[direction]
+                ranks = [ 'e.`label`', 'e.`id`' ]
+            else:
+                (owner, rank) = Teamo.RANK_COLUMNS[direction]
+                (table, other) = ('Edge', 'head' if direction == 'out' else 'tail')
+                ranks = [ 'e.`{}`'.format(rank) ]
+            keys = [ 's.`k{}`'.format(i) for i in range(key_number) ]
+            # both()/bothE()每个点依次展开两个方向 分支键在点之后
+            if len(directions) > 1:
+                keys.append(str(branch))
+            branches.append(('SELECT e.`{}` AS `id`, {} FROM ({}) AS s JOIN `{}` AS e ON e.`{}` = s.`id` {}'.format(
+                'id' if to_edge else other, CompiledTraversal._aliases(keys + ranks), sql, table, owner, label_filter),
+                sql_args + label_args))
+        return CompiledTraversal._union(branches, key_number + (len(directions) > 1) + len(ranks))
+
+    @staticmethod
+    def _union(branches: List[Tuple[str, List[Any]]], key_number: int) -> Tuple[str, List[Any], int]:
+        return (' UNION ALL '.join(sql for (sql, _) in branches), [ arg for (_, args) in branches for arg in args ], key_number)
+
+    # 排序键的列名 例如 s.`k0`, s.`k1`
+    @staticmethod
+    def _keys(alias: Optional[str], key_number: int) -> str:
+        prefix = '' if alias is None else alias + '.'
+        return ', '.join('{}`k{}`'.format(prefix, i) for i in range(key_number))
+
+    # 把一组表达式依次命名为排序键 `k0`, `k1`, ...
+    @staticmethod
+    def _aliases(keys: Sequence[str]) -> str:
+        return ', '.join('{} AS `k{}`'.format(key, i) for (i, key) in enumerate(keys))
+
+# 命令行导入边列表文件到SQLite3数据库 例如：
+# python teamo.py import-edges com-lj.sqlite com-lj.ungraph.txt.gz --offset 1 --chunk-size 1000000
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(prog='teamo')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_edges = commands.add_parser('import-edges', help='流式导入SNAP格式的边列表文件')
+    import_edges.add_argument('database', help='SQLite3数据库文件')
+    import_edges.add_argument('path', help='边列表文件 可以是.gz')
+    import_edges.add_argument('--offset', type=int, default=0, help='文件中的id加上offset即为点的id（点的id由1开始）')
+    import_edges.add_argument('--chunk-size', type=int, default=1000000, help='每批插入的边数')
+    import_edges.add_argument('--comment', default='#', help='注释行的前缀')
+    import_edges.add_argument('--init', action='store_true', help='先删除已有的图再导入（慎用）')
+    import_edges.add_argument('--layout', choices=Teamo.LAYOUTS, help='与--init一起使用时新图的存储布局（默认linked）')
+    upgrade = commands.add_parser('upgrade', help='把旧版本的图升级为当前格式（label编码、边的位次）')
+    upgrade.add_argument('database', help='SQLite3数据库文件')
+    args = parser.parse_args(argv)
+    if args.command == 'import-edges':
+        conn = sqlite3.connect(args.database)
+        graph = Teamo(conn, db='sqlite3', layout=args.layout if args.init else None)
+        if args.init:
+            graph.destroy()
+            graph.init()
+        t = time.time()
+        count = graph.import_edge_list(args.path, offset=args.offset, chunk_size=args.chunk_size,
+            comment=args.comment, verbose=True)
+        elapsed = time.time() - t
+        print('{} edges imported in {:.2f}s => {:.0f} edges/s'.format(count, elapsed, count / max(elapsed, 1e-9)))
+        conn.close()
+    elif args.command == 'upgrade':
+        conn = sqlite3.connect(args.database)
+        if Teamo(conn, db='sqlite3').upgrade():
+            print('{} upgraded.'.format(args.database))
+        else:
+            print('{} is already up to date.'.format(args.database))
+        conn.close()
 
 if __name__ == "__main__":
     main()
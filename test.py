@@ -1,22 +1,28 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from teamo import Teamo
+from teamo import Teamo, P
+from typing import Optional, Sequence, Tuple, List, Callable, Any
+import contextlib
 import sqlite3
+import sys
 import pymysql
 import json
 import random
 import time
 import datetime
+import tracemalloc
+import tempfile
+import os
 
 # 甚至不用异常 直接退出 (原处理为 包装异常 并且不处理异常 直接抛出 结束程序)
 def shouldNotHappen(message: str) -> None:
     raise Exception(message)
 
 
-def generate_gremlin_modern_graph(conn, db: str):
+def generate_gremlin_modern_graph(conn, db: str, *, layout: Optional[str] = None):
     print('构建Gremlin Modern Graph Runing...')
-    graph = Teamo(conn, db=db)
+    graph = Teamo(conn, db=db, layout=layout)
     graph.destroy()
     graph.init()
     g = graph.traversal()
@@ -35,34 +41,29 @@ def generate_gremlin_modern_graph(conn, db: str):
     print('Done!')
 
 
-def generate_gremlin_modern_graph_in_branch(conn, db: str):
+def generate_gremlin_modern_graph_in_branch(conn, db: str, *, layout: Optional[str] = None):
     print('Build Gremlin Modern Graph Runing In Batch...')
-    graph = Teamo(conn, db=db)
+    graph = Teamo(conn, db=db, layout=layout)
     graph.destroy()
     graph.init()
     g = graph.traversal()
-    g.addV().label('person').data('{"name":"marko","age":29}').id()
-    g.addV().label('person').data('{"name":"vadas","age":27}').id()
-    g.addV().label('software').data('{"name":"lop","lang":"java"}').id()
-    g.addV().label('person').data('{"name":"josh","age":32}').id()
-    g.addV().label('software').data('{"name":"ripple","lang":"java"}').id()
-    g.addV().label('person').data('{"name":"peter","age":35}').id()
-    graph._add_edge_in_branch([ (1, 2), (1, 4), (1, 3), (4, 5), (4, 3), (6, 3) ])
-    # 找到点A所有出边 点B所有入边 取交集 即得 A -> B 的边
-    def take_e(va: int, vb: int) -> int:
-        va_out_e = g.V(va).outE().identity()
-        vb_in_e = g.V(vb).inE().identity()
-        e_set = set(va_out_e) & set(vb_in_e)
-        if len(e_set) != 1:
-            shouldNotHappen('应该只有一条由A到B的边（简单图）')
-        return e_set.pop()
-    # 为边插入标签属性
-    g.E(take_e(1, 2)).label('knows').data('{"weight:0.5"}')
-    g.E(take_e(1, 4)).label('knows').data('{"weight:1.0"}')
-    g.E(take_e(1, 3)).label('created').data('{"weight:0.4"}')
-    g.E(take_e(4, 5)).label('created').data('{"weight:1.0"}')
-    g.E(take_e(4, 3)).label('created').data('{"weight:0.4"}')
-    g.E(take_e(6, 3)).label('created').data('{"weight:0.2"}')
+    g.addVs([
+        ('person', '{"name":"marko","age":29}'),
+        ('person', '{"name":"vadas","age":27}'),
+        ('software', '{"name":"lop","lang":"java"}'),
+        ('person', '{"name":"josh","age":32}'),
+        ('software', '{"name":"ripple","lang":"java"}'),
+        ('person', '{"name":"peter","age":35}'),
+    ])
+    # 边的label与data和指针一起批量写入
+    g.addEs([
+        (1, 2, 'knows', '{"weight:0.5"}'),
+        (1, 4, 'knows', '{"weight:1.0"}'),
+        (1, 3, 'created', '{"weight:0.4"}'),
+        (4, 5, 'created', '{"weight:1.0"}'),
+        (4, 3, 'created', '{"weight:0.4"}'),
+        (6, 3, 'created', '{"weight:0.2"}'),
+    ])
     print('Done!')
 
 
@@ -77,61 +78,49 @@ def generate_sparse_graph(conn, db: str, vertex_number: int, out_degree: int):
     #     cur.execute("SET storage_engine=MYISAM;")
     # 基于数据库的抽象图
     graph = Teamo(conn, db=db)
-    # 若是sqlite3，关闭智能commit模式，便于自己操作事务
-    if graph.get_db_name().lower() == 'SQLite3'.lower():
-        conn.isolation_level = None
     # 删除已有表 慎用
     graph.destroy()
     # 从数据库中构建空图
     graph.init()
     g = graph.traversal()
-    cur = conn.cursor()
     # 单个事务，批量插入数据
-    cur.execute("BEGIN")
-    # 插点
-    for _ in range(vertex_number):
-        g.addVinRaw()
-    # 随机插入边
-    all_vertex = [ i + 1 for i in range(vertex_number) ]
-    random.shuffle(all_vertex)
-    count = 0
-    for from_vertex in all_vertex:
-        count = count + 1
-        for to_vertex in random.sample(all_vertex, random.randint(0, 2 * out_degree)):
-            g.addEinRaw(from_vertex, to_vertex)
-        print('vertex {} done. {}%'.format(count, count * 100 / vertex_number))
-    cur.execute("COMMIT")
+    with graph.batch():
+        # 插点
+        g.addVs(vertex_number)
+        # 随机插入边
+        all_vertex = [ i + 1 for i in range(vertex_number) ]
+        random.shuffle(all_vertex)
+        count = 0
+        for from_vertex in all_vertex:
+            count = count + 1
+            for to_vertex in random.sample(all_vertex, random.randint(0, 2 * out_degree)):
+                g.addE(from_vertex, to_vertex)
+            print('vertex {} done. {}%'.format(count, count * 100 / vertex_number))
 
 
 def generate_email_enron_graph(conn, db: str):
     graph = Teamo(conn, db=db)
-    # 若是sqlite3，关闭智能commit模式，便于自己操作事务
-    if graph.get_db_name().lower() == 'SQLite3'.lower():
-        conn.isolation_level = None
     graph.destroy()
     graph.init()
     g = graph.traversal()
-    cur = conn.cursor()
-    cur.execute("BEGIN")
-    # Nodes: 36692 Edges: 367662
-    for _ in range(36692):
-        g.addVinRaw()
-    with open('Email-Enron.txt') as f:
-        count = 0
-        # 解析一行中两个数字 并且增一（为了使点id由1开始）
-        to_int = lambda x: (int(x[0]) + 1, int(x[1]) + 1)
-        # 4是硬编码 默认原Email-Enron.txt仅有四行注释
-        lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
-        t = time.time()
-        for line in lines:
-            g.addEinRaw(line[0], line[1])
-            count = count + 1
-            if count % 10000 == 0:
-                print('edge {} done. {:8.2f}%'.format(count, count * 100 / 367662))
-        print('edge {} done. {:8.2f}%'.format(count, count * 100 / 367662))
-        elapsed = time.time() - t
-        print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
-    cur.execute("COMMIT")
+    with graph.batch():
+        # Nodes: 36692 Edges: 367662
+        g.addVs(36692)
+        with open('Email-Enron.txt') as f:
+            count = 0
+            # 解析一行中两个数字 并且增一（为了使点id由1开始）
+            to_int = lambda x: (int(x[0]) + 1, int(x[1]) + 1)
+            # 4是硬编码 默认原Email-Enron.txt仅有四行注释
+            lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
+            t = time.time()
+            for line in lines:
+                g.addE(line[0], line[1])
+                count = count + 1
+                if count % 10000 == 0:
+                    print('edge {} done. {:8.2f}%'.format(count, count * 100 / 367662))
+            print('edge {} done. {:8.2f}%'.format(count, count * 100 / 367662))
+            elapsed = time.time() - t
+            print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
 
 
 def generate_email_enron_graph_in_branch(conn, db: str):
@@ -140,49 +129,37 @@ def generate_email_enron_graph_in_branch(conn, db: str):
     graph.init()
     g = graph.traversal()
     # Nodes: 36692 Edges: 367662
-    for _ in range(36692):
-        g.addVinRaw()
-    conn.commit()
-    with open('Email-Enron.txt') as f:
-        # 解析一行中两个数字 并且增一（为了使点id由1开始）
-        to_int = lambda x: (int(x[0]) + 1, int(x[1]) + 1)
-        # 4是硬编码 默认原Email-Enron.txt仅有四行注释
-        lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
-        t = time.time()
-        g._graph._add_edge_in_branch(lines)
-        elapsed = time.time() - t
-        print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
+    g.addVs(36692)
+    # 流式导入 内存只与chunk_size和点数有关
+    t = time.time()
+    graph.import_edge_list('Email-Enron.txt', offset=1, verbose=True)
+    elapsed = time.time() - t
+    print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
 
 
 def generate_amazon0601_graph(conn, db: str):
     graph = Teamo(conn, db=db)
-    # 若是sqlite3，关闭智能commit模式，便于自己操作事务
-    if graph.get_db_name().lower() == 'SQLite3'.lower():
-        conn.isolation_level = None
     graph.destroy()
     graph.init()
     g = graph.traversal()
-    cur = conn.cursor()
-    cur.execute("BEGIN")
-    # Nodes: 403394 Edges: 3387388
-    for _ in range(403394):
-        g.addVinRaw()
-    with open('Amazon0601.txt') as f:
-        count = 0
-        # 解析一行中两个数字 并且增一（为了使点id由1开始）
-        to_int = lambda x: (int(x[0]) + 1, int(x[1]) + 1)
-        # 4是硬编码 默认原Amazon0601.txt仅有四行注释
-        lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
-        t = time.time()
-        for line in lines:
-            g.addEinRaw(line[0], line[1])
-            count = count + 1
-            if count % 100000 == 0:
-                print('edge {} done. {:8.2f}%'.format(count, count * 100 / 3387388))
-        print('edge {} done. {:8.2f}%'.format(count, count * 100 / 3387388))
-        elapsed = time.time() - t
-        print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
-    cur.execute("COMMIT")
+    with graph.batch():
+        # Nodes: 403394 Edges: 3387388
+        g.addVs(403394)
+        with open('Amazon0601.txt') as f:
+            count = 0
+            # 解析一行中两个数字 并且增一（为了使点id由1开始）
+            to_int = lambda x: (int(x[0]) + 1, int(x[1]) + 1)
+            # 4是硬编码 默认原Amazon0601.txt仅有四行注释
+            lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
+            t = time.time()
+            for line in lines:
+                g.addE(line[0], line[1])
+                count = count + 1
+                if count % 100000 == 0:
+                    print('edge {} done. {:8.2f}%'.format(count, count * 100 / 3387388))
+            print('edge {} done. {:8.2f}%'.format(count, count * 100 / 3387388))
+            elapsed = time.time() - t
+            print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
 
 
 def generate_amazon0601_graph_in_branch(conn, db: str):
@@ -191,49 +168,37 @@ def generate_amazon0601_graph_in_branch(conn, db: str):
     graph.init()
     g = graph.traversal()
     # Nodes: 403394 Edges: 3387388
-    for _ in range(403394):
-        g.addVinRaw()
-    conn.commit()
-    with open('Amazon0601.txt') as f:
-        # 解析一行中两个数字 并且增一（为了使点id由1开始）
-        to_int = lambda x: (int(x[0]) + 1, int(x[1]) + 1)
-        # 4是硬编码 默认原Amazon0601.txt仅有四行注释
-        lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
-        t = time.time()
-        g._graph._add_edge_in_branch(lines)
-        elapsed = time.time() - t
-        print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
+    g.addVs(403394)
+    # 流式导入 内存只与chunk_size和点数有关
+    t = time.time()
+    graph.import_edge_list('Amazon0601.txt', offset=1, verbose=True)
+    elapsed = time.time() - t
+    print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
 
 
 def generate_com_youtube_ungraph_graph(conn, db: str):
     graph = Teamo(conn, db=db)
-    # 若是sqlite3，关闭智能commit模式，便于自己操作事务
-    if graph.get_db_name().lower() == 'SQLite3'.lower():
-        conn.isolation_level = None
     graph.destroy()
     graph.init()
     g = graph.traversal()
-    cur = conn.cursor()
-    cur.execute("BEGIN")
-    # Nodes: 1134890(有问题 暂定 1157827) Edges: 2987624
-    for _ in range(1157827):
-        g.addVinRaw()
-    with open('com-youtube.ungraph.txt') as f:
-        count = 0
-        # 解析一行中两个数字 不需要增一（文件中id本身就是由1开始）
-        to_int = lambda x: (int(x[0]), int(x[1]))
-        # 4是硬编码 默认原com-youtube.ungraph.txt仅有四行注释
-        lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
-        t = time.time()
-        for line in lines:
-            g.addEinRaw(line[0], line[1])
-            count = count + 1
-            if count % 100000 == 0:
-                print('edge {} done. {:8.2f}%'.format(count, count * 100 / 2987624))
-        print('edge {} done. {:8.2f}%'.format(count, count * 100 / 2987624))
-        elapsed = time.time() - t
-        print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
-    cur.execute("COMMIT")
+    with graph.batch():
+        # Nodes: 1134890(有问题 暂定 1157827) Edges: 2987624
+        g.addVs(1157827)
+        with open('com-youtube.ungraph.txt') as f:
+            count = 0
+            # 解析一行中两个数字 不需要增一（文件中id本身就是由1开始）
+            to_int = lambda x: (int(x[0]), int(x[1]))
+            # 4是硬编码 默认原com-youtube.ungraph.txt仅有四行注释
+            lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
+            t = time.time()
+            for line in lines:
+                g.addE(line[0], line[1])
+                count = count + 1
+                if count % 100000 == 0:
+                    print('edge {} done. {:8.2f}%'.format(count, count * 100 / 2987624))
+            print('edge {} done. {:8.2f}%'.format(count, count * 100 / 2987624))
+            elapsed = time.time() - t
+            print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
 
 
 def generate_com_youtube_ungraph_graph_in_branch(conn, db: str):
@@ -242,49 +207,37 @@ def generate_com_youtube_ungraph_graph_in_branch(conn, db: str):
     graph.init()
     g = graph.traversal()
     # Nodes: 1134890(有问题 暂定 1157827) Edges: 2987624
-    for _ in range(1157827):
-        g.addVinRaw()
-    conn.commit()
-    with open('com-youtube.ungraph.txt') as f:
-        # 解析一行中两个数字 不需要增一（文件中id本身就是由1开始）
-        to_int = lambda x: (int(x[0]), int(x[1]))
-        # 4是硬编码 默认原com-youtube.ungraph.txt仅有四行注释
-        lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
-        t = time.time()
-        g._graph._add_edge_in_branch(lines)
-        elapsed = time.time() - t
-        print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
+    g.addVs(1157827)
+    # 流式导入 内存只与chunk_size和点数有关
+    t = time.time()
+    graph.import_edge_list('com-youtube.ungraph.txt', offset=0, verbose=True)
+    elapsed = time.time() - t
+    print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
 
 
 def generate_com_lj_ungraph_graph(conn, db: str):
     graph = Teamo(conn, db=db)
-    # 若是sqlite3，关闭智能commit模式，便于自己操作事务
-    if graph.get_db_name().lower() == 'SQLite3'.lower():
-        conn.isolation_level = None
     graph.destroy()
     graph.init()
     g = graph.traversal()
-    cur = conn.cursor()
-    cur.execute("BEGIN")
-    # Nodes: 3997962(有问题 暂定为 4040000) Edges: 34681189
-    for _ in range(4040000):
-        g.addVinRaw()
-    with open('com-lj.ungraph.txt') as f:
-        count = 0
-        # 解析一行中两个数字 不需要增一（文件中id本身就是由1开始）
-        to_int = lambda x: (int(x[0]) + 1, int(x[1]) + 1)
-        # 4是硬编码 默认原com-youtube.ungraph.txt仅有四行注释
-        lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
-        t = time.time()
-        for line in lines:
-            g.addEinRaw(line[0], line[1])
-            count = count + 1
-            if count % 1000000 == 0:
-                print('edge {} done. {:8.2f}%'.format(count, count * 100 / 34681189))
-        print('edge {} done. {:8.2f}%'.format(count, count * 100 / 34681189))
-        elapsed = time.time() - t
-        print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
-    cur.execute("COMMIT")
+    with graph.batch():
+        # Nodes: 3997962(有问题 暂定为 4040000) Edges: 34681189
+        g.addVs(4040000)
+        with open('com-lj.ungraph.txt') as f:
+            count = 0
+            # 解析一行中两个数字 不需要增一（文件中id本身就是由1开始）
+            to_int = lambda x: (int(x[0]) + 1, int(x[1]) + 1)
+            # 4是硬编码 默认原com-youtube.ungraph.txt仅有四行注释
+            lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
+            t = time.time()
+            for line in lines:
+                g.addE(line[0], line[1])
+                count = count + 1
+                if count % 1000000 == 0:
+                    print('edge {} done. {:8.2f}%'.format(count, count * 100 / 34681189))
+            print('edge {} done. {:8.2f}%'.format(count, count * 100 / 34681189))
+            elapsed = time.time() - t
+            print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
 
 
 def generate_com_lj_ungraph_graph_in_branch(conn, db: str):
@@ -293,18 +246,12 @@ def generate_com_lj_ungraph_graph_in_branch(conn, db: str):
     graph.init()
     g = graph.traversal()
     # Nodes: 3997962(有问题 暂定为 4040000) Edges: 34681189
-    for _ in range(4040000):
-        g.addVinRaw()
-    conn.commit()
-    with open('com-lj.ungraph.txt') as f:
-        # 解析一行中两个数字 不需要增一（文件中id本身就是由1开始）
-        to_int = lambda x: (int(x[0]) + 1, int(x[1]) + 1)
-        # 4是硬编码 默认原com-youtube.ungraph.txt仅有四行注释
-        lines = [ to_int(line.split()) for line in f.readlines()[4:] ]
-        t = time.time()
-        g._graph._add_edge_in_branch(lines)
-        elapsed = time.time() - t
-        print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
+    g.addVs(4040000)
+    # 流式导入 内存只与chunk_size和点数有关
+    t = time.time()
+    graph.import_edge_list('com-lj.ungraph.txt', offset=1, verbose=True)
+    elapsed = time.time() - t
+    print('[Raw] Time waste: {} => {}s'.format(datetime.timedelta(seconds=elapsed), elapsed))
 
 
 def modify_test_on_greamlin_modern_graph(conn, db: str) -> None:
@@ -398,58 +345,806 @@ def query_test_on_gremlin_modern_graph(conn, db: str) -> None:
     #         查询类功能         #
     #############################
 
-    # gt 和 t 只是为了打断点时看数值
-    _gt = g.V()
-    _gt = g.E()
-    _gt = g.V(6)
-    _gt = g.V(2, 3, 4)
-    _gt = g.E(1)
-    _gt = g.E(3, 6).identity()
-    _t = g.V(1).label()
-    _t = g.E(4).label()
-    _t = g.V(3).data()
-    _t = g.E(2).data()
-
-    _gt = g.V(1).outE()
-    _gt = g.V(1).outE('knows')
-    _gt = g.V(1).outE('knows', 'created')
-    _gt = g.V(1).outE('know')
-
-    _gt = g.V(3).inE().outV().pack('hey')
-    _gt = g.package('hey')
-    _gt = g.V(3).inE('knows').outV().identity()
-    _gt = g.V(3).inE('knows', 'created')
-    _gt = g.V(4).inE('knows')
-    _gt = g.V(1).inE()
-
-    _gt = g.E(1).inV()
-    _gt = g.E(2, 4).inV()
-    _gt = g.E().inV()
-
-    _gt = g.V(1).outE().inV()
-
-    _gt = g.V(1).out('knows').identity()
-
-    _gt = g.V(4).both()
-    _gt = g.V(4).both('knows')
-    _gt = g.V(4).both('created')
-    _gt = g.V(1).both()
-    _gt = g.V(1).both('created')
-    _gt = g.V(1).both('creat')
-
-    _gt = g.V(4).bothE()
-    _gt = g.V(1).bothE('created')
-    _gt = g.V(3).bothE()
-    _gt = g.V(6).bothE('knows')
-
-    _gt = g.E(3).bothV()
-    _gt = g.E(1, 5, 6).bothV()
-
-    _gt = g.V().pack('p1')
-    _gt = g.unpackV('p1').identity()
-    _gt = g.V(2, 4, 5).pack('p2')
-    _gt = g.unpackV('p2').identity()
+    # 遍历是惰性的 查询要以终止步骤（identity/label/data/pack等）结束才会真正执行 这里同时检查结果
+    if g.V().identity() != [ 1, 2, 3, 4, 5, 6 ]:
+        shouldNotHappen("g.V().identity() 结果不正确")
+    if g.E().identity() != [ 1, 2, 3, 4, 5, 6 ]:
+        shouldNotHappen("g.E().identity() 结果不正确")
+    if g.V(6).identity() != [ 6 ]:
+        shouldNotHappen("g.V(6).identity() 结果不正确")
+    if g.V(2, 3, 4).identity() != [ 2, 3, 4 ]:
+        shouldNotHappen("g.V(2, 3, 4).identity() 结果不正确")
+    if g.E(1).identity() != [ 1 ]:
+        shouldNotHappen("g.E(1).identity() 结果不正确")
+    if g.E(3, 6).identity() != [ 3, 6 ]:
+        shouldNotHappen("g.E(3, 6).identity() 结果不正确")
+    if g.V(1).label() != [ 'person' ]:
+        shouldNotHappen("g.V(1).label() 结果不正确")
+    if g.E(4).label() != [ 'created' ]:
+        shouldNotHappen("g.E(4).label() 结果不正确")
+    if g.V(3).data() != [ '{"name":"lop","lang":"java"}' ]:
+        shouldNotHappen("g.V(3).data() 结果不正确")
+    if g.E(2).data() != [ '{"weight:1.0"}' ]:
+        shouldNotHappen("g.E(2).data() 结果不正确")
+
+    if g.V(1).outE().identity() != [ 3, 2, 1 ]:
+        shouldNotHappen("g.V(1).outE().identity() 结果不正确")
+    if g.V(1).outE('knows').identity() != [ 2, 1 ]:
+        shouldNotHappen("g.V(1).outE('knows').identity() 结果不正确")
+    if g.V(1).outE('knows', 'created').identity() != [ 3, 2, 1 ]:
+        shouldNotHappen("g.V(1).outE('knows', 'created').identity() 结果不正确")
+    if g.V(1).outE('know').identity() != []:
+        shouldNotHappen("g.V(1).outE('know').identity() 结果不正确")
+
+    g.V(3).inE().outV().pack('hey')
+    if g.package('hey') != [ 6, 4, 1 ]:
+        shouldNotHappen("g.package('hey') 结果不正确")
+    if g.V(3).inE('knows').outV().identity() != []:
+        shouldNotHappen("g.V(3).inE('knows').outV().identity() 结果不正确")
+    if g.V(3).inE('knows', 'created').identity() != [ 6, 5, 3 ]:
+        shouldNotHappen("g.V(3).inE('knows', 'created').identity() 结果不正确")
+    if g.V(4).inE('knows').identity() != [ 2 ]:
+        shouldNotHappen("g.V(4).inE('knows').identity() 结果不正确")
+    if g.V(1).inE().identity() != []:
+        shouldNotHappen("g.V(1).inE().identity() 结果不正确")
+
+    if g.E(1).inV().identity() != [ 2 ]:
+        shouldNotHappen("g.E(1).inV().identity() 结果不正确")
+    if g.E(2, 4).inV().identity() != [ 4, 5 ]:
+        shouldNotHappen("g.E(2, 4).inV().identity() 结果不正确")
+    if g.E().inV().identity() != [ 2, 4, 3, 5, 3, 3 ]:
+        shouldNotHappen("g.E().inV().identity() 结果不正确")
+
+    if g.V(1).outE().inV().identity() != [ 3, 4, 2 ]:
+        shouldNotHappen("g.V(1).outE().inV().identity() 结果不正确")
+
+    if g.V(1).out('knows').identity() != [ 4, 2 ]:
+        shouldNotHappen("g.V(1).out('knows').identity() 结果不正确")
+
+    if g.V(4).both().identity() != [ 3, 5, 1 ]:
+        shouldNotHappen("g.V(4).both().identity() 结果不正确")
+    if g.V(4).both('knows').identity() != [ 1 ]:
+        shouldNotHappen("g.V(4).both('knows').identity() 结果不正确")
+    if g.V(4).both('created').identity() != [ 3, 5 ]:
+        shouldNotHappen("g.V(4).both('created').identity() 结果不正确")
+    if g.V(1).both().identity() != [ 3, 4, 2 ]:
+        shouldNotHappen("g.V(1).both().identity() 结果不正确")
+    if g.V(1).both('created').identity() != [ 3 ]:
+        shouldNotHappen("g.V(1).both('created').identity() 结果不正确")
+    if g.V(1).both('creat').identity() != []:
+        shouldNotHappen("g.V(1).both('creat').identity() 结果不正确")
+
+    if g.V(4).bothE().identity() != [ 2, 5, 4 ]:
+        shouldNotHappen("g.V(4).bothE().identity() 结果不正确")
+    if g.V(1).bothE('created').identity() != [ 3 ]:
+        shouldNotHappen("g.V(1).bothE('created').identity() 结果不正确")
+    if g.V(3).bothE().identity() != [ 6, 5, 3 ]:
+        shouldNotHappen("g.V(3).bothE().identity() 结果不正确")
+    if g.V(6).bothE('knows').identity() != []:
+        shouldNotHappen("g.V(6).bothE('knows').identity() 结果不正确")
+
+    if g.E(3).bothV().identity() != [ 3, 1 ]:
+        shouldNotHappen("g.E(3).bothV().identity() 结果不正确")
+    if g.E(1, 5, 6).bothV().identity() != [ 2, 1, 3, 4, 3, 6 ]:
+        shouldNotHappen("g.E(1, 5, 6).bothV().identity() 结果不正确")
+
+    g.V().pack('p1')
+    if g.unpackV('p1').identity() != [ 1, 2, 3, 4, 5, 6 ]:
+        shouldNotHappen("g.unpackV('p1').identity() 结果不正确")
+    g.V(2, 4, 5).pack('p2')
+    if g.unpackV('p2').identity() != [ 2, 4, 5 ]:
+        shouldNotHappen("g.unpackV('p2').identity() 结果不正确")
+
+    if g.V().has('age', P.gt(30)).values('name') != [ 'josh', 'peter' ]:
+        shouldNotHappen('has() 结果不正确')
+    if g.V().has('lang').identity() != [ 3, 5 ]:
+        shouldNotHappen('has() 结果不正确')
+    # out()的顺序取决于图是逐条加边还是批量导入的 只比较集合
+    if sorted(g.V(1).out().has('name', P.within('vadas', 'lop')).identity()) != [ 2, 3 ]:
+        shouldNotHappen('has() 结果不正确')
+    _gt = g.V().hasLabel('person').has('age', P.lte(29)).values('name')
+
+    print('Pass!')
+
+
+# 在新的内存数据库上用generate（默认逐条加边）构建Gremlin Modern Graph layout为存储布局
+def new_gremlin_modern_graph(generate=generate_gremlin_modern_graph, *, layout: Optional[str] = None) -> Teamo:
+    conn = sqlite3.connect(':memory:')
+    generate(conn, 'sqlite3', layout=layout)
+    return Teamo(conn, db='sqlite3')
+
+
+# 按块沿链表批量遍历(_walk_edge_chains)与逐条边遍历(_get_out_edge等)的结果必须一致
+# 有tail/head索引时按索引取边后在内存中排序 没有时为递归查询 两种情况都要检查
+def check_chain_walk(graph: Teamo) -> None:
+    vertices = graph.traversal().V().identity()
+    single = { 'out': (graph._get_out_edge, graph._get_out_edge_by_label),
+        'in': (graph._get_in_edge, graph._get_in_edge_by_label) }
+    for with_index in (True, False):
+        if not with_index:
+            for (table, *columns) in Teamo.DEFAULT_INDEXES:
+                graph.drop_index(table, *columns)
+        for (direction, (get_edges, get_edges_by_label)) in single.items():
+            for labels in ([], [ 'knows' ], [ 'created', 'knows' ], [ 'unknown' ]):
+                walked = graph._walk_edge_chains(vertices, direction, labels)
+                for v in vertices:
+                    expected = list(get_edges_by_label(v, labels) if labels else get_edges(v))
+                    if walked.get(v, []) != expected:
+                        shouldNotHappen('按块遍历与逐条遍历{}边的结果不一致: 点{} {}'.format(direction, v, labels))
+    for (table, *columns) in Teamo.DEFAULT_INDEXES:
+        graph.create_index(table, *columns)
+
+
+# 批量取边端点的outV/inV/bothV与逐条边查询(_get_out_vertex/_get_in_vertex)的结果必须一致
+def check_edge_endpoints(graph: Teamo) -> None:
+    g = graph.traversal()
+    edges = g.E().identity()
+    tails = [ graph._get_out_vertex(e) for e in edges ]
+    heads = [ graph._get_in_vertex(e) for e in edges ]
+    if g.E().outV().identity() != tails or g.E().inV().identity() != heads:
+        shouldNotHappen('批量取边端点与逐条查询的结果不一致')
+    if g.E().bothV().identity() != [ v for (tail, head) in zip(tails, heads) for v in (head, tail) ]:
+        shouldNotHappen('bothV与逐条查询的结果不一致')
+
+
+# 一步到邻接点的out()/in_()与先取边再取端点的outE().inV()/inE().outV()的结果必须一致
+def check_fused_neighbor(graph: Teamo) -> None:
+    g = graph.traversal()
+    for labels in ([], [ 'knows' ], [ 'created', 'knows' ], [ 'unknown' ]):
+        for v in [ None ] + list(g.V().identity()):
+            start = (lambda: g.V()) if v is None else (lambda: g.V(v))
+            if start().out(*labels).identity() != start().outE(*labels).inV().identity():
+                shouldNotHappen('out与outE().inV()的结果不一致: 点{} {}'.format(v, labels))
+            if start().in_(*labels).identity() != start().inE(*labels).outV().identity():
+                shouldNotHappen('in_与inE().outV()的结果不一致: 点{} {}'.format(v, labels))
+
+
+# 惰性遍历按块处理 块的大小不能影响任何查询的结果（包括both中每个点先出后入、bothE中每个点先入后出的顺序）
+def check_chunked_pipeline(graph: Teamo) -> None:
+    queries = [
+        lambda g: g.V().out().identity(),
+        lambda g: g.V().in_('created').identity(),
+        lambda g: g.V().both().identity(),
+        lambda g: g.V().bothE('knows', 'created').identity(),
+        lambda g: g.V().both().both().dedup().identity(),
+        lambda g: g.E().bothV().identity(),
+        lambda g: g.V().outE().inV().hasLabel('software').identity(),
+        lambda g: g.V().out().out().label(),
+        lambda g: g.V().both().range(2, 7).identity(),
+        lambda g: g.V().both().count(),
+    ]
+    for (i, query) in enumerate(queries):
+        expected = query(graph.traversal())
+        for chunk_size in (1, 2, 5):
+            if query(graph.traversal(chunk_size=chunk_size)) != expected:
+                shouldNotHappen('第{}个查询在chunk_size={}时的结果不一致'.format(i, chunk_size))
+    g = graph.traversal(chunk_size=1)
+    for v in g.V().identity():
+        if g.V(v).both().identity() != g.V(v).out().identity() + g.V(v).in_().identity():
+            shouldNotHappen('both的结果不是点{}的出邻接点后接入邻接点'.format(v))
+        if g.V(v).bothE().identity() != g.V(v).inE().identity() + g.V(v).outE().identity():
+            shouldNotHappen('bothE的结果不是点{}的入边后接出边'.format(v))
+
+
+# 批量读写label/data与逐个元素读写(_get_vertex_label/_set_vertex_label等)的结果必须一致
+def check_batched_properties() -> None:
+    graph = new_gremlin_modern_graph()
+    g = graph.traversal()
+    vertices = g.V().both().identity()
+    edges = g.V().bothE().identity()
+    if g.V().both().label() != [ graph._get_vertex_label(v) for v in vertices ] \
+            or g.V().both().data() != [ graph._get_vertex_data(v) for v in vertices ]:
+        shouldNotHappen('批量读点的label/data与逐个读的结果不一致')
+    if g.V().bothE().label() != [ graph._get_edge_label(e) for e in edges ] \
+            or g.V().bothE().data() != [ graph._get_edge_data(e) for e in edges ]:
+        shouldNotHappen('批量读边的label/data与逐个读的结果不一致')
+    single = new_gremlin_modern_graph()
+    g.V(1, 3).label('engineer').data('{"name":"x"}')
+    g.E(2, 5).label('likes').data('{"weight:0.9"}')
+    for v in (1, 3):
+        single._set_vertex_label(v, 'engineer')
+        single._set_vertex_data(v, '{"name":"x"}')
+    for e in (2, 5):
+        single._set_edge_label(e, 'likes')
+        single._set_edge_data(e, '{"weight:0.9"}')
+    if dump_graph(graph) != dump_graph(single):
+        shouldNotHappen('批量写label/data与逐个写得到的图不一致')
+
+
+# 在写批次(batch)中逐个加点加边 得到的图必须与每步自动提交时完全一致；批次中出现异常时所有修改都要回滚
+def check_write_batch() -> None:
+    (vertices, edges) = dump_graph(new_gremlin_modern_graph())
+    for commit_every in (None, 1, 4):
+        graph = Teamo(sqlite3.connect(':memory:'), db='sqlite3')
+        graph.init()
+        g = graph.traversal()
+        with g.batch(commit_every):
+            for (_, _, _, label, data) in vertices:
+                g.addV().label(label).data(data)
+            for (_, tail, head, _, _, _, _, label, data) in edges:
+                g.addE(tail, head).label(label).data(data)
+        if dump_graph(graph) != (vertices, edges):
+            shouldNotHappen('commit_every={}的写批次与自动提交得到的图不一致'.format(commit_every))
+        try:
+            with g.batch():
+                v = g.addV().label('person').id()
+                g.addE(v, 1).label('knows')
+                g.V(4).drop()
+                g.E(1).data('{"weight:0.0"}')
+                raise RuntimeError('rollback')
+        except RuntimeError:
+            pass
+        if dump_graph(graph) != (vertices, edges):
+            shouldNotHappen('写批次出现异常后没有完全回滚')
+
+
+# 批量加边(addEs)得到的图（十字链表指针、链表顺序、label与data）必须与逐条addE完全一致
+def check_bulk_edges() -> None:
+    expected = dump_graph(new_gremlin_modern_graph())
+    if dump_graph(new_gremlin_modern_graph(generate_gremlin_modern_graph_in_branch)) != expected:
+        shouldNotHappen('addVs/addEs与逐个addV/addE得到的图不一致')
+    graph = new_gremlin_modern_graph()
+    g = graph.traversal()
+    g.E().drop()
+    edges = expected[1]
+    g.addEs([ (tail, head) for (_, tail, head, *_) in edges ],
+        labels=[ label for (*_, label, _) in edges ], datas=[ data for (*_, data) in edges ])
+    if dump_graph(graph) != expected:
+        shouldNotHappen('addEs(labels=, datas=)与逐条addE得到的图不一致')
+
+
+# 流式导入边列表文件(import_edge_list)得到的图必须与逐条addE完全一致 与chunk_size无关
+def check_import_edge_list() -> None:
+    (_, edges) = dump_graph(new_gremlin_modern_graph())
+    expected = Teamo(sqlite3.connect(':memory:'), db='sqlite3')
+    expected.init()
+    g = expected.traversal()
+    g.addVs(6)
+    for (_, tail, head, *_) in edges:
+        g.addE(tail, head)
+    with tempfile.TemporaryDirectory() as path:
+        # 文件中的id从0开始 另外带有注释、空行与多余的列
+        file_name = os.path.join(path, 'modern.txt')
+        with open(file_name, 'w') as f:
+            f.write('# Gremlin Modern Graph\n# FromNodeId\tToNodeId\n')
+            for (_, tail, head, *_) in edges:
+                f.write('{}\t{}\t1\n\n'.format(tail - 1, head - 1))
+        for chunk_size in (1, 4, 1000):
+            graph = Teamo(sqlite3.connect(':memory:'), db='sqlite3')
+            graph.init()
+            if graph.import_edge_list(file_name, offset=1, chunk_size=chunk_size) != len(edges):
+                shouldNotHappen('导入的边数不对')
+            if dump_graph(graph) != dump_graph(expected):
+                shouldNotHappen('chunk_size={}时导入与逐条addE得到的图不一致'.format(chunk_size))
+
+
+# 批量加边时新链表直接衔接在点已有的链表之前 得到的图必须与在已有的图上逐条addE完全一致
+def check_splice_chains() -> None:
+    more = [ (1, 3, 'created'), (3, 1, None), (4, 4, 'knows'), (1, 2, 'knows'), (7, 3, 'created'), (2, 7, None) ]
+    (bulk, single) = (new_gremlin_modern_graph(), new_gremlin_modern_graph())
+    for graph in (bulk, single):
+        g = graph.traversal()
+        g.E(2).drop()
+        g.addV()
+    bulk.traversal().addEs([ (tail, head, label, None) for (tail, head, label) in more ])
+    g = single.traversal()
+    for (tail, head, label) in more:
+        e = g.addE(tail, head)
+        if label is not None:
+            e.label(label)
+    if dump_graph(bulk) != dump_graph(single):
+        shouldNotHappen('在已有的链表上批量加边与逐条addE得到的图不一致')
+    for v in range(1, 8):
+        if bulk.traversal().V(v).both().identity() != g.V(v).both().identity():
+            shouldNotHappen('在已有的链表上批量加边后点{}的邻接点不一致'.format(v))
+
+
+# 批量删除(drop)后的图（十字链表指针、度数）必须与逐个_remove_vertex/_remove_edge完全一致
+def check_bulk_drop() -> None:
+    cases = [ ('Vertex', [ 4 ]), ('Vertex', [ 1, 4 ]), ('Vertex', [ 3, 2, 6 ]), ('Vertex', [ 1, 2, 3, 4, 5, 6 ]),
+        ('Edge', [ 2 ]), ('Edge', [ 1, 2, 3 ]), ('Edge', [ 6, 3, 5 ]), ('Edge', [ 1, 2, 3, 4, 5, 6 ]) ]
+    for (table, ids) in cases:
+        (bulk, single) = (new_gremlin_modern_graph(), new_gremlin_modern_graph())
+        g = bulk.traversal()
+        (g.V(*ids) if table == 'Vertex' else g.E(*ids)).drop()
+        for i in ids:
+            (single._remove_vertex if table == 'Vertex' else single._remove_edge)(i)
+        if dump_graph(bulk) != dump_graph(single) \
+                or g.V().outDegree() != single.traversal().V().outDegree() \
+                or g.V().inDegree('created') != single.traversal().V().inDegree('created'):
+            shouldNotHappen('批量删除{} {}与逐个删除得到的图不一致'.format(table, ids))
+
+
+# 两种存储布局的遍历结果必须一致 clustered中每个点的边按 (label, id) 排序 因此逐个点比较排序后的结果
+# 批量加边、修改label、删除之后也要一致
+def check_layouts() -> None:
+    graphs = [ new_gremlin_modern_graph(), new_gremlin_modern_graph(layout='clustered'),
+        new_gremlin_modern_graph(generate_gremlin_modern_graph_in_branch, layout='clustered') ]
+    queries = [
+        lambda g, v: g.V(v).out().identity(),
+        lambda g, v: g.V(v).in_().identity(),
+        lambda g, v: g.V(v).both('knows').identity(),
+        lambda g, v: g.V(v).outE('created').identity(),
+        lambda g, v: g.V(v).inE('knows', 'created').identity(),
+        lambda g, v: g.V(v).bothE().outV().identity(),
+        lambda g, v: g.V(v).out().out().identity(),
+    ]
+    for modify in (None, lambda g: g.addEs([ (3, 1, 'uses', None), (5, 5, None, None) ]),
+            lambda g: g.E(1, 4).label('created'), lambda g: g.V(4).drop(), lambda g: g.V(1).outE('created').drop()):
+        for graph in graphs:
+            if modify is not None:
+                modify(graph.traversal())
+        for v in graphs[0].traversal().V().identity():
+            for (i, query) in enumerate(queries):
+                results = [ sorted(query(graph.traversal(), v)) for graph in graphs ]
+                if any(result != results[0] for result in results):
+                    shouldNotHappen('第{}个查询在两种布局下对点{}的结果不一致'.format(i, v))
+        if any(graph.traversal().V().outDegree('knows') != graphs[0].traversal().V().outDegree('knows')
+                or graph.traversal().V().inDegree() != graphs[0].traversal().V().inDegree() for graph in graphs):
+            shouldNotHappen('两种布局下的度数不一致')
+
+
+# 维护好的度数必须与逐个点数outE/inE/bothE的结果一致 加边、批量加边、修改label、删除之后以及快照上都要一致
+def check_degrees() -> None:
+    for layout in (None, 'clustered'):
+        graph = new_gremlin_modern_graph(layout=layout)
+        for modify in (None, lambda g: g.addE(3, 3).label('knows'), lambda g: g.addEs([ (2, 1, 'created', None), (2, 1) ]),
+                lambda g: g.E(1, 5).label('likes'), lambda g: g.V(1).outE('knows').drop(), lambda g: g.V(4).drop()):
+            if modify is not None:
+                modify(graph.traversal())
+            for g in (graph.traversal(), graph.traversal(snapshot=graph.snapshot())):
+                vertices = g.V().identity()
+                for labels in ([], [ 'knows' ], [ 'created', 'likes' ]):
+                    for (degree, edges) in ((g.V().outDegree(*labels), lambda v: g.V(v).outE(*labels)),
+                            (g.V().inDegree(*labels), lambda v: g.V(v).inE(*labels)),
+                            (g.V().bothDegree(*labels), lambda v: g.V(v).bothE(*labels))):
+                        if degree != [ len(edges(v).identity()) for v in vertices ]:
+                            shouldNotHappen('度数与邻接边数不一致: {} {}'.format(layout, labels))
+
+
+# 索引的创建、列出与删除 以及删除索引后各种查询退回不用索引的做法 结果不变
+def check_indexes() -> None:
+    graph = new_gremlin_modern_graph()
+    g = graph.traversal()
+    queries = [
+        lambda g: g.V().out().identity(),
+        lambda g: g.V().in_('knows').identity(),
+        lambda g: g.V().bothE('created').identity(),
+        lambda g: g.V().hasLabel('person').out().hasLabel('software').identity(),
+        lambda g: g.E().hasLabel('knows').inV().identity(),
+    ]
+    expected = [ query(g) for query in queries ]
+    def check(state: str) -> None:
+        for g in (graph.traversal(), graph.traversal(compiled=True)):
+            if [ query(g) for query in queries ] != expected:
+                shouldNotHappen('{}时的查询结果不一致'.format(state))
+        # 另一个连接看到的索引与本实例记录的一致
+        if sorted(Teamo(graph.get_connection(), db='sqlite3').list_indexes()) != sorted(graph.list_indexes()):
+            shouldNotHappen('{}时list_indexes与数据库中的索引不一致'.format(state))
+    if sorted(columns for (_, _, columns) in graph.list_indexes()) != sorted(tuple(index[1:]) for index in Teamo.DEFAULT_INDEXES):
+        shouldNotHappen('init()没有创建默认索引')
+    if not graph._has_index('Edge', 'tail') or not graph._has_rank_index('out'):
+        shouldNotHappen('默认的点为中心的索引应当可以按tail查找')
+    check('默认索引')
+    # 只剩按tail查找的普通索引：按tail取边 label过滤沿链表
+    graph.drop_index('Edge', 'tail', 'label', 'out_rank')
+    if graph._has_index('Edge', 'tail') or graph._has_rank_index('out'):
+        shouldNotHappen('删除后仍然认为有索引')
+    name = graph.create_index('Edge', 'tail')
+    if graph.create_index('Edge', 'tail') != name or [ columns for (name_, _, columns) in graph.list_indexes() if name_ == name ] != [ ('tail',) ]:
+        shouldNotHappen('重复创建索引应当返回已有的索引')
+    if not graph._has_index('Edge', 'tail') or graph._has_rank_index('out'):
+        shouldNotHappen('Edge(tail)不是点为中心的索引')
+    check('只有Edge(tail)')
+    # 没有任何索引：沿链表的递归查询 编译模式下走一跳不编译
+    for (_, table, columns) in graph.list_indexes():
+        graph.drop_index(table, *columns)
+    graph.drop_index('Edge', 'head')
+    if graph.list_indexes() != [] or graph._has_index('Edge', 'head'):
+        shouldNotHappen('索引没有全部删除')
+    check('没有索引')
+    name = graph.create_property_index('Vertex', 'age')
+    if graph.list_property_indexes() != [ (name, 'Vertex', 'age') ] or not graph._has_property_index('Vertex', 'age'):
+        shouldNotHappen('属性索引没有列出')
+    graph.drop_property_index('Vertex', 'age')
+    if graph.list_property_indexes() != []:
+        shouldNotHappen('属性索引没有删除')
+    for (table, *columns) in Teamo.DEFAULT_INDEXES:
+        graph.create_index(table, *columns)
+    check('重建默认索引')
+
+
+# 在CSR快照上遍历与直接查询数据库的结果（包括顺序与重复）必须一致 快照不反映之后对图的修改
+def check_snapshot() -> None:
+    queries = [
+        lambda g: g.V().out().identity(),
+        lambda g: g.V().in_('knows').identity(),
+        lambda g: g.V().both().both('created', 'knows').identity(),
+        lambda g: g.V().outE().inV().identity(),
+        lambda g: g.V().inE('created').outV().identity(),
+        lambda g: g.V(1, 4).bothE().bothV().identity(),
+        lambda g: g.E().hasLabel('knows').outV().identity(),
+        lambda g: g.V().hasLabel('person').out('created').hasLabel('software').identity(),
+        lambda g: g.V(3).in_('unknown').identity(),
+        lambda g: g.V().out().label(),
+    ]
+    for layout in Teamo.LAYOUTS:
+        graph = new_gremlin_modern_graph(layout=layout)
+        snapshot = graph.snapshot()
+        expected = [ query(graph.traversal()) for query in queries ]
+        graph.traversal().addE(5, 1).label('knows')
+        graph.traversal().V(6).drop()
+        g = graph.traversal(snapshot=snapshot)
+        for (i, query) in enumerate(queries):
+            if query(g) != expected[i]:
+                shouldNotHappen('{}布局 第{}个查询在快照上的结果与数据库不一致'.format(layout, i))
+
+
+# 开启label/data缓存时 读取的结果必须总是与数据库一致：修改、删除之后以及写批次回滚之后都不能读到旧值
+def check_property_cache() -> None:
+    conn = new_gremlin_modern_graph().get_connection()
+    uncached = Teamo(conn, db='sqlite3')
+    graph = Teamo(conn, db='sqlite3', cache_size=4)
+    g = graph.traversal()
+    def check(state: str) -> None:
+        u = uncached.traversal()
+        if g.V().label() != u.V().label() or g.V().data() != u.V().data() or g.E().label() != u.E().label() \
+                or g.E().data() != u.E().data() or g.V().values('name') != u.V().values('name') \
+                or [ graph._get_vertex_label(v) for v in u.V().identity() ] != u.V().label():
+            shouldNotHappen('{}后缓存中有旧值'.format(state))
+    if uncached.cache_stats() is not None or graph.cache_stats() != { 'capacity': 4, 'size': 0, 'hits': 0, 'misses': 0 }:
+        shouldNotHappen('缓存的初始状态不对')
+    g.V(1).label()
+    g.V(1).label()
+    stats = graph.cache_stats()
+    if (stats['hits'], stats['misses'], stats['size']) != (1, 1, 1):
+        shouldNotHappen('第二次读取应当命中缓存')
+    check('读取全部label/data')
+    if graph.cache_stats()['size'] != 4:
+        shouldNotHappen('缓存超出了容量')
+    g.V(1, 2).label('engineer').data('{"name":"marko2"}')
+    g.E(1).label('likes')
+    graph._set_edge_data(2, '{"weight:0.1"}')
+    graph._set_vertex_label(3, 'library')
+    check('修改label/data')
+    g.V(6).drop()
+    g.E(3).drop()
+    # 新的点与边复用被删除的id
+    g.addV().data('{"name":"new"}')
+    g.addE(1, 3).label('created')
+    check('删除后复用id')
+    try:
+        with g.batch():
+            g.V(4, 5).label('changed').data('{"name":"changed"}')
+            g.E(4).label('changed')
+            if g.V(4, 5).label() != [ 'changed', 'changed' ] or g.E(4).label() != [ 'changed' ]:
+                shouldNotHappen('写批次中读不到自己的修改')
+            raise RuntimeError('rollback')
+    except RuntimeError:
+        pass
+    check('写批次回滚')
+    graph.clear_cache()
+    if graph.cache_stats()['size'] != 0:
+        shouldNotHappen('clear_cache后缓存不为空')
+
+
+# 有无属性索引时has()的结果必须完全一致 且与在Python中逐个判断(P.test)一致
+# 包括大小写、首尾空格不同的字符串、超过索引长度的长字符串、数值与不存在的属性
+def check_property_index() -> None:
+    long_name = 'marko' * 200
+    names = [ 'marko', 'MARKO', 'Marko', 'marko ', ' marko', 'márko', 'marko\t', long_name, long_name.upper(), long_name + 'x',
+        'vadas', 'lop', '', 29, 29.5, True, None ]
+    graph = Teamo(sqlite3.connect(':memory:'), db='sqlite3')
+    graph.init()
+    g = graph.traversal()
+    g.addVs([ ('person', json.dumps({ 'name': name }) if name is not None else '{}') for name in names ])
+    predicates = [ P.eq('marko'), P.eq('MARKO'), P.eq('marko '), P.eq(long_name), P.eq(long_name.upper()), P.neq('marko'),
+        P.lt('marko'), P.lte('marko'), P.gt('marko'), P.gte(long_name), P.gt(long_name), P.lt('marko\t'),
+        P.within('MARKO', 'lop', long_name), P.without('marko', long_name), P.eq(29), P.gt(20), P.eq(True), P.eq('') ]
+    properties = graph._get_parsed_data_in_batch('Vertex', g.V().identity())
+    def run() -> List[List[int]]:
+        results = []
+        for predicate in predicates:
+            expected = [ v for v in sorted(properties) if predicate.test(properties[v], 'name') ]
+            for result in (g.V().has('name', predicate).identity(), g.V(*g.V().identity()).has('name', predicate).identity(),
+                    graph.traversal(compiled=True).V().has('name', predicate).identity()):
+                if result != expected:
+                    shouldNotHappen('has(name, {} {})的结果与P.test不一致'.format(predicate.operator, predicate.values))
+            results.append(expected)
+        return results
+    without_index = run()
+    graph.create_property_index('Vertex', 'name')
+    if run() != without_index:
+        shouldNotHappen('有无属性索引时has()的结果不一致')
+
+
+# 沿十字链表取出图的内容 与边的id无关：每个点的 (点的行, 出边链表, 入边链表) 链表中每条边为 (tail, head, label, data, 出位次, 入位次)
+# 同时检查每条链表的逆向指针与正向指针一致
+def dump_chains(graph: Teamo) -> List[Tuple]:
+    c = graph.get_connection().cursor()
+    c.execute('''SELECT `id`, `tail`, `head`, `backward`, `forward`, `revback`, `revfor`, `label`, `data`, `out_rank`, `in_rank` FROM Edge''')
+    edges = { row[0]: row for row in c.fetchall() }
+    c.execute('''SELECT `id`, `out_edge`, `in_edge`, `label`, `data`, `out_degree`, `in_degree` FROM Vertex ORDER BY `id`''')
+    chains = []
+    for (vertex, out_edge, in_edge, label, data, out_degree, in_degree) in c.fetchall():
+        walked = []
+        for (edge_id, next_column, prev_column) in ((out_edge, 4, 6), (in_edge, 3, 5)):
+            chain = []
+            previous = None
+            while edge_id is not None:
+                edge = edges[edge_id]
+                if edge[prev_column] != previous:
+                    shouldNotHappen('点{}的链表中边{}的逆向指针不对'.format(vertex, edge_id))
+                chain.append(edge[1:3] + (graph._decode_label(edge[7]),) + edge[8:])
+                (previous, edge_id) = (edge_id, edge[next_column])
+            walked.append(chain)
+        chains.append((vertex, graph._decode_label(label), data, out_degree, in_degree, walked[0], walked[1]))
+    return chains
+
+
+# 整理边表(compact)之后 每条链表中边的先后顺序、位次、label、data与度数都不变 索引全部重建 每个点的出边连续编号
+def check_compact() -> None:
+    random.seed('compact')
+    graph = Teamo(sqlite3.connect(':memory:'), db='sqlite3')
+    graph.init()
+    g = graph.traversal()
+    g.addVs([ (random.choice([ 'person', 'software' ]), json.dumps({ 'name': 'v{}'.format(i) })) for i in range(30) ])
+    for _ in range(3):
+        g.addEs([ (random.randint(1, 30), random.randint(1, 30), random.choice([ 'knows', 'created', None ]),
+            json.dumps({ 'weight': random.random() })) for _ in range(100) ])
+        for _ in range(20):
+            g.addE(random.randint(1, 30), random.randint(1, 30)).label('likes').data('{"weight":1}')
+        g.E(*random.sample(g.E().identity(), 30)).drop()
+    g.V(7, 19).drop()
+    graph.create_property_index('Edge', 'weight')
+    graph.create_index('Edge', 'data')
+    before = dump_chains(graph)
+    indexes = sorted(graph.list_indexes())
+    queries = [
+        lambda g: g.V().outE().values('weight'),
+        lambda g: g.V().in_('knows', 'likes').identity(),
+        lambda g: g.V().bothE('created').label(),
+        lambda g: g.E().has('weight', P.gt(0.5)).count(),
+        lambda g: g.V().outDegree('likes') + g.V().inDegree(),
+    ]
+    expected = [ query(g) for query in queries ]
+    graph.compact()
+    if dump_chains(graph) != before:
+        shouldNotHappen('整理边表后链表的内容或顺序变了')
+    if sorted(graph.list_indexes()) != indexes or sorted(Teamo(graph.get_connection(), db='sqlite3').list_indexes()) != indexes:
+        shouldNotHappen('整理边表后索引没有全部重建')
+    if [ query(graph.traversal()) for query in queries ] != expected:
+        shouldNotHappen('整理边表后的查询结果不一致')
+    if g.V().outE().identity() != list(range(1, g.E().count() + 1)):
+        shouldNotHappen('整理边表后每个点的出边没有连续编号')
+
+
+# 只有大小写或末尾空格不同的label各自有独立的编码 并且原样读回
+def check_label_case() -> None:
+    graph = new_gremlin_modern_graph()
+    g = graph.traversal()
+    names = [ 'person', 'Person', 'PERSON', 'person ' ]
+    vertices = [ g.addV().label(name).id() for name in names ]
+    edges = [ g.addE(vertices[0], v).label(name).id() for (v, name) in zip(vertices, names) ]
+    for graph in (graph, Teamo(graph.get_connection(), db='sqlite3')):
+        g = graph.traversal()
+        if g.V(*vertices).label() != names or g.E(*edges).label() != names:
+            shouldNotHappen('label读回时被改变')
+        for (v, e, name) in zip(vertices, edges, names):
+            if [ x for x in g.V().hasLabel(name).identity() if x in vertices ] != [ v ] or g.E().hasLabel(name).identity() != [ e ]:
+                shouldNotHappen('hasLabel({!r})的结果不正确'.format(name))
+        if len(set(graph._label_codes_of(names))) != len(names):
+            shouldNotHappen('只有大小写不同的label共用了编码')
+
 
+# 按最初版本的表结构（label为文本 没有位次与度数 索引由用户手工建立）建立一个与graph内容相同的图
+def new_baseline_graph(graph: Teamo) -> Teamo:
+    (vertices, edges) = dump_graph(graph)
+    conn = sqlite3.connect(':memory:')
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE `Edge` (
+            `id`	INTEGER PRIMARY KEY NOT NULL UNIQUE,
+            `tail`	INTEGER NOT NULL,
+            `head`	INTEGER NOT NULL,
+            `backward`	INTEGER,
+            `forward`	INTEGER,
+            `revback`	INTEGER,
+            `revfor`	INTEGER,
+            `label`   TEXT,
+            `data`	TEXT
+        );
+    ''')
+    c.execute('''
+        CREATE TABLE `Vertex` (
+            `id`	INTEGER PRIMARY KEY NOT NULL UNIQUE,
+            `in_edge`	INTEGER,
+            `out_edge`	INTEGER,
+            `label`   TEXT,
+            `data`	TEXT
+        );
+    ''')
+    c.executemany('''INSERT INTO Vertex (`id`, `out_edge`, `in_edge`, `label`, `data`) VALUES (?, ?, ?, ?, ?)''', vertices)
+    c.executemany(
+        '''INSERT INTO Edge (`id`, `tail`, `head`, `backward`, `forward`, `revback`, `revfor`, `label`, `data`)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', edges
+    )
+    for (table, column) in (('Edge', 'tail'), ('Edge', 'head'), ('Edge', 'label'), ('Vertex', 'label')):
+        c.execute('''CREATE INDEX `{table}_{column}` ON `{table}` (`{column}`)'''.format(table=table, column=column))
+    conn.commit()
+    return Teamo(conn, db='sqlite3')
+
+
+# 最初版本的图经upgrade()之后 与用当前版本直接建立的同一个图相比：遍历结果、label、度数与索引都相同
+# 位次的具体数值不同（升级时从0开始编号） 但沿每条链表都严格递增
+def check_upgrade() -> None:
+    fresh = new_gremlin_modern_graph()
+    g = fresh.traversal()
+    g.addE(3, 3).label('Knows')
+    g.addEs([ (2, 1, 'created', None), (2, 1), (6, 3, 'knows', '{"weight": 0.1}') ])
+    g.V(1).outE('created').drop()
+    g.E(8).label('likes')
+    graph = new_baseline_graph(fresh)
+    try:
+        graph.traversal().V().label()
+        shouldNotHappen('旧版本的图应当要求先调用upgrade()')
+    except Exception as e:
+        if 'upgrade()' not in str(e):
+            raise
+    if sqlite3.sqlite_version_info < (3, 35, 0):
+        try:
+            graph.upgrade()
+        except Exception as e:
+            if '3.35' not in str(e):
+                raise
+            return
+        shouldNotHappen('SQLite3低于3.35时upgrade()应当报错')
+    if not graph.upgrade() or graph.upgrade():
+        shouldNotHappen('upgrade()的返回值不正确')
+    def strip_ranks(chains: List[Tuple]) -> List[Tuple]:
+        for (vertex, *_, out_chain, in_chain) in chains:
+            for (chain, rank) in ((out_chain, -2), (in_chain, -1)):
+                ranks = [ edge[rank] for edge in chain ]
+                if None in ranks or ranks != sorted(set(ranks)):
+                    shouldNotHappen('点{}的链表上位次不是严格递增'.format(vertex))
+        return [ row[:-2] + ([ edge[:-2] for edge in row[-2] ], [ edge[:-2] for edge in row[-1] ]) for row in chains ]
+    def degree_rows(graph: Teamo) -> List[Tuple]:
+        c = graph.get_connection().cursor()
+        c.execute('''SELECT `vertex`, `label`, `out_degree`, `in_degree` FROM `Degree` WHERE `out_degree`>0 OR `in_degree`>0''')
+        return sorted((vertex, graph._decode_label(label), out_degree, in_degree) for (vertex, label, out_degree, in_degree) in c.fetchall())
+    if strip_ranks(dump_chains(graph)) != strip_ranks(dump_chains(fresh)):
+        shouldNotHappen('升级后的链表、label或度数与新建的图不一致')
+    if degree_rows(graph) != degree_rows(fresh):
+        shouldNotHappen('升级后Degree表与新建的图不一致')
+    if sorted(columns for (_, _, columns) in graph.list_indexes()) != sorted(columns for (_, _, columns) in fresh.list_indexes()):
+        shouldNotHappen('升级后的索引与新建的图不一致')
+    queries = [
+        lambda g: g.V().label(),
+        lambda g: g.E().label(),
+        lambda g: g.V().out().identity(),
+        lambda g: g.V().outE('knows', 'Knows').identity(),
+        lambda g: g.V().inE('created').identity(),
+        lambda g: g.V().bothE('likes').identity(),
+        lambda g: g.V().hasLabel('person').out().hasLabel('software').identity(),
+        lambda g: g.E().hasLabel('knows').inV().identity(),
+        lambda g: g.V().outDegree('knows'),
+        lambda g: g.V().bothDegree(),
+        lambda g: g.V(1, 2, 6).outE().range(1, 3).identity(),
+    ]
+    for compiled in (False, True):
+        if [ query(graph.traversal(compiled=compiled)) for query in queries ] != [ query(fresh.traversal()) for query in queries ]:
+            shouldNotHappen('升级后的遍历结果与新建的图不一致')
+
+
+# V()/E()起始时count/limit/range/hasLabel下推成一条SQL 边界情况与在Python中对完整结果切片/过滤得到的一致
+def check_count_pushdown() -> None:
+    graph = new_gremlin_modern_graph()
+    (vertex_rows, edge_rows) = dump_graph(graph)
+    vertices = [ row[0] for row in vertex_rows ]
+    edges = [ row[0] for row in edge_rows ]
+    persons = [ row[0] for row in vertex_rows if row[3] == 'person' ]
+    knows = [ row[0] for row in edge_rows if row[7] == 'knows' ]
+    outs = [ edge[1] for row in dump_chains(graph) for edge in row[5] ]
+    software_outs = [ v for v in outs if v in { row[0] for row in vertex_rows if row[3] == 'software' } ]
+    cases = [
+        ('range(0, 0)', lambda V, E: V().range(0, 0), []),
+        ('limit(0)', lambda V, E: V().limit(0), []),
+        ('E().limit(0)', lambda V, E: E().limit(0), []),
+        ('range(1, 4)', lambda V, E: V().range(1, 4), vertices[1:4]),
+        ('range(2, -1)', lambda V, E: V().range(2, -1), vertices[2:]),
+        ('range(n, n + 3)', lambda V, E: V().range(len(vertices), len(vertices) + 3), []),
+        ('range(n + 5, -1)', lambda V, E: V().range(len(vertices) + 5, -1), []),
+        ('E().range(n - 1, n + 10)', lambda V, E: E().range(len(edges) - 1, len(edges) + 10), edges[-1:]),
+        ('limit(n + 10)', lambda V, E: V().limit(len(vertices) + 10), vertices),
+        ('range(1, 5).range(1, 2)', lambda V, E: V().range(1, 5).range(1, 2), vertices[2:3]),
+        ("hasLabel('nosuch')", lambda V, E: V().hasLabel('nosuch'), []),
+        ("E().hasLabel('nosuch').limit(1)", lambda V, E: E().hasLabel('nosuch').limit(1), []),
+        ("hasLabel('nosuch', 'person')", lambda V, E: V().hasLabel('nosuch', 'person'), persons),
+        ("hasLabel('person').range(1, 3)", lambda V, E: V().hasLabel('person').range(1, 3), persons[1:3]),
+        ("hasLabel('person').range(10, -1)", lambda V, E: V().hasLabel('person').range(10, -1), []),
+        ("E().hasLabel('knows').limit(1)", lambda V, E: E().hasLabel('knows').limit(1), knows[:1]),
+        ("range(1, -1).hasLabel('person')", lambda V, E: V().range(1, -1).hasLabel('person'), [ v for v in persons if v != vertices[0] ]),
+        ('out()', lambda V, E: V().out(), outs),
+        ('out().range(1, 3)', lambda V, E: V().out().range(1, 3), outs[1:3]),
+        ('out().limit(0)', lambda V, E: V().out().limit(0), []),
+        ("out().hasLabel('software')", lambda V, E: V().out().hasLabel('software'), software_outs),
+        ("out().hasLabel('nosuch')", lambda V, E: V().out().hasLabel('nosuch'), []),
+    ]
+    for compiled in (False, True):
+        for chunk_size in (Teamo.QUERY_BATCH, 2):
+            g = graph.traversal(compiled=compiled, chunk_size=chunk_size)
+            # V()/E()走下推 V(ids)/E(ids)按块过滤与截取
+            for (V, E) in ((g.V, g.E), (lambda: g.V(*vertices), lambda: g.E(*edges))):
+                for (name, query, expected) in cases:
+                    if query(V, E).identity() != expected:
+                        shouldNotHappen('{} 结果不正确 compiled={}'.format(name, compiled))
+                    if query(V, E).count() != len(expected):
+                        shouldNotHappen('{}.count() 结果不正确 compiled={}'.format(name, compiled))
+
+
+# 编译模式与逐步执行的结果（包括顺序与重复）必须完全一致 两种存储布局、按块起始的情况都要覆盖
+def check_compiled(vertex_number: int = 200, edge_number: int = 1000) -> None:
+    queries = [
+        lambda g: g.V().out().identity(),
+        lambda g: g.V().in_('knows', 'created').identity(),
+        lambda g: g.V().both().both('knows').identity(),
+        lambda g: g.V().bothE().bothV().identity(),
+        lambda g: g.V().outE('knows').inV().out().identity(),
+        lambda g: g.E().hasLabel('created').outV().hasLabel('person').in_().identity(),
+        lambda g: g.V().both().out().dedup().identity(),
+        lambda g: g.V().out().out().count(),
+        lambda g: g.V().out().has('age', P.gt(25)).values('name', 'age'),
+        lambda g: g.V().outE().has('weight', P.lt(0.5)).values('weight'),
+        lambda g: g.V().hasLabel('software').in_().dedup().count(),
+        # 由若干点或不可编译的步骤的结果起始 每块一条SQL
+        lambda g: g.V(3, 1, 4, 15, 9).out().bothE().inV().identity(),
+        lambda g: g.V(3, 1, 4, 15, 9).both().both().dedup().identity(),
+        lambda g: g.V().out().limit(50).out('knows').values('name'),
+        lambda g: g.V().in_().range(10, 80).outE().outV().count(),
+        lambda g: g.V().out().label(),
+    ]
+    for layout in Teamo.LAYOUTS:
+        random.seed('pyGraph')
+        graph = Teamo(sqlite3.connect(':memory:'), db='sqlite3', layout=layout)
+        graph.init()
+        g = graph.traversal()
+        g.addVs([ (random.choice([ 'person', 'software' ]), json.dumps({ 'name': 'v{}'.format(i), 'age': random.randint(1, 50) }))
+            for i in range(vertex_number) ])
+        g.addEs([ (random.randint(1, vertex_number), random.randint(1, vertex_number),
+            random.choice([ 'knows', 'created', None ]), json.dumps({ 'weight': random.random() }))
+            for _ in range(edge_number) ])
+        for chunk_size in (Teamo.QUERY_BATCH, 7):
+            eager = graph.traversal(chunk_size=chunk_size)
+            compiled = graph.traversal(chunk_size=chunk_size, compiled=True)
+            for (i, query) in enumerate(queries):
+                if query(compiled) != query(eager):
+                    shouldNotHappen('{}布局 chunk_size={} 第{}个查询 编译模式与逐步执行的结果不一致'.format(layout, chunk_size, i))
+
+
+# 各种批量/按块的做法与逐个元素的原始做法的结果必须一致
+def equivalence_test_on_gremlin_modern_graph() -> None:
+    print('基于gremlin modern graph的等价性测试 Running...')
+    check_chain_walk(new_gremlin_modern_graph())
+    check_edge_endpoints(new_gremlin_modern_graph())
+    check_fused_neighbor(new_gremlin_modern_graph())
+    check_chunked_pipeline(new_gremlin_modern_graph())
+    check_batched_properties()
+    check_write_batch()
+    check_bulk_edges()
+    check_import_edge_list()
+    check_splice_chains()
+    check_bulk_drop()
+    check_layouts()
+    check_degrees()
+    check_indexes()
+    check_snapshot()
+    check_property_cache()
+    check_property_index()
+    check_compact()
+    check_label_case()
+    check_upgrade()
+    check_count_pushdown()
+    check_compiled()
     print('Pass!')
 
 
@@ -474,21 +1169,432 @@ def query_test_on_big_sparse_graph(conn, db: str) -> None:
     print('基于 “一千万个点与平均出度为十（一亿条边）的稀疏图” 的只读测试 Running...')
     graph = Teamo(conn, db=db)
     g = graph.traversal()
-    g.V()
+    # 遍历是惰性的 以count()结束才会真正扫描一遍点表
+    if g.V().count() == 0:
+        shouldNotHappen('图中没有点')
 
 
 # FN(Find Neighbor), 遍历所有vertex, 根据vertex查邻接edge, 通过edge和vertex查other vertex
-def find_neighbor(conn, db: str):
+# 每条边恰好给出一个邻接点 返回邻接点的个数
+def find_neighbor(conn, db: str) -> int:
     graph = Teamo(conn, db=db)
     g = graph.traversal()
-    g.V().out()
+    neighbor_number = g.V().out().count()
+    if neighbor_number != g.E().count():
+        shouldNotHappen('FN的邻接点个数与边数不一致')
+    return neighbor_number
 
 
 # FA(Find Adjacent), 遍历所有edge，根据edge获得source vertex和target vertex
-def find_adjacent(conn, db: str):
+# 每条边给出两个端点 返回端点的个数
+def find_adjacent(conn, db: str) -> int:
     graph = Teamo(conn, db=db)
     g = graph.traversal()
-    g.E().bothV()
+    vertex_number = g.E().bothV().count()
+    if vertex_number != 2 * g.E().count():
+        shouldNotHappen('FA的端点个数不是边数的两倍')
+    return vertex_number
+
+
+# 随机图：vertex_number个点 edge_number条随机边 给出labels时点/边的label从中随机选取
+# 随机数种子固定 同样的参数总是生成同样的图
+def generate_random_graph(conn, db: str, vertex_number: int, edge_number: int, *, layout: Optional[str] = None,
+        with_index: bool = True, vertex_labels: Sequence[str] = (), edge_labels: Sequence[str] = ()) -> Teamo:
+    random.seed('pyGraph')
+    graph = Teamo(conn, db=db, layout=layout)
+    graph.destroy()
+    graph.init(with_index=with_index)
+    g = graph.traversal()
+    if vertex_labels:
+        g.addVs(labels=[ random.choice(vertex_labels) for _ in range(vertex_number) ])
+    else:
+        g.addVs(vertex_number)
+    label = (lambda: (random.choice(edge_labels),)) if edge_labels else (lambda: ())
+    g.addEs([ (random.randint(1, vertex_number), random.randint(1, vertex_number)) + label() for _ in range(edge_number) ])
+    return graph
+
+
+# 图的全部内容：点表与边表的所有行（含十字链表指针，label解码为字符串，不含位次） 用于比较两种做法得到的图是否完全一致
+def dump_graph(graph: Teamo) -> Tuple[List[Tuple], List[Tuple]]:
+    c = graph.get_connection().cursor()
+    c.execute('''SELECT `id`, `out_edge`, `in_edge`, `label`, `data` FROM Vertex ORDER BY `id`''')
+    vertices = [ row[:3] + (graph._decode_label(row[3]), row[4]) for row in c.fetchall() ]
+    c.execute('''SELECT `id`, `tail`, `head`, `backward`, `forward`, `revback`, `revfor`, `label`, `data` FROM Edge ORDER BY `id`''')
+    edges = [ row[:7] + (graph._decode_label(row[7]), row[8]) for row in c.fetchall() ]
+    return (vertices, edges)
+
+
+# 所有Benchmark共用：依次进入modes中的每种模式（(名称, 进入该模式前的准备 或None)），在其中执行一遍queries并计时
+# queries中每项为 (名称, 查询) 或 (名称, 模式一下的查询, 模式二下的查询, ...)
+# 同一个查询在各模式下的结果必须一致（normalize不为None时先规整再比较） 否则说明某种做法有错
+def benchmark(title: str, modes: Sequence[Tuple[str, Optional[Callable[[], Any]]]],
+        queries: Sequence[Tuple], *, normalize: Optional[Callable[[Any], Any]] = None, width: int = 44) -> None:
+    print('{} Benchmark Running...'.format(title))
+    timing = {}
+    results = {}
+    for (i, (mode, prepare)) in enumerate(modes):
+        if prepare is not None:
+            prepare()
+        for (name, *query) in queries:
+            run = query[i] if len(query) > 1 else query[0]
+            t = time.time()
+            result = run()
+            timing[(name, mode)] = time.time() - t
+            results[(name, mode)] = result if normalize is None else normalize(result)
+    for (name, *_) in queries:
+        print('{:{}} {}'.format(name, width, '    '.join('{} {:8.3f}s'.format(mode, timing[(name, mode)])
+            for (mode, _) in modes)))
+        if any(results[(name, mode)] != results[(name, modes[0][0])] for (mode, _) in modes):
+            shouldNotHappen('{} 在不同模式下的结果不一致'.format(name))
+
+
+# 对比有无二级索引时 hasLabel 与邻接点查询的耗时
+def benchmark_index(conn, db: str, vertex_number: int, edge_number: int):
+    graph = generate_random_graph(conn, db, vertex_number, edge_number, with_index=False)
+    g = graph.traversal()
+    # 百分之一的点为software 百分之一的边为knows
+    with graph.batch():
+        g.V().label('person')
+        g.V(*range(100, vertex_number + 1, 100)).label('software')
+        g.E().label('created')
+        g.E(*range(100, edge_number + 1, 100)).label('knows')
+    sample = random.sample(range(1, vertex_number + 1), min(vertex_number, 10000))
+    def create_indexes():
+        for (table, *columns) in Teamo.DEFAULT_INDEXES:
+            graph.create_index(table, *columns)
+    benchmark('二级索引', [ ('无索引', None), ('有索引', create_indexes) ], [
+        ("g.V().hasLabel('software')", lambda: g.V().hasLabel('software').identity()),
+        ("g.E().hasLabel('knows')", lambda: g.E().hasLabel('knows').identity()),
+        ("g.V(<10000>).out()", lambda: g.V(*sample).out().identity()),
+        ("g.V(<10000>).in_('knows')", lambda: g.V(*sample).in_('knows').identity()),
+    ])
+
+
+# 对比直接查询数据库与在内存CSR快照上执行FN、FA的耗时 并输出快照占用的内存
+def benchmark_snapshot(conn, db: str):
+    graph = Teamo(conn, db=db)
+    t = time.time()
+    snapshot = graph.snapshot()
+    print('构建快照: {} 个点 {} 条边 {:.2f}s 占用内存 {:.1f}MB'.format(snapshot.vertex_number(),
+        snapshot.edge_number(), time.time() - t, snapshot.memory_usage() / 1024 / 1024))
+    g = graph.traversal()
+    gs = graph.traversal(snapshot=snapshot)
+    benchmark('CSR快照', [ ('SQL', None), ('快照', None) ], [
+        ('FN g.V().out()', lambda: g.V().out().identity(), lambda: gs.V().out().identity()),
+        ('FA g.E().bothV()', lambda: g.E().bothV().identity(), lambda: gs.E().bothV().identity()),
+    ], width=20)
+
+
+# 对比逐条自动提交与写入批次中的单条加边吞吐量
+def benchmark_batch(conn, db: str, vertex_number: int, edge_number: int):
+    random.seed('pyGraph')
+    graph = Teamo(conn, db=db)
+    g = graph.traversal()
+    edges = [ (random.randint(1, vertex_number), random.randint(1, vertex_number)) for _ in range(edge_number) ]
+    def rebuild():
+        graph.destroy()
+        graph.init()
+        g.addVs(vertex_number)
+    def add_edges(batch):
+        with batch:
+            for (from_vertex, to_vertex) in edges:
+                g.addE(from_vertex, to_vertex)
+        return g.V().out().identity()
+    benchmark('写入批次', [ ('autocommit', rebuild), ('batch()', rebuild), ('batch(commit_every=1000)', rebuild) ], [
+        ('addE x {}'.format(edge_number), lambda: add_edges(contextlib.nullcontext()), lambda: add_edges(graph.batch()),
+            lambda: add_edges(graph.batch(commit_every=1000))),
+    ], width=20)
+
+
+# 批量加边时在内存中构建十字链表的峰值内存（每条边多少字节）
+def benchmark_add_edge_memory(conn, db: str, vertex_number: int, edge_number: int):
+    print('批量加边内存 Benchmark Running...')
+    random.seed('pyGraph')
+    graph = Teamo(conn, db=db)
+    graph.destroy()
+    graph.init()
+    g = graph.traversal()
+    g.addVs(vertex_number)
+    edges = [ (random.randint(1, vertex_number), random.randint(1, vertex_number)) for _ in range(edge_number) ]
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    t = time.time()
+    g.addEs(edges)
+    elapsed = time.time() - t
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    print('{} 个点 {} 条边: 峰值 {:.1f}MB  {:.0f} 字节/边  {:.2f}s'.format(vertex_number, edge_number,
+        peak / 1024 / 1024, peak / edge_number, elapsed))
+
+
+# 反复读取同一批热点点的data时 有无label/data缓存的耗时
+def benchmark_cache(conn, db: str, vertex_number: int, hot_number: int, rounds: int):
+    random.seed('pyGraph')
+    graph = Teamo(conn, db=db)
+    graph.destroy()
+    graph.init()
+    graph.traversal().addVs(datas=[ '{{"name":"v{}"}}'.format(i) for i in range(vertex_number) ])
+    hot = random.sample(range(1, vertex_number + 1), hot_number)
+    # 每种模式换一个带不同大小缓存的Teamo实例
+    current = {}
+    def use_cache(cache_size):
+        current['graph'] = Teamo(conn, db=db, cache_size=cache_size)
+    benchmark('属性缓存', [ ('cache_size=0', lambda: use_cache(0)), ('cache_size={}'.format(hot_number), lambda: use_cache(hot_number)) ], [
+        ('g.V(<hot>).data()', lambda: [ current['graph'].traversal().V(*hot).data() for _ in range(rounds) ]),
+        ('逐个读取', lambda: [ [ current['graph']._get_vertex_data(v) for v in hot ] for _ in range(rounds) ]),
+    ], width=20)
+
+
+# values()/valueMap()的耗时：下推json取值 与 缓存解析后的data
+def benchmark_values(conn, db: str, vertex_number: int, rounds: int):
+    graph = Teamo(conn, db=db)
+    graph.destroy()
+    graph.init()
+    # 每个点除了name与age之外还带有一段较大的描述
+    graph.traversal().addVs(datas=[ json.dumps({ 'name': 'v{}'.format(i), 'age': i % 90, 'bio': 'x' * 512 })
+        for i in range(vertex_number) ])
+    current = {}
+    def use_cache(cache_size):
+        current['g'] = Teamo(conn, db=db, cache_size=cache_size).traversal()
+    benchmark('属性投影', [ ('cache_size=0', lambda: use_cache(0)),
+            ('cache_size={}'.format(vertex_number), lambda: use_cache(vertex_number)) ], [
+        ('values(name, age)', lambda: [ current['g'].V().values('name', 'age') for _ in range(rounds) ]),
+        ('data()+json.loads', lambda: [ [ (props['name'], props['age']) for props in map(json.loads, current['g'].V().data()) ]
+            for _ in range(rounds) ]),
+    ], width=20)
+
+
+# has()下推到数据库 与 取出全部data在Python中过滤 的耗时对比（沿用benchmark_values建好的图）
+def benchmark_has(conn, db: str):
+    g = Teamo(conn, db=db).traversal()
+    benchmark('属性过滤', [ ('下推', None), ('Python中过滤', None) ], [
+        ("g.V().has('age', P.gt(85))", lambda: g.V().has('age', P.gt(85)).identity(),
+            lambda: [ v for v, d in zip(g.V().identity(), g.V().data()) if json.loads(d)['age'] > 85 ]),
+        ("g.V().has('name', 'v42')", lambda: g.V().has('name', 'v42').identity(),
+            lambda: [ v for v, d in zip(g.V().identity(), g.V().data()) if json.loads(d)['name'] == 'v42' ]),
+    ], width=30)
+
+
+# 对比建立属性索引前后 g.V().has(key, value) 点查的耗时 图中的点需带有name属性（如 v0, v1, ...）
+def benchmark_property_index(conn, db: str, times: int = 100):
+    graph = Teamo(conn, db=db)
+    g = graph.traversal()
+    vertex_count = g.V().count()
+    names = [ 'v{}'.format(random.randrange(vertex_count)) for _ in range(times) ]
+    benchmark('属性索引', [ ('无索引', None), ('有索引', lambda: graph.create_property_index('Vertex', 'name')) ], [
+        ('{}次点查'.format(times), lambda: [ g.V().has('name', name).identity() for name in names ]),
+    ], width=20)
+    graph.drop_property_index('Vertex', 'name')
+
+
+# 对比逐个删除与批量删除同一组点（及其邻接边）的耗时 两种做法删除后的图必须一致
+def benchmark_drop(conn, db: str, vertex_number: int, edge_number: int, drop_number: int):
+    random.seed('pyGraph')
+    dropped = random.sample(range(1, vertex_number + 1), drop_number)
+    rebuild = lambda: generate_random_graph(conn, db, vertex_number, edge_number)
+    graph = Teamo(conn, db=db)
+    g = graph.traversal()
+    def drop_one_by_one():
+        for v in dropped:
+            graph._remove_vertex(v)
+        return dump_graph(graph)
+    def drop_in_batch():
+        g.V(*dropped).drop()
+        return dump_graph(graph)
+    benchmark('批量删除', [ ('逐个删除', rebuild), ('批量删除', rebuild) ], [
+        ('drop {} 个点'.format(drop_number), drop_one_by_one, drop_in_batch),
+    ], width=20)
+    dropped = set(dropped)
+    if any(tail in dropped or head in dropped for (tail, head) in graph._get_vertex_of_all_edge()):
+        shouldNotHappen('批量删除后仍有边连着被删除的点')
+
+
+# 对比整理边表(compact)前后冷缓存下FN(Find Neighbor)的耗时 只适用于SQLite3数据库文件
+# 边分成许多小批次插入 每个点的出边链表散落在整张边表中；每次计时前用posix_fadvise清掉文件的系统页缓存
+def benchmark_compact(path: str, vertex_number: int, edge_number: int, sample_number: int = 10000):
+    random.seed('pyGraph')
+    conn = sqlite3.connect(path)
+    graph = Teamo(conn, db='sqlite3')
+    graph.destroy()
+    graph.init()
+    g = graph.traversal()
+    g.addVs(vertex_number)
+    edges = [ (random.randint(1, vertex_number), random.randint(1, vertex_number)) for _ in range(edge_number) ]
+    for i in range(0, edge_number, 1000):
+        g.addEs(edges[i:(i + 1000)])
+    conn.close()
+    sample = random.sample(range(1, vertex_number + 1), min(vertex_number, sample_number))
+    def find_neighbor_cold():
+        with open(path, 'rb') as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        conn = sqlite3.connect(path)
+        result = Teamo(conn, db='sqlite3').traversal().V(*sample).out().identity()
+        conn.close()
+        return result
+    def compact():
+        conn = sqlite3.connect(path)
+        Teamo(conn, db='sqlite3').compact()
+        conn.close()
+    size_before = os.path.getsize(path)
+    benchmark('整理边表', [ ('整理前', None), ('整理后', compact) ], [
+        ('FN({}个点)'.format(len(sample)), find_neighbor_cold),
+    ], width=20)
+    print('文件 {:.1f}MB -> {:.1f}MB'.format(size_before / 2 ** 20, os.path.getsize(path) / 2 ** 20))
+
+
+# 对比两种存储布局（十字链表linked / 按点聚簇的clustered）的插入与FN、FA的耗时
+def benchmark_layout(conn, db: str, vertex_number: int, edge_number: int, single_number: int = 10000):
+    random.seed('pyGraph')
+    edges = [ (random.randint(1, vertex_number), random.randint(1, vertex_number)) for _ in range(edge_number) ]
+    current = {}
+    def use_layout(layout):
+        graph = Teamo(conn, db=db, layout=layout)
+        graph.destroy()
+        graph.init()
+        graph.traversal().addVs(vertex_number)
+        current['graph'] = graph
+    def add_edges_in_bulk():
+        current['graph'].traversal().addEs(edges)
+    def add_edges_one_by_one():
+        g = current['graph'].traversal()
+        with g.batch():
+            for (from_vertex, to_vertex) in edges[:single_number]:
+                g.addE(from_vertex, to_vertex)
+    # 两种布局中每个点的边的先后顺序不同 只比较结果的多重集
+    benchmark('存储布局', [ (layout, lambda layout=layout: use_layout(layout)) for layout in Teamo.LAYOUTS ], [
+        ('addEs {} 条边'.format(edge_number), add_edges_in_bulk),
+        ('addE {} 条边'.format(single_number), add_edges_one_by_one),
+        ('FN g.V().out()', lambda: current['graph'].traversal().V().out().identity()),
+        ('FA g.E().bothV()', lambda: current['graph'].traversal().E().bothV().identity()),
+    ], normalize=lambda result: None if result is None else sorted(result), width=20)
+
+
+# 少量不同label的大图上 按label过滤的耗时与数据库文件大小 只适用于SQLite3数据库文件
+def benchmark_label(path: str, vertex_number: int, edge_number: int):
+    conn = sqlite3.connect(path)
+    graph = generate_random_graph(conn, 'sqlite3', vertex_number, edge_number,
+        vertex_labels=[ 'person', 'software', 'organization' ], edge_labels=[ 'knows', 'created', 'belongs_to', 'follows' ])
+    g = graph.traversal()
+    conn.execute('VACUUM')
+    benchmark('label编码', [ ('', None) ], [
+        ("g.V().hasLabel('software')", lambda: g.V().hasLabel('software').identity()),
+        ("g.V().outE('knows')", lambda: g.V().outE('knows').identity()),
+        ("g.V().out('knows', 'created')", lambda: g.V().out('knows', 'created').identity()),
+        ("g.E().label()", lambda: g.E().label()),
+    ], width=32)
+    print('文件大小 {:.1f}MB'.format(os.path.getsize(path) / 2 ** 20))
+    conn.close()
+
+
+# 对比沿链表过滤label与按 (所属点, label, 位次) 索引取边的耗时
+# hub_number个点各有hub_degree条created出边和3条knows出边 其余的边随机分布
+def benchmark_rank(conn, db: str, vertex_number: int, edge_number: int, hub_number: int = 100, hub_degree: int = 50000):
+    graph = generate_random_graph(conn, db, vertex_number, edge_number, edge_labels=[ 'knows', 'created' ])
+    g = graph.traversal()
+    hubs = random.sample(range(1, vertex_number + 1), hub_number)
+    edges = [ (hub, random.randint(1, vertex_number), 'created') for hub in hubs for _ in range(hub_degree) ]
+    edges += [ (hub, random.randint(1, vertex_number), 'knows') for hub in hubs for _ in range(3) ]
+    random.shuffle(edges)
+    g.addEs(edges)
+    sample = random.sample(range(1, vertex_number + 1), min(vertex_number, 10000))
+    def use_rank_index(with_rank):
+        for (key_column, rank_column) in Teamo.RANK_COLUMNS.values():
+            if with_rank:
+                graph.create_index('Edge', key_column, 'label', rank_column)
+                graph.drop_index('Edge', key_column)
+            else:
+                graph.create_index('Edge', key_column)
+                graph.drop_index('Edge', key_column, 'label', rank_column)
+    benchmark('点为中心的label索引', [ ('沿链表', lambda: use_rank_index(False)), ('位次索引', lambda: use_rank_index(True)) ], [
+        ("g.V(<hub>).outE('knows') 逐个", lambda: [ graph._get_out_edge_by_label(hub, [ 'knows' ]) for hub in hubs ]),
+        ("g.V(<hub>).out('knows')", lambda: g.V(*hubs).out('knows').identity()),
+        ("g.V(<10000>).in_('knows')", lambda: g.V(*sample).in_('knows').identity()),
+    ], width=32)
+
+
+# 对比维护的度数与数邻接边得到的度数的耗时 并输出批量加边的耗时（含度数维护）
+def benchmark_degree(conn, db: str, vertex_number: int, edge_number: int, sample_number: int = 10000):
+    t = time.time()
+    graph = generate_random_graph(conn, db, vertex_number, edge_number, edge_labels=[ 'knows', 'created' ])
+    print('建图（含度数维护） {} 条边 {:.2f}s'.format(edge_number, time.time() - t))
+    g = graph.traversal()
+    sample = random.sample(range(1, vertex_number + 1), min(vertex_number, sample_number))
+    benchmark('度数', [ ('数邻接边', None), ('维护的度数', None) ], [
+        ('bothDegree()', lambda: [ len(g.V(v).bothE().identity()) for v in sample ], lambda: g.V(*sample).bothDegree()),
+        ("outDegree('knows')", lambda: [ len(g.V(v).outE('knows').identity()) for v in sample ],
+            lambda: g.V(*sample).outDegree('knows')),
+    ], width=24)
+
+
+# 对比取出全部id后再计数/切片与count()/limit()/range()的耗时
+def benchmark_count(conn, db: str, vertex_number: int, edge_number: int):
+    graph = generate_random_graph(conn, db, vertex_number, edge_number, vertex_labels=[ 'person', 'software' ])
+    g = graph.traversal()
+    benchmark('count/limit/range', [ ('取出全部id', None), ('下推/截取', None) ], [
+        ("g.V().hasLabel('person').count()", lambda: len(g.V().hasLabel('person').identity()),
+            lambda: g.V().hasLabel('person').count()),
+        ('g.E().count()', lambda: len(g.E().identity()), lambda: g.E().count()),
+        ("g.V().hasLabel('person').limit(10)", lambda: g.V().hasLabel('person').identity()[:10],
+            lambda: g.V().hasLabel('person').limit(10).identity()),
+        ("g.V().hasLabel('person').range(10000, 10010)", lambda: g.V().hasLabel('person').identity()[10000:10010],
+            lambda: g.V().hasLabel('person').range(10000, 10010).identity()),
+        ('g.V().out().limit(10)', lambda: g.V().out().identity()[:10], lambda: g.V().out().limit(10).identity()),
+    ])
+
+
+# 多跳遍历 逐步执行与编译成一条SQL的耗时对比
+def benchmark_compiled(conn, db: str, vertex_number: int, edge_number: int):
+    graph = generate_random_graph(conn, db, vertex_number, edge_number,
+        vertex_labels=[ 'person', 'software' ], edge_labels=[ 'knows', 'created' ])
+    g = graph.traversal()
+    compiled = graph.traversal(compiled=True)
+    starts = random.sample(range(1, vertex_number + 1), 100)
+    queries = [
+        ("g.V().hasLabel('person').out('knows').count()", lambda g: g.V().hasLabel('person').out('knows').count()),
+        ('g.V(<100>).out().out().count()', lambda g: g.V(*starts).out().out().count()),
+        ('g.V(<100>).both().both().dedup().count()', lambda g: g.V(*starts).both().both().dedup().count()),
+        ("g.V(<100>).out('knows').out().values('name')", lambda g: g.V(*starts).out('knows').out().values('name')),
+        ("g.V().hasLabel('software').in_('created').dedup().count()",
+            lambda g: g.V().hasLabel('software').in_('created').dedup().count()),
+    ]
+    benchmark('遍历编译', [ ('逐步执行', None), ('编译', None) ],
+        [ (name, lambda query=query: query(g), lambda query=query: query(compiled)) for (name, query) in queries ], width=58)
+
+
+# 以较小的规模依次运行所有Benchmark 每个Benchmark都会检查各模式下的结果一致
+def run_benchmarks(vertex_number: int = 10000, edge_number: int = 50000):
+    conn = sqlite3.connect(':memory:')
+    benchmark_index(conn, 'sqlite3', vertex_number, edge_number)
+    benchmark_snapshot(conn, 'sqlite3')
+    benchmark_batch(conn, 'sqlite3', vertex_number // 10, edge_number // 10)
+    benchmark_add_edge_memory(conn, 'sqlite3', vertex_number, edge_number)
+    benchmark_cache(conn, 'sqlite3', vertex_number, vertex_number // 100, 10)
+    benchmark_values(conn, 'sqlite3', vertex_number, 3)
+    benchmark_has(conn, 'sqlite3')
+    benchmark_property_index(conn, 'sqlite3')
+    benchmark_drop(conn, 'sqlite3', vertex_number, edge_number, vertex_number // 10)
+    benchmark_layout(conn, 'sqlite3', vertex_number, edge_number, edge_number // 10)
+    benchmark_rank(conn, 'sqlite3', vertex_number, edge_number, 10, edge_number // 10)
+    benchmark_degree(conn, 'sqlite3', vertex_number, edge_number)
+    benchmark_count(conn, 'sqlite3', vertex_number, edge_number)
+    benchmark_compiled(conn, 'sqlite3', vertex_number, edge_number)
+    conn.close()
+    # 以下两个需要数据库文件
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark_compact(os.path.join(directory, 'compact.sqlite'), vertex_number, edge_number)
+        benchmark_label(os.path.join(directory, 'label.sqlite'), vertex_number, edge_number)
+
+
+# 在内存数据库上对逐条构建与批量构建的Gremlin Modern Graph各运行一遍只读测试、FN/FA与修改测试
+def modern_graph_test() -> None:
+    for generate in (generate_gremlin_modern_graph, generate_gremlin_modern_graph_in_branch):
+        conn = sqlite3.connect(':memory:')
+        generate(conn, 'sqlite3')
+        query_test_on_gremlin_modern_graph(conn, 'sqlite3')
+        find_neighbor(conn, 'sqlite3')
+        find_adjacent(conn, 'sqlite3')
+        modify_test_on_greamlin_modern_graph(conn, 'sqlite3')
+        conn.close()
 
 
 def test_mini():
@@ -499,7 +1605,12 @@ def test_mini():
     sqlite_conn.close()
 
 
-def main():
+# 默认只运行正确性测试（都在内存数据库上 不产生文件） with_benchmarks为True时（python test.py --benchmark）再运行所有Benchmark
+def main(with_benchmarks: bool = False):
+    modern_graph_test()
+    equivalence_test_on_gremlin_modern_graph()
+    if with_benchmarks:
+        run_benchmarks()
     # sqlite_mysql_read_write_test()
     # test_mini()
     # mysql_conn = pymysql.connect(host='localhost', port=3306,
@@ -512,7 +1623,7 @@ def main():
     # sqlite_conn = sqlite3.connect('email-enron.sqlite')
     # sqlite_conn = sqlite3.connect('com-youtube-ungraph.sqlite')
     # sqlite_conn = sqlite3.connect('gremlin_modern_graph.sqlite')
-    sqlite_conn = sqlite3.connect('storage/tmp.sqlite')
+    # sqlite_conn = sqlite3.connect('storage/tmp.sqlite')
     # generate_com_lj_ungraph_graph_in_branch(sqlite_conn, 'sqlite3')
     # generate_email_enron_graph_in_branch(sqlite_conn, 'sqlite3')
     # generate_amazon0601_graph_in_branch(sqlite_conn, 'sqlite3')
@@ -531,10 +1642,10 @@ def main():
     # generate_com_lj_ungraph_graph(sqlite_conn, 'sqlite3')
     # find_neighbor(sqlite_conn, 'sqlite3')
     # find_adjacent(sqlite_conn, 'sqlite3')
-    sqlite_conn.close()
+    # sqlite_conn.close()
 
 if __name__ == "__main__":
     t = time.time()
-    main()
+    main(with_benchmarks='--benchmark' in sys.argv[1:])
     elapsed = time.time() - t
     print('Time waste: {} => {:.2f}s'.format(datetime.timedelta(seconds=elapsed), elapsed))